@@ -0,0 +1,274 @@
+"""オフライン E2E ベンチマーク (AppTest + 偽の Gemini / 検索)
+
+    python -m bench.bench_e2e [--repeat N] [--json out.json] [--baseline old.json] [--tolerance 0.25]
+                              [--llm-latency S] [--chunk-delay S] [--response-chars N]
+                              [--search-latency S] [--search-body N] [--images N] [--rows N]
+
+app.py / app_pro.py / research.py を AppTest で動かす。Gemini は core.llm_executor.FakeGemini、
+検索は core.search.FakeSearchBackend に差し替え、遅延と応答の大きさは引数で変える。
+キャッシュ・患者データ・trace は一時ディレクトリに置き、応答キャッシュは切る (KS_LLM_MODE=off)。
+
+シナリオ
+  trend_1000   app_pro: 1,000 行の履歴で初回描画・再実行・診断
+  images_20    app_pro: 画像 20 枚をアップロードして診断 (first は縮小・再圧縮、以降は画像キャッシュ)
+  long_search  research / app: 本文の長い検索結果での検索 & 分析・診断
+  rapid_edits  app_pro / app: 入力欄を続けて書き換える (1回ごとに全体を再実行)
+計測値
+  rerun の p50 / p95 / max (ms)、1回目 (first_ms)
+  メモリ peak: 計測とは別の1回を tracemalloc 付きで実行した間の最大増加 (MB)
+  送信バイト数: 1回の実行でブラウザへ送る ForwardMsg の合計 (bytes_sent)
+--baseline を渡すと p50 / peak / bytes_sent が tolerance を超えて悪化したシナリオを挙げ、終了コード 1 で終わる。
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRETS = {"GEMINI_API_KEY": "bench"}
+
+
+def _isolate(tmp):
+    """core を読み込む前に環境変数を決める (利用者が指定した値は優先)"""
+    for name, value in {
+        "KS_CACHE_DIR": os.path.join(tmp, "cache"),
+        "KS_DATA_DIR": os.path.join(tmp, "data"),
+        "KS_TRACE_LOG": "off",
+        "KS_LLM_BACKEND": "fake",
+        "KS_SEARCH_BACKEND": "fake",
+        "KS_LLM_MODE": "off",
+        # 偽のバックエンドを手元のレート制限で待たせない
+        "KS_LLM_RPM": "1000000", "KS_LLM_BURST": "1000000",
+        "KS_SEARCH_RPM": "1000000", "KS_SEARCH_BURST": "1000000",
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+class ByteCounter:
+    """AppTest のスクリプト実行がキューに積む ForwardMsg (= ブラウザへの送信) のバイト数"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.messages = 0
+
+    def install(self):
+        from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+        original = ForwardMsgQueue.enqueue
+        counter = self
+
+        def enqueue(queue, msg):
+            counter.bytes += msg.ByteSize()
+            counter.messages += 1
+            return original(queue, msg)
+
+        ForwardMsgQueue.enqueue = enqueue
+
+    def reset(self):
+        self.bytes = 0
+        self.messages = 0
+
+
+# ==========================================
+# 入力データ
+# ==========================================
+def make_images(n, size=(2000, 1500), seed=0):
+    """スマホ写真程度の JPEG (グラデーション + ノイズ、1枚ずつ内容が違う)"""
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    w, h = size
+    grad = np.add.outer(np.linspace(0, 160, h), np.linspace(0, 80, w))
+    files = []
+    for i in range(n):
+        pixels = np.stack([grad + 20 * i % 60, grad[::-1], grad[:, ::-1]], axis=-1)
+        pixels = pixels + rng.normal(0, 12, pixels.shape)
+        buf = io.BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buf, "JPEG", quality=90)
+        files.append((f"photo_{i + 1:02d}.jpg", buf.getvalue(), "image/jpeg"))
+    return files
+
+
+# ==========================================
+# 操作
+# ==========================================
+def _app(name, rows):
+    from streamlit.testing.v1 import AppTest
+    from bench.bench_rerun import make_store
+
+    def factory():
+        at = AppTest.from_file(os.path.join(ROOT, name), default_timeout=300)
+        at.secrets.update(SECRETS)
+        at.session_state["patient_db"] = make_store(rows)
+        return at
+    return factory
+
+
+def _click(label):
+    def action(at, i):
+        at.button[[b.label for b in at.button].index(label)].click()
+    return action
+
+
+def _edit(key):
+    def action(at, i):
+        at.number_input(key=key).set_value(60.0 + i)
+    return action
+
+
+def _noop(at, i):
+    pass
+
+
+def _upload(files):
+    def setup(at):
+        [u for u in at.file_uploader if u.accept_multiple_files][0].set_value(files)
+    return setup
+
+
+def _check(at, name):
+    if at.exception:
+        raise RuntimeError(f"{name}: {[e.value for e in at.exception]}")
+
+
+def run_case(name, factory, action, repeat, counter, setup=None, fresh=False):
+    """action → run() を repeat 回計測し、最後に tracemalloc 付きで1回"""
+
+    def prepared():
+        at = factory()
+        at.run()
+        _check(at, name)
+        if setup:
+            setup(at)
+        return at
+
+    samples, sent = [], []
+    at = None
+    for i in range(repeat):
+        if fresh:
+            # 初回描画: 毎回新しいセッション
+            at = factory()
+            if setup:
+                setup(at)
+        else:
+            at = at or prepared()
+            action(at, i)
+        counter.reset()
+        t0 = time.perf_counter()
+        at.run()
+        samples.append((time.perf_counter() - t0) * 1000)
+        sent.append(counter.bytes)
+        _check(at, name)
+
+    at = factory() if fresh else at
+    if not fresh:
+        action(at, repeat)
+    tracemalloc.start()
+    try:
+        at.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    _check(at, name)
+
+    return {
+        "runs": len(samples),
+        "first_ms": round(samples[0], 1),
+        "p50_ms": round(statistics.median(samples), 1),
+        "p95_ms": round(float(np.percentile(samples, 95)), 1),
+        "max_ms": round(max(samples), 1),
+        "peak_mb": round(peak / 2 ** 20, 2),
+        "bytes_sent": int(statistics.median(sent)),
+    }
+
+
+def scenarios(args):
+    images = make_images(args.images)
+    rows = args.rows
+    pro_run, stable_run, research_run = "🚀 EXECUTE AI DIAGNOSIS", "🔍 診断実行", "🚀 検索 & 分析開始"
+    return [
+        ("trend_1000/first_render", _app("app_pro.py", rows), _noop, None, True),
+        ("trend_1000/rerun", _app("app_pro.py", rows), _noop, None, False),
+        ("trend_1000/diagnose", _app("app_pro.py", rows), _click(pro_run), None, False),
+        ("images_20/diagnose", _app("app_pro.py", rows), _click(pro_run), _upload(images), False),
+        ("long_search/research", _app("research.py", rows), _click(research_run), None, False),
+        ("long_search/app", _app("app.py", rows), _click(stable_run), None, False),
+        ("rapid_edits/app_pro", _app("app_pro.py", rows), _edit("vital_in_PaO2"), None, False),
+        ("rapid_edits/app", _app("app.py", rows), _edit("n_pao2"), None, False),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """baseline より tolerance を超えて悪化した (シナリオ, 指標, 旧, 新)"""
+    worse = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            continue
+        for metric in ("p50_ms", "peak_mb", "bytes_sent"):
+            if b.get(metric) and r[metric] > b[metric] * (1 + tolerance):
+                worse.append((name, metric, b[metric], r[metric]))
+    return worse
+
+
+def main(argv):
+    p = argparse.ArgumentParser(prog="python -m bench.bench_e2e")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--rows", type=int, default=1000)
+    p.add_argument("--images", type=int, default=20)
+    p.add_argument("--llm-latency", type=float, default=0.2, help="最初のテキスト片までの秒数")
+    p.add_argument("--chunk-delay", type=float, default=0.002)
+    p.add_argument("--response-chars", type=int, default=4000)
+    p.add_argument("--search-latency", type=float, default=0.05)
+    p.add_argument("--search-body", type=int, default=4000, help="検索結果1件あたりの本文の文字数")
+    p.add_argument("--only", help="名前にこの文字列を含むシナリオだけ")
+    p.add_argument("--json", help="結果の保存先")
+    p.add_argument("--baseline", help="比較する過去の結果 (JSON)")
+    p.add_argument("--tolerance", type=float, default=0.25)
+    args = p.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="ks-bench-")
+    _isolate(tmp)
+    from core.llm_executor import FakeGemini, set_llm_call
+    from core.search import FakeSearchBackend, set_search_backend
+    set_llm_call(FakeGemini(latency=args.llm_latency, chunk_delay=args.chunk_delay, response_chars=args.response_chars))
+    set_search_backend(FakeSearchBackend(latency=args.search_latency, body_size=args.search_body))
+    counter = ByteCounter()
+    counter.install()
+
+    print(f"repeat={args.repeat} rows={args.rows:,} images={args.images} llm={args.llm_latency}s "
+          f"search={args.search_latency}s body={args.search_body} (tmp {tmp})")
+    print(f"{'scenario':<26} {'first':>8} {'p50':>8} {'p95':>8} {'peak':>8} {'sent':>10}")
+    results = {}
+    for name, factory, action, setup, fresh in scenarios(args):
+        if args.only and args.only not in name:
+            continue
+        r = results[name] = run_case(name, factory, action, args.repeat, counter, setup=setup, fresh=fresh)
+        print(f"{name:<26} {r['first_ms']:6.0f}ms {r['p50_ms']:6.0f}ms {r['p95_ms']:6.0f}ms "
+              f"{r['peak_mb']:6.1f}MB {r['bytes_sent'] / 1024:8.1f}KB")
+
+    if args.json:
+        import streamlit
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+                       "streamlit": streamlit.__version__,
+                       "config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+                       "results": results}, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            worse = compare(results, json.load(f)["results"], args.tolerance)
+        for name, metric, old, new in worse:
+            print(f"REGRESSION {name} {metric}: {old} -> {new}")
+        if worse:
+            sys.exit(1)
+        print(f"no regressions (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
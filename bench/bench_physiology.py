@@ -0,0 +1,74 @@
+"""派生指標の計算ベンチマーク (スカラー実装 vs ベクトル化)
+
+    python -m bench.bench_physiology [rows]
+"""
+import sys
+import time
+
+import numpy as np
+
+from core.physiology import INPUT_COLUMNS, derive
+
+
+def scalar_derive(pao2, fio2, hb, co, spo2, svo2, na, cl, hco3, alb, ecmo_flow):
+    # 旧 TAB 2 の行単位ロジック
+    pf, do2, vo2, o2er, ag, c_ag, flow_ratio = None, None, None, None, None, None, None
+    if pao2 and fio2 and fio2 > 0:
+        pf = pao2 / (fio2 / 100)
+    if hb and co and spo2 and pao2:
+        cao2 = 1.34 * hb * (spo2 / 100) + 0.0031 * pao2
+        do2 = co * cao2 * 10
+        if svo2:
+            cvo2 = 1.34 * hb * (svo2 / 100) + 0.0031 * 40
+            vo2 = co * (cao2 - cvo2) * 10
+            if do2 and do2 > 0:
+                o2er = (vo2 / do2) * 100
+    if na and cl and hco3:
+        ag = na - (cl + hco3)
+        if alb:
+            c_ag = ag + 2.5 * (4.0 - alb)
+    if co and ecmo_flow and co > 0:
+        flow_ratio = (ecmo_flow / co) * 100
+    return pf, do2, vo2, o2er, c_ag if c_ag else ag, flow_ratio
+
+
+def make_inputs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    base = {
+        "PaO2": (40, 300), "FiO2": (21, 100), "Hb": (6, 15), "CO": (2, 12), "SpO2": (70, 100),
+        "SvO2": (40, 90), "Na": (125, 150), "Cl": (90, 115), "HCO3": (10, 30), "Alb": (1.5, 4.5),
+        "ECMO_Flow": (0, 6),
+    }
+    cols = {}
+    for name in INPUT_COLUMNS:
+        lo, hi = base[name]
+        v = rng.uniform(lo, hi, n)
+        v[rng.random(n) < 0.2] = np.nan  # 実データ同様に2割欠損
+        cols[name] = v
+    return cols
+
+
+def main(n):
+    cols = make_inputs(n)
+    t = time.perf_counter()
+    out = derive(cols)
+    vec = time.perf_counter() - t
+
+    rows = [[None if np.isnan(cols[c][i]) else float(cols[c][i]) for c in INPUT_COLUMNS] for i in range(n)]
+    t = time.perf_counter()
+    ref = [scalar_derive(*r) for r in rows]
+    scalar = time.perf_counter() - t
+
+    # 一致確認 (P/F, DO2, VO2, O2ER, AG, Flow_Ratio)
+    names = ("P/F", "DO2", "VO2", "O2ER", "AG", "Flow_Ratio")
+    for k, name in enumerate(names):
+        expected = np.array([np.nan if (r[k] is None or r[k] == 0) else r[k] for r in ref])
+        assert np.allclose(out[name], expected, equal_nan=True), name
+
+    print(f"rows={n:,}")
+    print(f"vectorized: {vec * 1000:8.1f} ms")
+    print(f"scalar    : {scalar * 1000:8.1f} ms  (x{scalar / vec:.0f})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,114 @@
+"""VITAL TRENDS 操作ごとの再実行時間ベンチマーク (AppTest)
+
+    python -m bench.bench_rerun [rows] [repeat]
+
+fragment 導入前は入力1回ごとに app_pro.py 全体が再実行されていた (full)。
+導入後はその操作の fragment 本体だけが再実行される。AppTest は常にスクリプト全体を
+実行するため、fragment 側は同じ描画関数だけを持つ小スクリプトで計測する。
+API キーなし (モデル一覧・LLM 呼び出しなし) で、画面側のコストだけを比べる。
+"""
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+from core.trend_store import TrendStore
+from core.physiology import recompute
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app_pro.py")
+PATIENT_ID = "TEST1"
+
+
+def make_store(n, seed=0):
+    rng = np.random.default_rng(seed)
+    store = TrendStore()
+    trend = store.get(PATIENT_ID)
+    times = np.datetime64("2026-01-01T00:00") + np.arange(n) * np.timedelta64(60, "s")
+    trend.extend_arrays(times, {
+        "PaO2": rng.uniform(50, 120, n), "FiO2": rng.uniform(30, 100, n), "Hb": rng.uniform(7, 12, n),
+        "CO": rng.uniform(4, 10, n), "SpO2": rng.uniform(85, 100, n), "SvO2": rng.uniform(50, 80, n),
+        "Lactate": rng.uniform(1, 8, n), "pH": rng.uniform(7.1, 7.45, n), "ECMO_Flow": rng.uniform(2, 5, n),
+        "Na": rng.uniform(130, 145, n), "Cl": rng.uniform(95, 110, n), "HCO3": rng.uniform(15, 28, n),
+        "Alb": rng.uniform(2, 4, n),
+    })
+    recompute(trend)
+    return store
+
+
+# --- fragment 本体相当のスクリプト (AppTest.from_function はソースを切り出して実行) ---
+def empty_script():
+    import streamlit as st  # noqa: F401
+
+
+def inputs_script():
+    from core.trend_panel import render_inputs
+    render_inputs()
+
+
+def panel_script():
+    import streamlit as st
+    from core.trend_panel import render_inputs, read_inputs, make_record, render_charts
+    render_inputs()
+    if st.button("💾 SAVE DATA (Add to Session)"):
+        st.session_state['patient_db'].append("TEST1", make_record(read_inputs()))
+    render_charts(st.session_state['patient_db'].get("TEST1"), "TEST1")
+
+
+def _new(at, store):
+    at.session_state["patient_db"] = store
+    at.run()
+    assert not at.exception, [e.value for e in at.exception]
+    return at
+
+
+def _time(at, action, repeat):
+    samples = []
+    for i in range(repeat):
+        action(at, i)
+        t = time.perf_counter()
+        at.run()
+        samples.append(time.perf_counter() - t)
+        assert not at.exception, [e.value for e in at.exception]
+    return samples
+
+
+def edit_input(at, i):
+    at.number_input(key="vital_in_PaO2").set_value(60.0 + i)
+
+
+def click_save(at, i):
+    edit_input(at, i)
+    at.button[[b.label for b in at.button].index("💾 SAVE DATA (Add to Session)")].click()
+
+
+def noop(at, i):
+    pass
+
+
+def main(n, repeat):
+    cases = [
+        ("harness (empty script)", lambda: AppTest.from_function(empty_script), noop),
+        ("edit input   : full app", lambda: AppTest.from_file(APP, default_timeout=60), edit_input),
+        ("edit input   : fragment", lambda: AppTest.from_function(inputs_script), edit_input),
+        ("save record  : full app", lambda: AppTest.from_file(APP, default_timeout=60), click_save),
+        ("save record  : fragment", lambda: AppTest.from_function(panel_script, default_timeout=60), click_save),
+    ]
+    print(f"rows={n:,} repeat={repeat}")
+    results = {}
+    for label, factory, action in cases:
+        at = _new(factory(), make_store(n))
+        samples = _time(at, action, repeat)
+        results[label] = statistics.median(samples)
+        print(f"{label}: median {results[label] * 1000:8.1f} ms  max {max(samples) * 1000:8.1f} ms")
+    for op in ("edit input", "save record"):
+        full = results[f"{op:<13}: full app"]
+        frag = results[f"{op:<13}: fragment"]
+        print(f"{op}: x{full / frag:.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 10)
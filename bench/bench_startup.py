@@ -0,0 +1,103 @@
+"""画面ごとの起動時間ベンチマーク (初回描画までの cold / warm)
+
+    python -m bench.bench_startup [repeat] [--json out.json]
+
+cold : 新しい Python プロセスで streamlit を import してから AppTest の初回 run() 完了まで
+warm : 同じプロセスでの2回目の run() (モジュールは読み込み済み)
+重いモジュール (HEAVY) のうち初回描画までに読み込まれたものも記録する。
+
+API キーあり (key) はリプレイモード + 記録済みのモデル一覧で計測し、ネットワークには出ない
+(リプレイモードでは genai 自体を読み込まない)。
+キャッシュ・患者データは一時ディレクトリに置くので手元のデータには触れない。
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ("app.py", "app_pro.py", "research.py")
+HEAVY = ("pandas", "pyarrow", "PIL", "google.generativeai", "duckduckgo_search")
+MODELS = ["models/gemini-1.5-pro", "models/gemini-1.5-flash"]
+
+
+def child(app, keyed):
+    """1回分の計測 (子プロセス側)。結果を JSON で標準出力へ"""
+    t0 = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    t_import = time.perf_counter()
+    if keyed:
+        from core.llm import record_models
+        record_models(MODELS)
+    at = AppTest.from_file(os.path.join(ROOT, app), default_timeout=120)
+    if keyed:
+        at.secrets["GEMINI_API_KEY"] = "bench"
+    t1 = time.perf_counter()
+    at.run()
+    t_first = time.perf_counter()
+    loaded = [m for m in HEAVY if m in sys.modules]
+    t2 = time.perf_counter()
+    at.run()
+    t_warm = time.perf_counter()
+    print(json.dumps({
+        "import_ms": (t_import - t0) * 1000,
+        "cold_ms": (t_import - t0 + t_first - t1) * 1000,
+        "warm_ms": (t_warm - t2) * 1000,
+        "loaded": loaded,
+        "errors": [str(e.value) for e in at.exception],
+    }))
+
+
+def measure(app, keyed, repeat):
+    samples = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, KS_CACHE_DIR=os.path.join(tmp, "cache"), KS_DATA_DIR=os.path.join(tmp, "data"),
+                       KS_LLM_MODE="replay" if keyed else "cache", KS_SEARCH_OFFLINE="1", PYTHONPATH=ROOT)
+            out = subprocess.run([sys.executable, "-m", "bench.bench_startup", "--child", app, "key" if keyed else "nokey"],
+                                 cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+            samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    errors = sorted({e for s in samples for e in s["errors"]})
+    return {
+        "app": app,
+        "key": keyed,
+        "import_ms": round(statistics.median(s["import_ms"] for s in samples), 1),
+        "cold_ms": round(statistics.median(s["cold_ms"] for s in samples), 1),
+        "warm_ms": round(statistics.median(s["warm_ms"] for s in samples), 1),
+        "loaded": samples[-1]["loaded"],
+        "errors": errors,
+    }
+
+
+def main(argv):
+    if argv[:1] == ["--child"]:
+        child(argv[1], argv[2] == "key")
+        return
+    json_path = None
+    if "--json" in argv:
+        i = argv.index("--json")
+        json_path = argv[i + 1]
+        argv = argv[:i] + argv[i + 2:]
+    repeat = int(argv[0]) if argv else 3
+
+    print(f"repeat={repeat} (median)  cold = streamlit import + first run, warm = second run")
+    print(f"{'app':<12} {'key':<5} {'import':>9} {'cold':>9} {'warm':>9}  loaded")
+    rows = []
+    for app in APPS:
+        for keyed in (False, True):
+            r = measure(app, keyed, repeat)
+            rows.append(r)
+            print(f"{app:<12} {'yes' if keyed else 'no':<5} {r['import_ms']:7.0f}ms {r['cold_ms']:7.0f}ms "
+                  f"{r['warm_ms']:7.0f}ms  {', '.join(r['loaded']) or '-'}")
+            for e in r["errors"]:
+                print(f"    ! {e}")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"repeat": repeat, "python": sys.version.split()[0], "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
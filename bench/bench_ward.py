@@ -0,0 +1,77 @@
+"""病棟一覧のベンチマーク (全患者の最新値 + 悪化スコア)
+
+    python -m bench.bench_ward [beds] [days]
+
+1分間隔・3割欠損の履歴を beds 人分作り、ward_overview を計測する。
+SQLite ストア経由では初回 (DB から読み込み) と2回目以降 (キャッシュ) を分けて出す。
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from core.patient_store import SQLiteTrendStore
+from core.physiology import recompute
+from core.trend_store import TrendStore
+from core.ward import store_overview, ward_overview
+
+RANGES = {
+    "PaO2": (50, 120), "FiO2": (30, 100), "Hb": (7, 12), "CO": (4, 10), "SpO2": (85, 100),
+    "SvO2": (50, 80), "Lactate": (1, 8), "ECMO_Flow": (2, 5), "Na": (130, 145), "Cl": (95, 110),
+    "HCO3": (15, 28), "Alb": (2, 4), "pH": (7.1, 7.45),
+}
+
+
+def make_ward(beds, days, seed=0):
+    rng = np.random.default_rng(seed)
+    store = TrendStore()
+    rows = days * 24 * 60
+    start = np.datetime64("2026-01-01T00:00")
+    for b in range(beds):
+        trend = store.get(f"BED{b:02d}")
+        times = start + np.arange(rows) * np.timedelta64(60, "s")
+        cols = {}
+        for name, (lo, hi) in RANGES.items():
+            v = rng.uniform(lo, hi, rows)
+            v[rng.random(rows) < 0.3] = np.nan
+            cols[name] = v
+        trend.extend_arrays(times, cols)
+        recompute(trend)
+    return store
+
+
+def _time(fn, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return min(samples)
+
+
+def main(beds, days):
+    store = make_ward(beds, days)
+    trends = {pid: store.get(pid) for pid in store.patients()}
+    total = sum(len(t) for t in trends.values())
+    print(f"beds={beds} days={days} rows={total:,}")
+    print(f"ward_overview (in memory): {_time(lambda: ward_overview(trends)) * 1000:8.1f} ms")
+
+    with tempfile.TemporaryDirectory() as d:
+        db = SQLiteTrendStore(os.path.join(d, "patients.sqlite"))
+        for pid, trend in trends.items():
+            db.put(pid, trend)
+        db.close()
+        db = SQLiteTrendStore(os.path.join(d, "patients.sqlite"))
+        t = time.perf_counter()
+        store_overview(db)
+        cold = time.perf_counter() - t
+        print(f"store_overview (SQLite, cold): {cold * 1000:8.1f} ms")
+        print(f"store_overview (SQLite, warm): {_time(lambda: store_overview(db)) * 1000:8.1f} ms")
+        db.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 3)
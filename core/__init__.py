@@ -0,0 +1 @@
+"""K's tech works 共通コア (app.py / app_pro.py / research.py 共有ロジック)"""
@@ -0,0 +1,399 @@
+"""患者トレンドのバックアップ (書き出し / ストリーミング取り込み)
+
+書き出しはダウンロード時にだけ呼ぶ (st.download_button の data に関数を渡す)。
+  JSON      : 従来形式 (配列 + indent=2)。既存のバックアップ・カルテ貼り付け用
+  NDJSON    : 1行1レコード、欠損列は省略
+  NDJSON.gz : 上の gzip
+  Parquet   : 列指向・型付き (時刻は timestamp、値は float64)。再読み込みが最速
+
+取り込みは形式を先頭バイトで判別し、JSON 配列も1レコードずつ読む (全体を
+json.load しない)。レコードはスキーマ (core.schema) で検証し、時刻が既存と
+重複する行は捨てて時刻順にマージ、最後に派生列を一括再計算する。
+"""
+import gzip
+import io
+import json
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import numpy as np
+
+from core.physiology import recompute
+from core.schema import COLUMN_INDEX, COLUMN_NAMES, TIME_COLUMN
+from core.trend_store import parse_time
+
+BATCH_ROWS = 5000
+_READ_CHUNK = 1 << 16
+_MAX_ERRORS = 5
+
+EXPORT_FORMATS = {
+    "JSON": (".json", "application/json"),
+    "NDJSON": (".ndjson", "application/x-ndjson"),
+    "NDJSON.gz": (".ndjson.gz", "application/gzip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+IMPORT_TYPES = ["json", "ndjson", "jsonl", "gz", "parquet"]
+
+
+class BackupFormatError(ValueError):
+    """バックアップとして読めないファイル (壊れた JSON / Time 列なし 等)"""
+
+
+# ==========================================
+# 書き出し
+# ==========================================
+def _time_strings(trend):
+    return np.char.replace(trend.times.astype("datetime64[s]").astype(str), "T", " ")
+
+
+def iter_ndjson(trend):
+    """NDJSON の行を順に返す (欠損列は省略)"""
+    times = _time_strings(trend)
+    data = trend.columns()
+    present = {name: ~np.isnan(v) for name, v in data.items()}
+    for i in range(len(trend)):
+        record = {TIME_COLUMN: str(times[i])}
+        for name in COLUMN_NAMES:
+            if present[name][i]:
+                record[name] = float(data[name][i])
+        yield json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def to_parquet(trend):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet の書き出しには pyarrow が必要です (pip install pyarrow)") from e
+    arrays = [pa.array(trend.times, type=pa.timestamp("ns"))]
+    arrays += [pa.array(trend.column(name), type=pa.float64(), from_pandas=True) for name in COLUMN_NAMES]
+    table = pa.Table.from_arrays(arrays, names=[TIME_COLUMN, *COLUMN_NAMES])
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression="zstd")
+    return buf.getvalue()
+
+
+def export_backup(trend, fmt="JSON"):
+    """fmt (EXPORT_FORMATS のキー) で書き出した str / bytes を返す"""
+    if fmt == "JSON":
+        return json.dumps(trend.to_records(), indent=2, ensure_ascii=False)
+    if fmt == "NDJSON":
+        return "".join(iter_ndjson(trend))
+    if fmt == "NDJSON.gz":
+        return gzip.compress("".join(iter_ndjson(trend)).encode("utf-8"), compresslevel=6)
+    if fmt == "Parquet":
+        return to_parquet(trend)
+    raise ValueError(f"unknown export format: {fmt}")
+
+
+def backup_filename(patient_id, fmt="JSON", now=None):
+    stamp = (now or datetime.now()).strftime("%Y%m%d_%H%M")
+    return f"ICU_DATA_{patient_id}_{stamp}{EXPORT_FORMATS[fmt][0]}"
+
+
+# ==========================================
+# 取り込み
+# ==========================================
+@dataclass
+class ImportReport:
+    format: str = ""
+    rows_read: int = 0
+    rows_added: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    invalid_values: int = 0
+    unknown_columns: set = field(default_factory=set)
+    errors: list = field(default_factory=list)
+
+    def error(self, message):
+        if len(self.errors) < _MAX_ERRORS:
+            self.errors.append(message)
+
+    def summary(self):
+        text = (f"{self.format}: {self.rows_read} rows read / {self.rows_added} added / "
+                f"{self.duplicates} duplicates / {self.rejected} rejected")
+        if self.invalid_values:
+            text += f" / {self.invalid_values} invalid values"
+        if self.unknown_columns:
+            text += f" / ignored columns: {', '.join(sorted(self.unknown_columns))}"
+        return text
+
+
+def _iter_json_array(text):
+    """JSON 配列の要素を1つずつ返す (ファイル全体をメモリに載せない)"""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = text.read(_READ_CHUNK)
+        if not chunk:
+            eof = True
+        buf, pos = buf[pos:] + chunk, 0
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    skip_ws()
+    if buf[pos:pos + 1] != "[":
+        raise BackupFormatError("JSON array expected")
+    pos += 1
+    first = True
+    while True:
+        skip_ws()
+        if pos >= len(buf):
+            raise BackupFormatError("unexpected end of JSON array")
+        if buf[pos] == "]":
+            return
+        if not first:
+            if buf[pos] != ",":
+                raise BackupFormatError(f"',' expected in JSON array (got {buf[pos]!r})")
+            pos += 1
+            skip_ws()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise BackupFormatError(f"broken JSON: {e}") from e
+                fill()
+                continue
+            # 数値リテラルがチャンク境界で切れていないか (要素の後ろに区切りが見えるまで読む)
+            if end >= len(buf) and not eof:
+                fill()
+                continue
+            break
+        pos = end
+        first = False
+        yield obj
+
+
+def _iter_ndjson(text, report):
+    for lineno, line in enumerate(text, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            report.rejected += 1
+            report.error(f"line {lineno}: {e.msg}")
+
+
+class _Batcher:
+    """検証済みレコードを列配列に貯める"""
+
+    def __init__(self, report):
+        self.report = report
+        self.last = None    # 直前の行の時刻 (日付のない旧形式の時刻をつなげる)
+        self.times, self.rows = [], []
+        self.time_parts, self.col_parts = [], {name: [] for name in COLUMN_NAMES}
+
+    def add(self, record):
+        report = self.report
+        report.rows_read += 1
+        if not isinstance(record, dict):
+            report.rejected += 1
+            report.error(f"row {report.rows_read}: not an object")
+            return
+        raw = record.get(TIME_COLUMN)
+        try:
+            # parse_time は空なら現在時刻を返すので、ここでは欠損として弾く
+            t = parse_time(raw, after=self.last) if raw not in (None, "") else None
+        except (TypeError, ValueError):
+            t = None
+        if t is None:
+            report.rejected += 1
+            report.error(f"row {report.rows_read}: invalid or missing {TIME_COLUMN}")
+            return
+        row = [np.nan] * len(COLUMN_NAMES)
+        for name, value in record.items():
+            j = COLUMN_INDEX.get(name)
+            if j is None:
+                if name != TIME_COLUMN:
+                    report.unknown_columns.add(name)
+                continue
+            kind = type(value)
+            if kind is float or kind is int:
+                row[j] = float(value)
+            elif kind is str:
+                try:
+                    row[j] = float(value)
+                except ValueError:
+                    report.invalid_values += 1
+            elif value is not None:
+                # bool / list / dict は数値として扱わない
+                report.invalid_values += 1
+        self.last = t
+        self.times.append(t)
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_ROWS:
+            self.flush()
+
+    def add_arrays(self, times, columns):
+        self.report.rows_read += len(times)
+        self.time_parts.append(np.asarray(times, dtype="datetime64[ns]"))
+        for name in COLUMN_NAMES:
+            values = columns.get(name)
+            self.col_parts[name].append(np.full(len(times), np.nan) if values is None else values)
+
+    def flush(self):
+        if not self.rows:
+            return
+        block = np.array(self.rows, dtype=np.float64)
+        self.time_parts.append(np.array(self.times, dtype="datetime64[ns]"))
+        for j, name in enumerate(COLUMN_NAMES):
+            self.col_parts[name].append(block[:, j])
+        self.times, self.rows = [], []
+
+    def arrays(self):
+        self.flush()
+        if not self.time_parts:
+            return np.array([], dtype="datetime64[ns]"), {}
+        return (np.concatenate(self.time_parts),
+                {name: np.concatenate(parts) for name, parts in self.col_parts.items()})
+
+
+def _read_parquet(f, batcher):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet の取り込みには pyarrow が必要です (pip install pyarrow)") from e
+    try:
+        _read_parquet_batches(pa, pq.ParquetFile(f), batcher)
+    except pa.ArrowException as e:
+        raise BackupFormatError(f"broken Parquet: {e}") from e
+
+
+def _read_parquet_batches(pa, pf, batcher):
+    schema = pf.schema_arrow
+    if TIME_COLUMN not in schema.names or not pa.types.is_timestamp(schema.field(TIME_COLUMN).type):
+        raise BackupFormatError(f"Parquet needs a timestamp column '{TIME_COLUMN}'")
+    report = batcher.report
+    wanted = []
+    for name in schema.names:
+        if name == TIME_COLUMN:
+            continue
+        kind = schema.field(name).type
+        if name not in COLUMN_INDEX:
+            report.unknown_columns.add(name)
+        elif pa.types.is_floating(kind) or pa.types.is_integer(kind):
+            wanted.append(name)
+        else:
+            report.error(f"column {name}: {kind} is not numeric")
+    for batch in pf.iter_batches(batch_size=BATCH_ROWS, columns=[TIME_COLUMN, *wanted]):
+        times = batch.column(TIME_COLUMN)
+        valid = np.asarray(times.is_valid())
+        report.rejected += int((~valid).sum())
+        t = times.cast(pa.timestamp("ns")).to_numpy(zero_copy_only=False)[valid]
+        cols = {name: batch.column(name).cast(pa.float64()).to_numpy(zero_copy_only=False)[valid] for name in wanted}
+        batcher.add_arrays(t, cols)
+        report.rows_read += int((~valid).sum())
+
+
+def _open_text(binary):
+    return io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+
+
+def read_backup(fileobj, report=None):
+    """バックアップを読んで (times, {列名: 配列}, ImportReport) を返す (ストアは変更しない)
+
+    壊れたファイル (途中で切れた gzip・Parquet 等) はすべて BackupFormatError にする。
+    """
+    report = report or ImportReport()
+    batcher = _Batcher(report)
+    try:
+        _read(fileobj, batcher)
+    except BackupFormatError:
+        raise
+    except UnicodeDecodeError as e:
+        raise BackupFormatError(f"not UTF-8 text: {e}") from e
+    except (OSError, EOFError, zlib.error, ValueError) as e:
+        raise BackupFormatError(f"broken {report.format or 'backup'}: {type(e).__name__}: {e}") from e
+    return (*batcher.arrays(), report)
+
+
+def _read(fileobj, batcher):
+    report = batcher.report
+    binary = fileobj
+    head = _peek(binary, 4)
+    if head[:2] == b"\x1f\x8b":
+        binary = gzip.GzipFile(fileobj=binary)
+        head = _peek(binary, 4)
+        report.format = "gzip+"
+    if head == b"PAR1":
+        report.format += "Parquet"
+        _read_parquet(binary, batcher)
+        return
+
+    text = _open_text(binary)
+    first = _first_char(text)
+    try:
+        if first == "[":
+            report.format += "JSON"
+            records = _iter_json_array(_Prefixed(first, text))
+        else:
+            report.format += "NDJSON"
+            records = _iter_ndjson(_Prefixed(first, text), report)
+        for record in records:
+            batcher.add(record)
+    finally:
+        text.detach()
+
+
+def import_backup(fileobj, trend):
+    """バックアップを trend に重複なしでマージし、派生列を一括再計算する"""
+    times, columns, report = read_backup(fileobj)
+    added = trend.merge_arrays(times, columns) if len(times) else 0
+    report.rows_added = added
+    report.duplicates = len(times) - added
+    if added:
+        recompute(trend)
+    return report
+
+
+def _peek(binary, n):
+    if hasattr(binary, "peek"):
+        return binary.peek(n)[:n]
+    pos = binary.tell()
+    head = binary.read(n)
+    binary.seek(pos)
+    return head
+
+
+def _first_char(text):
+    while True:
+        c = text.read(1)
+        if not c or not c.isspace():
+            return c
+
+
+class _Prefixed:
+    """先読みした1文字を戻したテキストストリーム (read / 行イテレーション)"""
+
+    def __init__(self, prefix, text):
+        self.prefix, self.text = prefix, text
+
+    def read(self, size=-1):
+        head, self.prefix = self.prefix, ""
+        if size is None or size < 0:
+            return head + self.text.read()
+        return head + self.text.read(max(size - len(head), 0))
+
+    def __iter__(self):
+        head, self.prefix = self.prefix, ""
+        first = True
+        for line in self.text:
+            if first:
+                line, first = head + line, False
+            yield line
+        if first and head:
+            yield head
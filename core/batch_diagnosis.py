@@ -0,0 +1,334 @@
+"""書き出し済みの患者データ (ICU_DATA_*.json) をまとめて診断するコマンドライン
+
+    python -m core.batch_diagnosis ICU_DATA_*.json [--out results.ndjson] [--workers 4]
+                                   [--model models/gemini-1.5-pro] [--history TEXT] [--labs TEXT]
+
+プロンプトは app_pro.py と同じ (トレンド要約・ルール判定・病歴・検査値・検索エビデンス)。
+病歴と検査値は書き出しファイルに含まれないので、同じ名前の <stem>.notes.json
+({"history": ..., "labs": ...}) があればそれを、無ければ --history / --labs を使う。
+読み込みは core.backup の取り込みと同じなので NDJSON(.gz) / Parquet の書き出しも渡せる。
+
+結果は1件終わるごとに NDJSON へ追記する (セクション別の本文・所要時間・推定トークン数)。
+途中で止まっても同じ --out で再実行すれば、内容 (ファイル・メモ・モデル) が同じで
+成功済みの件は飛ばす。トークン数は core.trend_summary.estimate_tokens による推定値。
+
+API キーは --api-key か環境変数 GEMINI_API_KEY。KS_LLM_MODE / KS_LLM_BACKEND=fake などは画面と同じ。
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import numpy as np
+
+WORKERS = 4
+SEARCH_BUDGET = 8.0
+DEFAULT_MODEL = "models/gemini-1.5-pro"
+NO_FEED = "No Feed"
+
+_EXPORT_NAME = re.compile(r"ICU_DATA_([A-Za-z0-9]+)_\d{8}_\d{4}")
+
+
+# ==========================================
+# 入力
+# ==========================================
+def expand_inputs(paths):
+    """ファイル・ディレクトリ (中の ICU_DATA_*)・glob を重複なく並べる"""
+    files, seen = [], set()
+    for p in paths:
+        if os.path.isdir(p):
+            matches = sorted(glob.glob(os.path.join(p, "ICU_DATA_*")))
+        else:
+            matches = sorted(glob.glob(p)) or [p]
+        for m in matches:
+            if m.endswith(".notes.json") or m in seen:
+                continue
+            seen.add(m)
+            files.append(m)
+    return files
+
+
+def _stem(path):
+    name = os.path.basename(path)
+    for ext in (".ndjson.gz", ".json", ".ndjson", ".jsonl", ".gz", ".parquet"):
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return os.path.splitext(name)[0]
+
+
+def patient_id(path):
+    """ICU_DATA_{ID}_{YYYYMMDD_HHMM}.json の ID (それ以外の名前は拡張子を除いたファイル名)"""
+    stem = _stem(path)
+    m = _EXPORT_NAME.fullmatch(stem)
+    return m.group(1) if m else stem
+
+
+def load_notes(path, history="", labs=""):
+    """<stem>.notes.json の (history, labs)。無い項目は引数の既定値 (読めなければ OSError / ValueError)"""
+    notes_path = os.path.join(os.path.dirname(path), _stem(path) + ".notes.json")
+    if os.path.exists(notes_path):
+        with open(notes_path, encoding="utf-8") as f:
+            notes = json.load(f)
+        if not isinstance(notes, dict):
+            raise ValueError(f"{notes_path}: JSON object expected")
+        history = notes.get("history", history)
+        labs = notes.get("labs", labs)
+    return history, labs
+
+
+def case_key(data, history, labs, model_name):
+    """再開判定用のキー (ファイルの中身・メモ・モデルが同じなら同じ)"""
+    h = hashlib.sha256(data)
+    h.update(json.dumps([history, labs, model_name], ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def load_results(path):
+    """保存済みの {key: 記録} (同じキーは後の記録が勝つ。壊れた末尾行は無視)"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[record.get("key")] = record
+    return done
+
+
+# ==========================================
+# 1件分
+# ==========================================
+@dataclass
+class Options:
+    model: str = DEFAULT_MODEL
+    api_key: str = None
+    mode: str = None                 # None: KS_LLM_MODE
+    fallback: str = None
+    deadline: float = None
+    search_budget: float = SEARCH_BUDGET
+    trend_budget: int = None
+    offline: bool = False
+    history: str = ""
+    labs: str = ""
+
+
+def diagnose_file(path, data, history, labs, opts):
+    """1ファイルを診断して記録 (dict) を返す。app_pro.py の EXECUTE AI DIAGNOSIS と同じ手順"""
+    import io
+    from core.backup import BackupFormatError, import_backup
+    from core.llm import generate, generate_text
+    from core.pipeline import prepare_diagnosis
+    from core.prompts import KUSANO_BRAIN, diagnosis_prompt, evidence_query, format_evidence, keyword_prompt
+    from core.rules import evaluate_trend, findings_text
+    from core.search import get_search
+    from core.sections import SECTION_ORDER, parse_sections
+    from core.tracing import get_tracer
+    from core.trend_store import PatientTrend
+    from core.trend_summary import DEFAULT_BUDGET, estimate_tokens, summarize_trend
+
+    trend = PatientTrend()
+    report = import_backup(io.BytesIO(data), trend)
+    if not len(trend):
+        raise BackupFormatError("; ".join([report.summary(), *report.errors]))
+    options = dict(mode=opts.mode, api_key=opts.api_key)
+    kw_prompt = keyword_prompt(history, labs)
+    kw_text = []
+
+    def extract_keywords():
+        kw_text.append(generate_text(opts.model, kw_prompt, kind="short", **options))
+        return kw_text[0].strip()
+
+    def search_evidence(search_key):
+        for r in get_search().iter_text(evidence_query(search_key), region='jp-jp', max_results=3, offline=opts.offline):
+            yield format_evidence(r)
+
+    with get_tracer().start("batch", model=opts.model, patient=patient_id(path)) as trace:
+        prep = prepare_diagnosis(extract_keywords, search_evidence, None,
+                                 lambda: summarize_trend(trend, budget_tokens=opts.trend_budget or DEFAULT_BUDGET),
+                                 search_budget=opts.search_budget)
+        trace.add_timer(prep.timer)
+        with trace.span("rules"):
+            findings = evaluate_trend(trend)
+        search_context = f"Search Error: {prep.search_error}" if prep.search_error else "".join(prep.evidence)
+        prompt = diagnosis_prompt(history, labs, prep.trend, findings_text(findings), NO_FEED, search_context)
+
+        gen_start = time.perf_counter()
+        chunks = generate(opts.model, [prompt], system_instruction=KUSANO_BRAIN, stream=True,
+                          fallback=opts.fallback, deadline=opts.deadline, **options)
+        text = "".join(trace.stream(chunks, start=gen_start))
+        with trace.span("parse"):
+            parser = parse_sections(text)
+
+    return {
+        "rows": report.rows_added,
+        "findings": len(findings),
+        "search_key": prep.search_key,
+        "evidence": len(prep.evidence),
+        "search_complete": prep.search_complete,
+        "search_error": prep.search_error,
+        "sections": {key: parser.text(key) for key in SECTION_ORDER if key in parser.sections},
+        "raw": "" if parser.saw_marker else text,
+        # 検索語抽出と診断の2回分
+        "tokens_in": estimate_tokens(kw_prompt) + estimate_tokens(KUSANO_BRAIN + prompt),
+        "tokens_out": sum(estimate_tokens(t) for t in kw_text) + estimate_tokens(text),
+        "stage_ms": {k: v for k, v in trace.stage_ms().items() if k != "total"},
+    }
+
+
+# ==========================================
+# バッチ
+# ==========================================
+@dataclass
+class BatchResult:
+    records: list = field(default_factory=list)   # 入力順
+    elapsed: float = 0.0
+    processed: int = 0                             # 今回実行した件数 (再開時の既存分を除く)
+    resumed: int = 0
+
+    @property
+    def throughput(self):
+        """今回実行分の cases/min"""
+        return self.processed / self.elapsed * 60 if self.elapsed > 0 else 0.0
+
+    def tokens(self):
+        """今回実行分と再開分を合わせた推定トークン数 (in, out)"""
+        ok = [r for r in self.records if r["status"] == "ok"]
+        return (sum(r["tokens_in"] for r in ok),
+                sum(r["tokens_out"] for r in ok))
+
+    def latency(self):
+        values = [r["elapsed_ms"] for r in self.records if r["status"] == "ok" and not r.get("resumed")]
+        if not values:
+            return None
+        return {"n": len(values), "p50_ms": round(float(np.percentile(values, 50)), 1),
+                "p95_ms": round(float(np.percentile(values, 95)), 1)}
+
+    def summary(self):
+        ok = sum(r["status"] == "ok" for r in self.records)
+        tin, tout = self.tokens()
+        lines = [f"{len(self.records)} files: ok {ok} / error {len(self.records) - ok} / resumed {self.resumed}",
+                 f"elapsed {self.elapsed:.1f} s / {self.throughput:.1f} cases/min (this run: {self.processed})",
+                 f"tokens (est.): in {tin:,} / out {tout:,} / total {tin + tout:,}"]
+        lat = self.latency()
+        if lat:
+            lines.append(f"per case: p50 {lat['p50_ms']:.0f} ms / p95 {lat['p95_ms']:.0f} ms (n={lat['n']})")
+        return "\n".join(lines)
+
+
+def run_batch(files, out_path, opts, workers=WORKERS, diagnose=diagnose_file, on_record=None):
+    """files を workers 件ずつ並列に診断し、1件ごとに out_path へ追記する
+
+    diagnose(path, data, history, labs, opts): 記録 (dict)
+    on_record(record, done, total): 1件終わるごと (呼び出し元のスレッド)
+    """
+    previous = load_results(out_path)
+    result = BatchResult()
+    records, todo = {}, []
+    for path in files:
+        try:
+            # 壊れたメモもそのファイルだけのエラーにする (バッチ全体は止めない)
+            history, labs = load_notes(path, opts.history, opts.labs)
+            with open(path, "rb") as f:
+                data = f.read()
+        except (OSError, ValueError) as e:
+            records[path] = {"file": path, "patient_id": patient_id(path), "key": None, "status": "error",
+                             "error": f"{type(e).__name__}: {e}"}
+            continue
+        key = case_key(data, history, labs, opts.model)
+        r = previous.get(key)
+        if r is not None and r["status"] == "ok":
+            records[path] = dict(r, file=path, resumed=True)
+        else:
+            # 中身はワーカーで読み直す (全ファイルを同時にメモリへ載せない)
+            todo.append((path, key, history, labs))
+    result.resumed = sum(bool(r.get("resumed")) for r in records.values())
+    total, done = len(files), len(records)
+    t0 = time.perf_counter()
+
+    def _run(path, key, history, labs, queued):
+        start = time.perf_counter()
+        base = {"file": path, "patient_id": patient_id(path), "key": key, "model": opts.model,
+                "queue_ms": round((start - queued) * 1000, 1)}
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            record = {**base, "status": "ok", **diagnose(path, data, history, labs, opts)}
+        except Exception as e:
+            record = {**base, "status": "error", "error": f"{type(e).__name__}: {e}"}
+        record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return record
+
+    with open(out_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(workers, thread_name_prefix="batch-diagnosis") as pool:
+        pending = {pool.submit(_run, *item, time.perf_counter()) for item in todo}
+        try:
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    record = fut.result()
+                    records[record["file"]] = record
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    done += 1
+                    result.processed += 1
+                    if on_record:
+                        on_record(record, done, total)
+        except BaseException:
+            # Ctrl-C: 未着手の分は捨て、実行中の分だけ待って抜ける (次回は続きから)
+            for fut in pending:
+                fut.cancel()
+            raise
+
+    result.elapsed = time.perf_counter() - t0
+    result.records = [records[p] for p in files if p in records]
+    return result
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m core.batch_diagnosis",
+                                description="ICU_DATA_*.json をまとめて KUSANO_BRAIN で診断する")
+    p.add_argument("inputs", nargs="+", help="書き出しファイル / ディレクトリ / glob")
+    p.add_argument("--out", default="diagnosis_results.ndjson", help="結果 (NDJSON、追記・再開)")
+    p.add_argument("--workers", type=int, default=WORKERS, help="同時に診断する件数")
+    p.add_argument("--model", default=DEFAULT_MODEL)
+    p.add_argument("--fallback", help="主モデルが遅い・落ちているときのモデル")
+    p.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"))
+    p.add_argument("--llm-mode", choices=("cache", "replay", "off"), help="既定は KS_LLM_MODE")
+    p.add_argument("--deadline", type=float, help="応答が始まるまでの上限 (秒)")
+    p.add_argument("--search-budget", type=float, default=SEARCH_BUDGET)
+    p.add_argument("--trend-budget", type=int, help="トレンド要約のトークン予算")
+    p.add_argument("--offline", action="store_true", help="検索キャッシュのみ")
+    p.add_argument("--history", default="", help="notes.json が無いときの Patient History")
+    p.add_argument("--labs", default="", help="notes.json が無いときの Lab Data")
+    args = p.parse_args(argv)
+
+    from core.llm import configure
+    files = expand_inputs(args.inputs)
+    if not files:
+        p.error("no input files")
+    configure(args.api_key)
+    opts = Options(model=args.model, api_key=args.api_key, mode=args.llm_mode, fallback=args.fallback,
+                   deadline=args.deadline, search_budget=args.search_budget, trend_budget=args.trend_budget,
+                   offline=args.offline, history=args.history, labs=args.labs)
+
+    def progress(record, done, total):
+        status = record["status"] if record["status"] == "ok" else f"ERROR {record.get('error')}"
+        print(f"[{done}/{total}] {record['patient_id']} {record['elapsed_ms'] / 1000:.1f}s {status}", flush=True)
+
+    result = run_batch(files, args.out, opts, workers=max(1, args.workers), on_record=progress)
+    print(result.summary())
+    print(f"results: {args.out}")
+    return 0 if all(r["status"] == "ok" for r in result.records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""SQLite ベースのディスクキャッシュ (TTL + LRU サイズ制限)
+
+WAL モードで開くため、同一サーバー内の複数セッション・複数プロセスから
+同じファイルを安全に共有できる。接続はスレッドごとに持つ。
+"""
+import os
+import sqlite3
+import threading
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cache_dir():
+    path = os.environ.get("KS_CACHE_DIR") or os.path.join(_ROOT, ".cache")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class DiskCache:
+    """key → bytes のキャッシュ。max_bytes / max_entries を超えたら最終アクセスの古い順に削除"""
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, max_entries=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, max_age=None):
+        """値 (bytes) を返す。無い・max_age 秒より古い場合は None"""
+        conn = self._conn()
+        row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        now = time.time()
+        if max_age is not None and now - created > max_age:
+            return None
+        conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return value
+
+    def age(self, key):
+        row = self._conn().execute("SELECT created FROM entries WHERE key = ?", (key,)).fetchone()
+        return None if row is None else time.time() - row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), now, now),
+        )
+        self._evict(conn)
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, conn):
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC").fetchall():
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                count -= 1
+                total -= size
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge_expired(self, max_age):
+        self._conn().execute("DELETE FROM entries WHERE created < ?", (time.time() - max_age,))
+
+    def stats(self):
+        count, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": count, "bytes": total}
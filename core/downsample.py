@@ -0,0 +1,171 @@
+"""長期トレンド描画用のダウンサンプリング (LTTB / min-max バケット)
+
+st.line_chart に全行を渡すと数日分の高頻度データでフロントエンドが固まる。
+表示範囲とグラフ幅から必要点数を決め、列ごとに LTTB (形状保持) または
+min-max バケット (keep_peaks の列: 乳酸スパイク等を必ず残す) で間引く。
+全期間の多段解像度 (tier) は患者・データ版ごとに1回だけ作ってキャッシュする。
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from core.schema import COLUMNS_BY_NAME
+
+CHART_WIDTH_PX = 900
+TIER_FACTOR = 4
+MIN_TIER_POINTS = 512
+
+
+def target_points(width_px=CHART_WIDTH_PX, px_per_point=1.0):
+    return max(16, int(width_px / px_per_point))
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets で残す点の位置 (x 昇順・NaN なし前提)"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if hi <= lo:
+            out[i + 1] = a = lo
+            continue
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y, n_buckets):
+    """各バケットの最小・最大点の位置 (ピークを取りこぼさない)"""
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    lo = edges[:-1]
+    mins = np.minimum.reduceat(y, lo)
+    maxs = np.maximum.reduceat(y, lo)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    # バケット内で最初に極値となる点を選ぶ
+    first = np.full(n_buckets, n, dtype=np.int64)
+    idx = np.arange(n)
+    hit_min = y == mins[bucket]
+    hit_max = y == maxs[bucket]
+    imin, imax = first.copy(), first.copy()
+    np.minimum.at(imin, bucket[hit_min], idx[hit_min])
+    np.minimum.at(imax, bucket[hit_max], idx[hit_max])
+    return np.unique(np.concatenate([imin, imax, [0, n - 1]]))
+
+
+def select_indices(x, columns, n_out, envelope=False):
+    """複数列それぞれで選んだ点の和集合 (行位置)
+
+    envelope=True では全列を min-max で間引く (tier 構築用: 完全ベクトル化で速い)。
+    """
+    keep = []
+    for name, y in columns.items():
+        valid = np.flatnonzero(~np.isnan(y))
+        if not len(valid):
+            continue
+        spec = COLUMNS_BY_NAME.get(name)
+        if envelope or (spec is not None and spec.keep_peaks):
+            chosen = minmax_indices(y[valid], max(1, n_out // 2))
+        else:
+            chosen = lttb_indices(x[valid], y[valid], n_out)
+        keep.append(valid[chosen])
+    if not keep:
+        return np.arange(0)
+    return np.unique(np.concatenate(keep))
+
+
+class _Tiers:
+    """全期間の多段解像度: tiers[k] は行位置の配列 (粗くなる順)"""
+
+    def __init__(self, x, columns):
+        self.x = x
+        self.columns = columns
+        self.tiers = []
+        # 各列の min/max の和集合が size 点に収まるよう、1列あたりの点数を列数で割る
+        self.width = max(1, len(columns))
+        n = len(x)
+        size = n // TIER_FACTOR
+        base = np.arange(n)
+        while size >= MIN_TIER_POINTS:
+            sub_x = x[base]
+            sub = {k: v[base] for k, v in columns.items()}
+            chosen = select_indices(sub_x, sub, max(2, size // self.width), envelope=True)
+            if len(chosen) > len(base) // 2:
+                # 列が多く点が減らない: これより粗い tier は作らない
+                break
+            base = base[chosen]
+            self.tiers.append(base)
+            size = len(base) // TIER_FACTOR
+
+    def pick(self, lo_pos, hi_pos, n_out):
+        """表示範囲 [lo_pos, hi_pos) で1列あたり n_out 点以上残る最も粗い tier の該当部分"""
+        best = np.arange(lo_pos, hi_pos)
+        for tier in self.tiers:
+            part = tier[np.searchsorted(tier, lo_pos):np.searchsorted(tier, hi_pos)]
+            if len(part) < n_out * self.width:
+                break
+            best = part
+        return best
+
+
+class TierCache:
+    """(キー, 列, データ版) → _Tiers の LRU キャッシュ (プロセス共有)"""
+
+    def __init__(self, max_items=64):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, x, columns):
+        ckey = (key, tuple(columns), version)
+        with self._lock:
+            tiers = self._items.get(ckey)
+            if tiers is not None:
+                self._items.move_to_end(ckey)
+                return tiers
+        tiers = _Tiers(x, columns)
+        with self._lock:
+            self._items[ckey] = tiers
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return tiers
+
+
+_cache = TierCache()
+
+
+def downsample_view(frame, columns, key, version, window=None, width_px=CHART_WIDTH_PX):
+    """frame[columns] を表示範囲 window (pd.Timedelta / np.timedelta64 / None=全期間) と幅に合わせて間引く
+
+    frame は DatetimeIndex 昇順。key と version は frame の持ち主と版
+    (同じ key/version なら tier を再利用する)。
+    """
+    if not len(frame) or not columns:
+        return frame[columns]
+    n_out = target_points(width_px)
+    index = frame.index
+    x = index.asi8.astype(np.float64)
+    hi_pos = len(index)
+    lo_pos = 0 if window is None else int(index.searchsorted(index[-1] - window))
+    if hi_pos - lo_pos <= 2 * n_out:
+        return frame[columns].iloc[lo_pos:hi_pos]
+
+    data = {c: frame[c].to_numpy(dtype=np.float64) for c in columns}
+    tiers = _cache.get(key, version, x, data)
+    base = tiers.pick(lo_pos, hi_pos, n_out)
+    chosen = base[select_indices(x[base], {c: v[base] for c, v in data.items()}, n_out)]
+    return frame[columns].iloc[chosen]
@@ -0,0 +1,180 @@
+"""検索クエリの展開 (fan-out)・重複除去・ローカル再ランキング
+
+1つのクエリを 原文 / 英訳 / サイト指定 (PubMed, Nature など) に展開して並列に検索し、
+正規化 URL とタイトルの類似度で重複を除いてから、研究テーマ + クエリに対する
+BM25 で並べ替えて上位 top_k 件だけをプロンプトに渡す。
+英訳 (LLM 呼び出し) は他の変種の検索と重ねて実行する。
+"""
+import re
+import time
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+SITE_FILTERS = ("pubmed.ncbi.nlm.nih.gov", "nature.com")
+TOP_K = 5
+TITLE_SIMILARITY = 0.8
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_STOPWORDS = frozenset("a an and are as at be by for from in is of on or the to with via vs".split())
+_TRACKING = frozenset({"fbclid", "gclid", "ref", "ref_src"})
+
+
+# ==========================================
+# 正規化・重複除去
+# ==========================================
+def normalize_url(href):
+    """scheme・www・末尾スラッシュ・フラグメント・トラッキング引数の違いを無視した URL"""
+    parts = urlsplit(href.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                             if not k.lower().startswith("utm_") and k.lower() not in _TRACKING))
+    return urlunsplit(("", host, parts.path.rstrip("/") or "/", query, ""))
+
+
+def tokenize(text):
+    """英数字は単語、日本語 (かな・漢字) は文字 bigram"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = [w for w in re.findall(r"[a-z0-9]+(?:-[a-z0-9]+)*", text) if w not in _STOPWORDS]
+    for run in re.findall(r"[぀-ヿ㐀-鿿]+", text):
+        tokens.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+    return tokens
+
+
+def _similar(a, b, threshold=TITLE_SIMILARITY):
+    if not a or not b:
+        return False
+    return len(a & b) / len(a | b) >= threshold
+
+
+def dedupe(results, threshold=TITLE_SIMILARITY):
+    """URL (正規化後) が同じ、またはタイトルの語集合の Jaccard 係数が threshold 以上なら同一文献
+
+    先に見つかった方を残し、hits に何個の変種から見つかったかを数える。
+    """
+    kept, seen_urls, titles = [], {}, []
+    for r in results:
+        url = normalize_url(r["href"])
+        i = seen_urls.get(url)
+        if i is None:
+            words = set(tokenize(r["title"].replace("-", " ")))   # early-stage ≒ early
+            i = next((j for j, t in enumerate(titles) if _similar(words, t, threshold)), None)
+            if i is None:
+                seen_urls[url] = len(kept)
+                titles.append(words)
+                kept.append(dict(r, hits=1))
+                continue
+            seen_urls[url] = i
+        kept[i]["hits"] += 1
+        if len(r.get("body", "")) > len(kept[i].get("body", "")):
+            kept[i]["body"] = r["body"]
+    return kept
+
+
+# ==========================================
+# BM25
+# ==========================================
+def bm25_scores(query, docs, k1=BM25_K1, b=BM25_B):
+    """query (文字列) に対する docs (文字列のリスト) の BM25"""
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not docs or not terms:
+        return np.zeros(len(docs))
+    doc_tokens = [Counter(tokenize(d)) for d in docs]
+    tf = np.array([[c.get(t, 0) for t in terms] for c in doc_tokens], dtype=float)   # (文書, 語)
+    lengths = np.array([sum(c.values()) for c in doc_tokens], dtype=float)
+    n = len(docs)
+    df = (tf > 0).sum(axis=0)
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1.0))
+    return (idf * tf * (k1 + 1) / (tf + norm[:, None])).sum(axis=1)
+
+
+def rerank(results, query, top_k=TOP_K):
+    """タイトル + 本文の BM25 降順 (同点は見つかった変種の数、元の順)"""
+    if not results:
+        return []
+    scores = bm25_scores(query, [f"{r['title']} {r['title']} {r.get('body', '')}" for r in results])
+    order = sorted(range(len(results)), key=lambda i: (-scores[i], -results[i].get("hits", 1), i))
+    return [dict(results[i], score=round(float(scores[i]), 3)) for i in order[:top_k]]
+
+
+# ==========================================
+# 展開して並列検索
+# ==========================================
+def expand_query(query, sites=SITE_FILTERS):
+    """検索する変種: query そのもの + サイト指定 (英訳にも同じ展開をかける)"""
+    query = query.strip()
+    return [query] + [f"{query} site:{site}" for site in sites]
+
+
+def needs_translation(query):
+    return any(ord(ch) > 0x2FFF for ch in query)
+
+
+@dataclass
+class FanOutResult:
+    results: list = field(default_factory=list)     # 再ランキング後の上位 top_k
+    variants: list = field(default_factory=list)    # {"query", "n", "ms", "error"}
+    raw: int = 0
+    unique: int = 0
+    elapsed: float = 0.0
+    english: str = ""
+
+
+def fan_out_search(query, rank_query, search, translate=None, sites=SITE_FILTERS, top_k=TOP_K, max_workers=4):
+    """query を展開して search(q) を並列に呼び、重複を除いて rank_query で再ランキング
+
+    translate(query): 英訳したクエリ (日本語などを含むときだけ呼ぶ)。英訳も同じくサイト指定に展開して同じプールで並べる。
+    1つも検索できなかったら最初の例外を投げる。
+    """
+    t0 = time.perf_counter()
+    out = FanOutResult()
+    per_variant = {}
+
+    def _search(q):
+        start = time.perf_counter()
+        try:
+            return q, search(q), None, (time.perf_counter() - start) * 1000
+        except Exception as e:
+            return q, [], e, (time.perf_counter() - start) * 1000
+
+    variants = expand_query(query, sites)
+    with ThreadPoolExecutor(max_workers, thread_name_prefix="fanout") as pool:
+        futures = [pool.submit(_search, q) for q in variants]
+        translation = pool.submit(translate, query) if translate and needs_translation(query) else None
+        if translation is not None:
+            try:
+                out.english = (translation.result() or "").strip()
+            except Exception:
+                out.english = ""
+            if out.english and out.english.lower() != query.strip().lower():
+                english = [q for q in expand_query(out.english, sites) if q not in variants]
+                variants += english
+                futures += [pool.submit(_search, q) for q in english]
+        for fut in as_completed(futures):
+            q, results, error, ms = fut.result()
+            per_variant[q] = (results, error, ms)
+
+    ordered = [q for q in variants if q in per_variant]
+    merged, errors = [], []
+    for q in ordered:
+        results, error, ms = per_variant[q]
+        out.variants.append({"query": q, "n": len(results), "ms": round(ms, 1),
+                             "error": f"{type(error).__name__}: {error}" if error else ""})
+        if error is not None:
+            errors.append(error)
+        merged.extend(results)
+    if errors and len(errors) == len(ordered):
+        raise errors[0]
+    unique = dedupe(merged)
+    out.raw, out.unique = len(merged), len(unique)
+    out.results = rerank(unique, f"{rank_query} {query} {out.english}", top_k=top_k)
+    out.elapsed = time.perf_counter() - t0
+    return out
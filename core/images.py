@@ -0,0 +1,175 @@
+"""アップロード画像の前処理 (縮小・再圧縮・内容ハッシュでキャッシュ)
+
+スマホで撮ったモニター写真や X 線画像をそのまま送らず、
+画素数を MAX_PIXELS 以下に縮小して JPEG に再圧縮してから Gemini に渡す。
+結果は元ファイルの内容ハッシュ (+ 設定) をキーにディスクキャッシュへ保存するので、
+同じ画像での再診断は再エンコードしない。送信パートは inline blob (dict) なので
+core.llm の応答キャッシュのキーも画素の再ハッシュなしで安定する。
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from core.disk_cache import DiskCache, cache_dir
+
+MAX_PIXELS = 1_000_000   # 約 1MP (1152x864 程度)。モニター数値・X 線の読影には十分
+JPEG_QUALITY = 85
+MIME = "image/jpeg"
+
+
+@dataclass
+class PreparedImage:
+    name: str
+    part: dict              # generate_content に渡す {"mime_type", "data"}
+    digest: str             # 元ファイルの sha256
+    original_bytes: int
+    original_size: tuple    # (幅, 高さ)。キャッシュヒット時は None
+    size: tuple
+    encode_ms: float
+    cached: bool
+
+    @property
+    def bytes(self):
+        return len(self.part["data"])
+
+    def row(self):
+        return {
+            "Image": self.name,
+            "Original": f"{self.original_size[0]}x{self.original_size[1]}" if self.original_size else "-",
+            "Sent": f"{self.size[0]}x{self.size[1]}",
+            "Original KB": round(self.original_bytes / 1024, 1),
+            "Sent KB": round(self.bytes / 1024, 1),
+            "Encode ms": round(self.encode_ms, 1),
+            "Cache": "HIT" if self.cached else "MISS",
+        }
+
+
+def _read(upload):
+    if isinstance(upload, (bytes, bytearray)):
+        return bytes(upload), "image"
+    name = getattr(upload, "name", "image")
+    if hasattr(upload, "getvalue"):
+        return upload.getvalue(), name
+    upload.seek(0)
+    return upload.read(), name
+
+
+def target_size(size, max_pixels=MAX_PIXELS):
+    """縦横比を保って max_pixels 以下に収まる大きさ (縮小のみ)"""
+    w, h = size
+    if w * h <= max_pixels:
+        return size
+    scale = (max_pixels / (w * h)) ** 0.5
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+def encode(data, max_pixels=MAX_PIXELS, quality=JPEG_QUALITY):
+    """元画像の bytes → (JPEG bytes, 元の大きさ, 送信する大きさ)"""
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(data))
+    original = img.size
+    size = target_size(original, max_pixels)
+    if img.format == "JPEG" and size != original:
+        # DCT 段階で 1/2〜1/8 に縮小してデコード (巨大な写真の展開を避ける)
+        img.draft("RGB" if img.mode != "L" else "L", size)
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("I", "I;16", "I;16B", "I;16L", "F"):
+        # 16bit の X 線等: そのまま L にすると 255 で飽和するので最小〜最大で 8bit に伸ばす
+        import numpy as np
+        a = np.asarray(img, dtype=np.float32)
+        lo, hi = float(a.min()), float(a.max())
+        a = (a - lo) * (255.0 / (hi - lo)) if hi > lo else np.zeros_like(a)
+        img = Image.fromarray(a.astype(np.uint8), "L")
+    if size != original:
+        # exif の回転で縦横が入れ替わった場合も考慮して取り直す
+        size = target_size(img.size, max_pixels)
+        img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if img.mode not in ("RGB", "L"):
+        if img.mode in ("RGBA", "LA") or "transparency" in img.info:
+            # 透過は白で埋める
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            img = img.convert("RGB")
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=quality, optimize=True)
+    return out.getvalue(), original, img.size
+
+
+class ImageCache:
+    def __init__(self, cache=None, max_pixels=MAX_PIXELS, quality=JPEG_QUALITY):
+        self.cache = cache or DiskCache(os.path.join(cache_dir(), "images.sqlite"), max_bytes=128 * 1024 * 1024)
+        self.max_pixels = max_pixels
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def prepare(self, upload):
+        """アップロード1件 → PreparedImage"""
+        data, name = _read(upload)
+        digest = hashlib.sha256(data).hexdigest()
+        key = f"{digest}:{self.max_pixels}:{self.quality}"
+        t = time.perf_counter()
+        blob = self.cache.get(key)
+        if blob is not None:
+            self._count("hits")
+            from PIL import Image
+            size = Image.open(io.BytesIO(blob)).size   # ヘッダのみ読む
+            return PreparedImage(name, {"mime_type": MIME, "data": blob}, digest, len(data),
+                                 None, size, (time.perf_counter() - t) * 1000, True)
+        self._count("misses")
+        blob, original, size = encode(data, self.max_pixels, self.quality)
+        elapsed = (time.perf_counter() - t) * 1000
+        self.cache.set(key, blob)
+        return PreparedImage(name, {"mime_type": MIME, "data": blob}, digest, len(data),
+                             original, size, elapsed, False)
+
+    def prepare_all(self, uploads, max_workers=4):
+        """複数件を並列に処理 (Pillow のデコード・縮小・エンコードは GIL を外す)"""
+        uploads = list(uploads or ())
+        if len(uploads) <= 1:
+            return [self.prepare(u) for u in uploads]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(uploads)), thread_name_prefix="image-prep") as pool:
+            return list(pool.map(self.prepare, uploads))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(self.cache.stats())
+        return stats
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache()
+    return _image_cache
+
+
+def prepare_image(upload):
+    return get_image_cache().prepare(upload)
+
+
+def prepare_images(uploads):
+    return get_image_cache().prepare_all(uploads)
+
+
+def image_report(images):
+    """画像ごとの送信サイズ・エンコード時間 (DataFrame 用の行)"""
+    return [img.row() for img in images]
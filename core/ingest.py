@@ -0,0 +1,469 @@
+"""ベッドサイドモニター / ECMO コンソールの高頻度データ取り込み
+
+CSV・NDJSON ファイルの追記 (tail -f) またはローカル TCP ソケットの NDJSON 行を
+1 Hz 以上で受け取り、患者ごとに固定長のリングバッファへ格納する。
+同時にローリング窓 (平均・最小・最大・傾き) と1分バケットの集約を逐次更新するので、
+グラフや AI 用トレンド要約は生サンプルを走査せずに済む。確定した1分平均は
+trend_sink で患者の経過表にも追記され、既存のトレンドグラフ・要約・ルール判定に載る。
+メモリ使用量は容量で頭打ちになり、数日間の ECMO 管理でも一定。
+"""
+import csv
+import io
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from core.physiology import DERIVED_COLUMNS, INPUT_COLUMNS, derive
+from core.schema import COLUMN_INDEX, COLUMN_NAMES, TIME_COLUMN
+
+WINDOWS = {"1min": 60.0, "5min": 300.0, "1h": 3600.0}
+
+
+class RingBuffer:
+    """時刻 (epoch 秒) + 固定幅 float64 行の環状バッファ"""
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self._t = np.full(capacity, np.nan)
+        self._v = np.full((capacity, width), np.nan)
+        self._head = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, t, row):
+        i = self._head
+        self._t[i] = t
+        self._v[i] = row
+        self._head = (i + 1) % self.capacity
+        self.count += 1
+
+    def arrays(self):
+        """古い順に並べた (times, values) のコピー"""
+        if self.count < self.capacity:
+            return self._t[:self.count].copy(), self._v[:self.count].copy()
+        order = np.r_[self._head:self.capacity, 0:self._head]
+        return self._t[order], self._v[order]
+
+
+class RollingWindow:
+    """直近 seconds 秒の平均・最小・最大・傾き (単位/時) を O(1) 償却で更新する
+
+    保持点数は max_points で頭打ち (窓が長いときは最小間隔で間引く)。
+    """
+
+    def __init__(self, seconds, max_points=3600):
+        self.seconds = seconds
+        self.min_dt = seconds / max_points
+        self._buf = deque()
+        self._mins = deque()
+        self._maxs = deque()
+        self._t0 = None
+        self._pushes = 0
+        self._reset_sums()
+
+    def _reset_sums(self):
+        self.n = 0
+        self._sx = self._st = self._stt = self._stx = 0.0
+
+    def _add(self, t, x, sign):
+        u = t - self._t0
+        self.n += sign
+        self._sx += sign * x
+        self._st += sign * u
+        self._stt += sign * u * u
+        self._stx += sign * u * x
+
+    def push(self, t, x):
+        if x != x:  # NaN
+            return
+        if self._buf and t - self._buf[-1][0] < self.min_dt:
+            return
+        if self._t0 is None:
+            self._t0 = t
+        self._buf.append((t, x))
+        self._add(t, x, +1)
+        while self._mins and self._mins[-1][1] >= x:
+            self._mins.pop()
+        self._mins.append((t, x))
+        while self._maxs and self._maxs[-1][1] <= x:
+            self._maxs.pop()
+        self._maxs.append((t, x))
+        self._expire(t)
+        self._pushes += 1
+        if self._pushes % 4096 == 0:
+            self._rebase()
+
+    def _expire(self, now):
+        limit = now - self.seconds
+        while self._buf and self._buf[0][0] < limit:
+            t, x = self._buf.popleft()
+            self._add(t, x, -1)
+        while self._mins and self._mins[0][0] < limit:
+            self._mins.popleft()
+        while self._maxs and self._maxs[0][0] < limit:
+            self._maxs.popleft()
+
+    def _rebase(self):
+        # 長時間運用での累積誤差を捨てて基準時刻を取り直す
+        self._t0 = self._buf[0][0] if self._buf else None
+        self._reset_sums()
+        for t, x in self._buf:
+            self._add(t, x, +1)
+
+    def stats(self):
+        if not self.n:
+            return None
+        mean = self._sx / self.n
+        denom = self.n * self._stt - self._st ** 2
+        slope = (self.n * self._stx - self._st * self._sx) / denom * 3600 if denom > 1e-9 else 0.0
+        return {
+            "mean": mean, "min": self._mins[0][1], "max": self._maxs[0][1],
+            "slope_per_h": slope, "n": self.n, "last": self._buf[-1][1],
+        }
+
+
+def _to_epoch(value):
+    """時刻 → epoch 秒 (UTC 基準)。タイムゾーンのない表記はローカル時刻として解釈する"""
+    if value is None or value == "":
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if len(text) <= 8:
+        t = datetime.strptime(text, "%H:%M:%S" if text.count(":") == 2 else "%H:%M").time()
+        return datetime.combine(datetime.now().date(), t).timestamp()
+    return datetime.fromisoformat(text).timestamp()
+
+
+class PatientFeed:
+    """1患者分の取り込み状態 (生サンプル・1分バケット・ローリング窓)"""
+
+    def __init__(self, raw_capacity=3600, minute_capacity=7 * 24 * 60, windows=WINDOWS):
+        width = len(COLUMN_NAMES)
+        self.raw = RingBuffer(raw_capacity, width)
+        self.minute_mean = RingBuffer(minute_capacity, width)
+        self.minute_min = RingBuffer(minute_capacity, width)
+        self.minute_max = RingBuffer(minute_capacity, width)
+        self.windows = {label: {name: RollingWindow(sec) for name in COLUMN_NAMES} for label, sec in windows.items()}
+        self._window_cols = [[cols[name] for name in COLUMN_NAMES] for cols in self.windows.values()]
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.errors = 0
+        self.last_time = None
+        # sink(t, {列名: 値}): 確定した1分平均ごとに呼ぶ (取り込みスレッド・ロックの外)
+        self.sink = None
+        self._closed = []
+        self._bucket = None
+        self._b_sum = np.zeros(width)
+        self._b_cnt = np.zeros(width)
+        self._b_min = np.full(width, np.inf)
+        self._b_max = np.full(width, -np.inf)
+
+    def ingest(self, record):
+        self.ingest_many([record])
+
+    def ingest_many(self, records):
+        """レコード群を取り込む。派生指標はバッチ単位でベクトル計算する
+
+        時刻を読めないレコードは捨てて errors に数える (バッチの残りは取り込む)。
+        """
+        parsed = []
+        for record in records:
+            try:
+                parsed.append((_to_epoch(record.get(TIME_COLUMN, record.get("ts"))), record))
+            except (TypeError, ValueError):
+                pass
+        self.reject(len(records) - len(parsed))
+        m = len(parsed)
+        if not m:
+            return
+        times = np.empty(m)
+        rows = np.full((m, len(COLUMN_NAMES)), np.nan)
+        for i, (t, record) in enumerate(parsed):
+            times[i] = t
+            for name, value in record.items():
+                j = COLUMN_INDEX.get(name)
+                if j is not None and value not in (None, ""):
+                    try:
+                        rows[i, j] = float(value)
+                    except (TypeError, ValueError):
+                        pass
+        # モニター側で計算されない派生指標 (Flow/CO 比など) を補う
+        d = derive({name: rows[:, COLUMN_INDEX[name]] for name in INPUT_COLUMNS})
+        for name in DERIVED_COLUMNS:
+            col = rows[:, COLUMN_INDEX[name]]
+            missing = np.isnan(col)
+            col[missing] = d[name][missing]
+        with self.lock:
+            for t, row in zip(times.tolist(), rows):
+                self._push(t, row)
+            closed, self._closed = self._closed, []
+        if self.sink is not None:
+            for t, mean in closed:
+                self.sink(t, {name: float(v) for name, v in zip(COLUMN_NAMES, mean) if v == v})
+
+    def reject(self, n):
+        """読めなかったレコード数を数える"""
+        if n:
+            with self.lock:
+                self.errors += n
+
+    def _push(self, t, row):
+        self.raw.append(t, row)
+        present = np.flatnonzero(~np.isnan(row))
+        values = row[present].tolist()
+        for cols in self._window_cols:
+            for j, x in zip(present.tolist(), values):
+                cols[j].push(t, x)
+        bucket = int(t // 60)
+        if self._bucket is not None and bucket != self._bucket:
+            self._flush_bucket()
+        self._bucket = bucket
+        ok = ~np.isnan(row)
+        self._b_sum[ok] += row[ok]
+        self._b_cnt[ok] += 1
+        self._b_min[ok] = np.minimum(self._b_min[ok], row[ok])
+        self._b_max[ok] = np.maximum(self._b_max[ok], row[ok])
+        self.samples += 1
+        self.last_time = t
+
+    def _flush_bucket(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(self._b_cnt > 0, self._b_sum / self._b_cnt, np.nan)
+        has = self._b_cnt > 0
+        t = self._bucket * 60.0
+        self.minute_mean.append(t, mean)
+        if self.sink is not None:
+            self._closed.append((t, mean))
+        self.minute_min.append(t, np.where(has, self._b_min, np.nan))
+        self.minute_max.append(t, np.where(has, self._b_max, np.nan))
+        self._b_sum[:] = 0
+        self._b_cnt[:] = 0
+        self._b_min[:] = np.inf
+        self._b_max[:] = -np.inf
+
+    def aggregates(self, window="5min"):
+        """{列名: {mean, min, max, slope_per_h, n, last}} (値のある列のみ)"""
+        with self.lock:
+            cols = self.windows[window]
+            return {name: s for name in COLUMN_NAMES if (s := cols[name].stats()) is not None}
+
+    def minute_frame(self, stat="mean"):
+        """1分バケットの DataFrame (DatetimeIndex, 進行中のバケットは含まない)
+
+        index は他の経過表と同じくタイムゾーンなしのローカル時刻。
+        """
+        import pandas as pd
+        from dateutil.tz import tzlocal
+        ring = {"mean": self.minute_mean, "min": self.minute_min, "max": self.minute_max}[stat]
+        with self.lock:
+            t, v = ring.arrays()
+        local = pd.to_datetime(t, unit="s", utc=True).tz_convert(tzlocal()).tz_localize(None)
+        index = pd.DatetimeIndex(local, name=TIME_COLUMN)
+        return pd.DataFrame(v, index=index, columns=list(COLUMN_NAMES))
+
+    def summary_text(self, window="5min"):
+        """AI プロンプト用の1行/パラメータの要約"""
+        lines = []
+        for name, s in self.aggregates(window).items():
+            lines.append(f"{name} ({window}, n={s['n']}): last {s['last']:.4g}, mean {s['mean']:.4g}, "
+                         f"min {s['min']:.4g}, max {s['max']:.4g}, slope {s['slope_per_h']:+.3g}/h")
+        return "\n".join(lines)
+
+
+def trend_sink(store, patient_id):
+    """確定した1分平均を store (TrendStore / SQLiteTrendStore) の経過表へ追記する sink
+
+    経過表のグラフ・トレンド要約 (summarize_trend)・ルール判定は生サンプルでなくこの1分平均を読む。
+    """
+    def sink(t, values):
+        if values:
+            store.append(patient_id, {TIME_COLUMN: datetime.fromtimestamp(t), **values})
+    return sink
+
+
+# ------------------------------------------------------------------
+# 入力ソース
+# ------------------------------------------------------------------
+class LineParser:
+    """CSV (ヘッダー行あり) または NDJSON の行 → dict (不正行は None)
+
+    時刻はここで1行ずつ epoch 秒に直し、読めない行も None にする。
+    """
+
+    def __init__(self):
+        self.header = None
+
+    def parse(self, lines):
+        records = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+            else:
+                row = next(csv.reader(io.StringIO(line)))
+                if self.header is None:
+                    self.header = row
+                    continue
+                record = dict(zip(self.header, row)) if len(row) == len(self.header) else None
+            records.append(self._with_epoch(record))
+        return records
+
+    @staticmethod
+    def _with_epoch(record):
+        if not isinstance(record, dict):
+            return None
+        try:
+            record[TIME_COLUMN] = _to_epoch(record.get(TIME_COLUMN, record.get("ts")))
+        except (TypeError, ValueError):
+            return None
+        return record
+
+
+def follow(path, stop, from_start=False, poll=0.2):
+    """ファイルへの追記を読み続け、読めた行をまとめて yield する (tail -f)
+
+    from_start=False でも CSV のヘッダー行だけは先頭から読む。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if not from_start:
+            first = f.readline()
+            if first.strip() and not first.lstrip().startswith("{"):
+                yield [first]
+            f.seek(0, os.SEEK_END)
+        pending = ""
+        while not stop.is_set():
+            data = f.read(1 << 20)
+            if not data:
+                time.sleep(poll)
+                continue
+            data = pending + data
+            lines = data.split("\n")
+            pending = lines.pop()
+            if lines:
+                yield lines
+
+
+class _Source:
+    def __init__(self, kind, target):
+        self.kind = kind
+        self.target = target
+        self.stop = threading.Event()
+        self.thread = None
+        self.server = None
+        self.error = None
+
+
+class FeedManager:
+    """患者 ID → PatientFeed と、その入力スレッドを管理する (プロセス共有)"""
+
+    def __init__(self):
+        self._feeds = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def feed(self, patient_id):
+        with self._lock:
+            feed = self._feeds.get(patient_id)
+            if feed is None:
+                feed = self._feeds[patient_id] = PatientFeed()
+            return feed
+
+    def get(self, patient_id):
+        return self._feeds.get(patient_id)
+
+    def source(self, patient_id):
+        return self._sources.get(patient_id)
+
+    def _consume(self, feed, source, batches):
+        parser = LineParser()
+        try:
+            for lines in batches:
+                if source.stop.is_set():
+                    break
+                records = parser.parse(lines)
+                good = [r for r in records if r is not None]
+                feed.reject(len(records) - len(good))
+                feed.ingest_many(good)
+        except Exception as e:
+            source.error = str(e)
+
+    def start_file(self, patient_id, path, from_start=False, sink=None):
+        """path の追記を読むスレッドを起動する (開けなければ OSError、既存の入力はそのまま)
+
+        sink: 確定した1分平均の受け取り先 (trend_sink で経過表へ書く。PatientFeed.sink)
+        """
+        # follow() は最初の next() まで開かないので、ここで一度開いて確かめる
+        open(path, "r", encoding="utf-8").close()
+        self.stop(patient_id)
+        feed = self.feed(patient_id)
+        feed.sink = sink
+        source = _Source("file", path)
+        batches = follow(path, source.stop, from_start=from_start)
+        source.thread = threading.Thread(target=self._consume, args=(feed, source, batches),
+                                         name=f"feed-{patient_id}", daemon=True)
+        self._sources[patient_id] = source
+        source.thread.start()
+        return source
+
+    def start_socket(self, patient_id, port, host="127.0.0.1", sink=None):
+        """TCP で NDJSON / CSV 行を受け付ける (接続ごとに CSV ヘッダーを読む)"""
+        self.stop(patient_id)
+        feed = self.feed(patient_id)
+        feed.sink = sink
+        source = _Source("socket", f"{host}:{port}")
+        manager = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                batches = ([raw.decode("utf-8", "replace")] for raw in self.rfile)
+                manager._consume(feed, source, batches)
+
+        server = socketserver.ThreadingTCPServer((host, port), Handler)
+        server.daemon_threads = True
+        source.server = server
+        source.thread = threading.Thread(target=server.serve_forever, name=f"feed-{patient_id}", daemon=True)
+        self._sources[patient_id] = source
+        source.thread.start()
+        return source
+
+    def stop(self, patient_id):
+        source = self._sources.pop(patient_id, None)
+        if source is None:
+            return
+        source.stop.set()
+        if source.server is not None:
+            source.server.shutdown()
+            source.server.server_close()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_feed_manager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = FeedManager()
+    return _manager
@@ -0,0 +1,204 @@
+"""Gemini 呼び出しまわりの共通処理 (応答キャッシュ・リプレイ)
+
+同じ (モデル, system_instruction, プロンプト, 画像) の組み合わせは
+同じ応答を返すものとして、内容ハッシュをキーに応答テキストを保存する。
+
+KS_LLM_MODE:
+    cache  (既定) キャッシュにあれば再利用、無ければ呼び出して保存
+    replay キャッシュのみ。無ければ ReplayMiss (ネットワークに出ない)
+    off    キャッシュを使わない
+KS_LLM_BACKEND=fake: API を呼ばず core.llm_executor.FakeGemini で応答する (テスト・ベンチ用)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from core.disk_cache import DiskCache, cache_dir
+
+MODE = os.environ.get("KS_LLM_MODE", "cache")
+
+_MODELS_KEY = "models:generateContent"
+
+
+class ReplayMiss(LookupError):
+    """リプレイモードで記録が無いリクエスト"""
+
+
+_configured = None
+_configure_lock = threading.Lock()
+
+
+def configure(api_key):
+    """genai にキーを設定する。genai (import に 1 秒弱) はキーが入って初めて読み込む
+
+    リプレイモード・KS_LLM_BACKEND=fake ではネットワークに出ないので読み込まない。
+    """
+    global _configured
+    if not api_key or MODE == "replay" or os.environ.get("KS_LLM_BACKEND") == "fake" or api_key == _configured:
+        return
+    import google.generativeai as genai
+    with _configure_lock:
+        genai.configure(api_key=api_key)
+        _configured = api_key
+
+
+def iter_text(response):
+    """stream=True のレスポンスからテキスト片だけを取り出す"""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # セーフティ等で parts が空のチャンク
+            continue
+        if text:
+            yield text
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def part_digest(part):
+    """プロンプト要素1つ分のハッシュ (テキスト・PIL 画像・bytes・inline blob)"""
+    if isinstance(part, str):
+        return "text:" + _sha256(part.encode("utf-8"))
+    if isinstance(part, (bytes, bytearray)):
+        return "bytes:" + _sha256(bytes(part))
+    if isinstance(part, dict) and "data" in part:
+        return f"blob:{part.get('mime_type', '')}:" + _sha256(part["data"])
+    if hasattr(part, "tobytes") and hasattr(part, "size"):
+        h = hashlib.sha256(f"{part.mode}:{part.size}".encode("ascii"))
+        h.update(part.tobytes())
+        return "image:" + h.hexdigest()
+    return "repr:" + _sha256(repr(part).encode("utf-8"))
+
+
+def cache_key(model_name, contents, system_instruction=None):
+    if isinstance(contents, (str, bytes)) or not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    payload = [
+        model_name,
+        _sha256((system_instruction or "").encode("utf-8")),
+        [part_digest(p) for p in contents],
+    ]
+    return _sha256(json.dumps(payload).encode("utf-8"))
+
+
+class LLMCache:
+    def __init__(self, cache=None):
+        self.cache = cache or DiskCache(os.path.join(cache_dir(), "llm.sqlite"), max_bytes=128 * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "replay_misses": 0}
+
+    def record(self, name):
+        """stats() の件数 (hits / misses / replay_misses) を1つ増やす"""
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        blob = self.cache.get(key)
+        return None if blob is None else json.loads(blob)
+
+    def put(self, key, record):
+        self.cache.set(key, json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(self.cache.stats())
+        return stats
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def _record(call, contents, system_instruction):
+    parts = []
+    for chunk in call:
+        parts.append(chunk)
+        yield chunk
+    # 最後まで受信できた応答だけを、実際に答えたモデルのキーで保存する
+    key = cache_key(call.model, contents, system_instruction)
+    get_llm_cache().put(key, {"model": call.model, "text": "".join(parts), "created": time.time()})
+
+
+class LLMStream:
+    """generate() の戻り値: テキスト片のイテレータ
+
+    call_id は上流を呼んだ executor の呼び出し ID (core.llm_executor.LLMExecutor.events_for)。
+    キャッシュヒット・実行中の同じ呼び出しに相乗りしたときは None。
+    """
+
+    def __init__(self, chunks, call_id=None):
+        self._chunks = iter(chunks)
+        self.call_id = call_id
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+
+def generate(model_name, contents, system_instruction=None, stream=False, mode=None,
+             fallback=None, deadline=None, hedge=True, api_key=None, kind=None):
+    """テキスト片のイテレータ (LLMStream) を返す (stream=False でも1片のイテレータ)
+
+    キャッシュミス時の API 呼び出しはこの関数の中で即座に開始する
+    (core.llm_executor: 期限・リトライ・fallback モデルへのヘッジ、api_key ごとのレート制限)。
+    同じ入力が実行中なら上流は呼ばずにその応答を最初から共有する (core.throttle)。
+    kind: 遅延履歴の区分 (core.llm_executor.CALL_KINDS。検索語抽出・翻訳は "short")
+    """
+    mode = mode or MODE
+    cache = get_llm_cache()
+    key = cache_key(model_name, contents, system_instruction)
+    if mode != "off":
+        hit = cache.get(key)
+        if hit is not None:
+            cache.record("hits")
+            return LLMStream([hit["text"]])
+        if mode == "replay":
+            cache.record("replay_misses")
+            raise ReplayMiss(f"no recorded response for {model_name} ({key[:12]})")
+        cache.record("misses")
+
+    from core.llm_executor import get_executor
+    from core.throttle import get_single_flight
+
+    started = []
+
+    def start():
+        call = get_executor().generate(model_name, contents, system_instruction=system_instruction, stream=stream,
+                                       fallback=fallback, deadline=deadline, hedge=hedge, api_key=api_key, kind=kind)
+        started.append(call.call_id)
+        return call if mode == "off" else _record(call, contents, system_instruction)
+
+    # start() は先頭の呼び出しのときだけ、この場で呼ばれる
+    chunks = get_single_flight().stream(("llm", key), start)
+    return LLMStream(chunks, started[0] if started else None)
+
+
+def generate_text(model_name, contents, system_instruction=None, mode=None, **options):
+    return "".join(generate(model_name, contents, system_instruction=system_instruction, mode=mode, **options))
+
+
+def recorded_models():
+    """リプレイ用に記録したモデル一覧 (なければ None)"""
+    hit = get_llm_cache().get(_MODELS_KEY)
+    return None if hit is None else hit["models"]
+
+
+def record_models(models):
+    get_llm_cache().put(_MODELS_KEY, {"models": list(models), "created": time.time()})
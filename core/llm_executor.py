@@ -0,0 +1,380 @@
+"""Gemini 呼び出しの実行器 (期限・リトライ・ヘッジ・フォールバック)
+
+generate_content は1回のブロッキング呼び出しで、止まるとベッドサイドで待ち続けることになる。
+呼び出しは試行ごとにスレッドで走らせ、結果を1本のキューで受ける。
+
+  deadline : 最初のテキスト片が届くまでの期限 (秒)。リトライ・ヘッジ込みの全体で数える。
+             ストリーミング開始後は片と片の間隔が STALL_TIMEOUT を超えたら打ち切る
+  retry    : 429 / 5xx / 接続エラーは full jitter の指数バックオフで再試行
+  hedge    : 主モデルの初回応答が過去の p95 (HEDGE_PERCENTILE) を過ぎても来なければ
+             fallback モデルにも同じプロンプトを投げ、先に返した方を採用する
+  fallback : 主モデルが再試行可能なエラーでリトライを使い切ったら fallback モデルで続ける
+
+判断 (開始・ヘッジ・リトライ・採用・失敗) と遅延は logging と events に残す。
+"""
+import hashlib
+import itertools
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from core.throttle import RateLimited, get_limiter
+
+log = logging.getLogger("kusano.llm")
+
+DEADLINE = float(os.environ.get("KS_LLM_DEADLINE", "120"))
+STALL_TIMEOUT = 60.0
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+RETRY_CODES = frozenset({429, 500, 502, 503, 504})
+
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 5
+HEDGE_DEFAULT = 15.0     # 履歴が少ないうちのヘッジ開始 (秒)
+HEDGE_FLOOR = 1.0
+
+# 遅延履歴の区分 (初回応答までの時間が桁で違うので混ぜない)
+#   stream: ストリーミング生成の TTFT / text: 一括生成 / short: 検索語抽出・翻訳などの短い指示
+CALL_KINDS = ("stream", "text", "short")
+
+
+class LLMTimeout(TimeoutError):
+    """期限までに応答が始まらなかった"""
+
+
+def is_retryable(exc):
+    if isinstance(exc, RateLimited):
+        # 手元の制限で期限内に順番が来ない: 再試行しても同じ
+        return False
+    # google.api_core.exceptions は HTTP ステータスを .code に持つ (ResourceExhausted = 429 など)
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code in RETRY_CODES
+    return isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def backoff(retry, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=random):
+    """full jitter: [0, min(cap, base * 2^retry)) の一様乱数"""
+    return rng.uniform(0, min(cap, base * (2 ** retry)))
+
+
+def gemini_call(model_name, contents, system_instruction=None, stream=False, timeout=None):
+    """実際の API 呼び出し。テキスト片のイテレータを返す"""
+    import google.generativeai as genai
+    from core.llm import iter_text
+    model = genai.GenerativeModel(model_name=model_name, system_instruction=system_instruction)
+    options = {"timeout": timeout} if timeout else None
+    if stream:
+        return iter_text(model.generate_content(contents, stream=True, request_options=options))
+    return iter([model.generate_content(contents, request_options=options).text])
+
+
+FAKE_MODELS = ("models/gemini-1.5-pro", "models/gemini-1.5-flash")
+
+
+class FakeGemini:
+    """テスト・ベンチ用の決定的な Gemini (gemini_call と同じ引数で呼べる)
+
+    latency: 最初のテキスト片までの秒数、chunk_delay: 片と片の間隔
+    response_chars: KUSANO_BRAIN 形式 (4セクション) の応答の長さ
+    system_instruction なしの短い指示 (検索語抽出・翻訳) には1行だけ返す。
+    """
+
+    def __init__(self, latency=0.0, chunk_delay=0.0, response_chars=2000, chunk_chars=40, fail=None):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.response_chars = response_chars
+        self.chunk_chars = chunk_chars
+        self.fail = fail
+        self.calls = []
+
+    def reply(self, contents, system_instruction=None):
+        parts = [contents] if isinstance(contents, str) else list(contents)
+        prompt = next((p for p in parts if isinstance(p, str)), "")
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        if system_instruction is None and len(prompt) < 1000:
+            return f"sepsis ARDS ECMO {digest}"
+        from core.sections import SECTION_MARKERS
+        size = max(1, self.response_chars // len(SECTION_MARKERS))
+        line = f"- [{digest}] images={len(parts) - 1} prompt={len(prompt)} chars\n"
+        return "".join(f"{marker}\n" + (line * (size // len(line) + 1))[:size] + "\n" for marker in SECTION_MARKERS)
+
+    def __call__(self, model_name, contents, system_instruction=None, stream=False, timeout=None):
+        self.calls.append((model_name, stream))
+        return self._chunks(self.reply(contents, system_instruction), stream)
+
+    def _chunks(self, text, stream):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail:
+            raise self.fail
+        if not stream:
+            yield text
+            return
+        for i in range(0, len(text), self.chunk_chars):
+            if i and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield text[i:i + self.chunk_chars]
+
+
+class _Attempt:
+    """1回分の試行。スレッドで call を回し、(self, 種別, 値) を共有キューへ流す"""
+
+    def __init__(self, call_id, model, number, hedge, q, fn):
+        self.call_id = call_id
+        self.model = model
+        self.number = number
+        self.hedge = hedge
+        self.started = time.perf_counter()
+        self.first_chunk = None
+        self.cancelled = False
+        self.failed = False
+        self._q = q
+        threading.Thread(target=self._run, args=(fn,), daemon=True, name=f"llm-{model}-{number}").start()
+
+    def _run(self, fn):
+        try:
+            for chunk in fn():
+                if self.cancelled:
+                    return
+                self._q.put((self, "chunk", chunk))
+            self._q.put((self, "done", None))
+        except Exception as e:
+            self._q.put((self, "error", e))
+
+
+class HedgedCall:
+    """generate 1回分。生成と同時に試行を開始し、イテレートで採用した試行のテキスト片を返す"""
+
+    def __init__(self, executor, model, contents, system_instruction, stream, fallback, deadline, hedge, api_key=None,
+                 kind=None):
+        self.executor = executor
+        self.api_key = api_key
+        self.kind = kind or ("stream" if stream else "text")
+        self.call_id = next(executor._ids)
+        self.model = model              # 採用されたモデル (確定までは主モデル)
+        self.requested = model
+        self.fallback = fallback if fallback and fallback != model else None
+        self.hedge = hedge and self.fallback is not None
+        self._args = (contents, system_instruction, stream)
+        self._q = queue.Queue()
+        self._t0 = time.perf_counter()
+        self._budget = deadline or executor.deadline
+        self._deadline = self._t0 + self._budget
+        self._attempts = []
+        self._retries = {}
+        self._scheduled = []        # (開始時刻, モデル)
+        self._fallback_started = False
+        self._hedge_at = self._t0 + executor.hedge_delay(model, self.kind) if self.hedge else None
+        self._start(model)
+        self._iter = self._run()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iter)
+
+    def _event(self, event, model, **fields):
+        self.executor._event(self.call_id, event, model, round((time.perf_counter() - self._t0) * 1000, 1), **fields)
+
+    def _start(self, model, hedge=False):
+        contents, system_instruction, stream = self._args
+        deadline, api_key, call = self._deadline, self.api_key, self.executor.call
+
+        def run():
+            # 試行 (リトライ・ヘッジ含む) ごとに API キーのトークンを1つ使う
+            get_limiter().acquire_llm(api_key, timeout=max(0.0, deadline - time.perf_counter()))
+            return call(model, contents, system_instruction=system_instruction, stream=stream,
+                        timeout=max(1.0, deadline - time.perf_counter()))
+
+        attempt = _Attempt(self.call_id, model, len(self._attempts) + 1, hedge, self._q, run)
+        self._attempts.append(attempt)
+        if model == self.fallback:
+            self._fallback_started = True
+        self._event("hedge" if hedge else "start", model, attempt=attempt.number)
+
+    def _live(self):
+        return [a for a in self._attempts if not a.cancelled and not a.failed]
+
+    def _cancel_all(self, keep=None):
+        for a in self._attempts:
+            if a is not keep:
+                a.cancelled = True
+
+    def _run(self):
+        winner = None
+        last_error = None
+        while True:
+            now = time.perf_counter()
+            if winner is None:
+                self._tick(now)
+                wakeups = [self._deadline] + [t for t, _ in self._scheduled]
+                if self._hedge_at is not None:
+                    wakeups.append(self._hedge_at)
+                timeout = min(wakeups) - now
+            else:
+                timeout = STALL_TIMEOUT
+            try:
+                attempt, kind, value = self._q.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                now = time.perf_counter()
+                if winner is not None:
+                    self._cancel_all()
+                    self._event("stall", winner.model)
+                    raise LLMTimeout(f"{winner.model}: no output for {STALL_TIMEOUT:.0f}s")
+                if now >= self._deadline:
+                    self._cancel_all()
+                    self._event("deadline", self.requested)
+                    raise LLMTimeout(f"{self.requested}: no response within {self._budget:g}s")
+                continue
+
+            if attempt.cancelled:
+                continue
+            if kind == "chunk":
+                if attempt.first_chunk is None:
+                    attempt.first_chunk = time.perf_counter() - attempt.started
+                    self.executor.observe(attempt.model, attempt.first_chunk, self.kind)
+                if winner is None:
+                    winner = attempt
+                    self.model = attempt.model
+                    self._hedge_at = None
+                    self._scheduled = []
+                    self._cancel_all(keep=winner)
+                    self._event("win", attempt.model, attempt=attempt.number,
+                                first_chunk_ms=round(attempt.first_chunk * 1000, 1), hedge=attempt.hedge)
+                if attempt is winner:
+                    yield value
+            elif kind == "done":
+                if winner is None:
+                    # 空の応答: そのまま採用 (再試行しても同じ結果になる)
+                    winner = attempt
+                    self.model = attempt.model
+                    self._cancel_all(keep=winner)
+                if attempt is winner:
+                    self._event("done", attempt.model, attempt=attempt.number)
+                    return
+            else:
+                attempt.failed = True
+                self._event("error", attempt.model, attempt=attempt.number, error=f"{type(value).__name__}: {value}")
+                if attempt is winner:
+                    # 途中まで表示済みの応答は再試行しない
+                    raise value
+                last_error = value
+                self._after_error(attempt, value)
+                if not self._live() and not self._scheduled:
+                    self._event("fail", self.requested)
+                    raise last_error
+
+    def _tick(self, now):
+        # ヘッジ開始・バックオフ明けの再試行
+        if self._hedge_at is not None and now >= self._hedge_at:
+            self._hedge_at = None
+            if not self._fallback_started:
+                self._start(self.fallback, hedge=True)
+        due = [m for t, m in self._scheduled if t <= now]
+        if due:
+            self._scheduled = [(t, m) for t, m in self._scheduled if t > now]
+            for model in due:
+                self._start(model)
+
+    def _after_error(self, attempt, error):
+        model = attempt.model
+        now = time.perf_counter()
+        if not is_retryable(error):
+            return
+        n = self._retries.get(model, 0)
+        if n < self.executor.max_retries:
+            delay = backoff(n)
+            if now + delay < self._deadline:
+                self._retries[model] = n + 1
+                self._scheduled.append((now + delay, model))
+                self._event("retry", model, retry=n + 1, backoff_ms=round(delay * 1000, 1))
+                return
+        if model != self.fallback and self.fallback and not self._fallback_started:
+            self._hedge_at = None
+            self._start(self.fallback)
+            self._event("fallback", self.fallback)
+
+
+class LLMExecutor:
+    """期限・リトライ・ヘッジ付きの呼び出し。call(model, contents, system_instruction, stream, timeout) は差し替え可能"""
+
+    def __init__(self, call=gemini_call, deadline=DEADLINE, max_retries=MAX_RETRIES, history=50):
+        self.call = call
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self._latency = {}      # (model, kind) -> deque[秒]
+        self._history = history
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.events = deque(maxlen=500)
+
+    def observe(self, model, seconds, kind="stream"):
+        with self._lock:
+            self._latency.setdefault((model, kind), deque(maxlen=self._history)).append(seconds)
+
+    def hedge_delay(self, model, kind="stream"):
+        """同じ区分 (kind) の呼び出しでの model の初回応答遅延の p95 (履歴が少なければ HEDGE_DEFAULT)"""
+        with self._lock:
+            samples = list(self._latency.get((model, kind), ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT
+        return max(HEDGE_FLOOR, float(np.percentile(samples, HEDGE_PERCENTILE)))
+
+    def _event(self, call_id, event, model, t_ms, **fields):
+        record = {"call": call_id, "event": event, "model": model, "t_ms": t_ms, **fields}
+        self.events.append(record)
+        log.log(logging.WARNING if event in ("error", "deadline", "stall", "fail") else logging.INFO,
+                "llm call=%d %s model=%s t=%.0fms %s", call_id, event, model, t_ms,
+                " ".join(f"{k}={v}" for k, v in fields.items()))
+
+    def generate(self, model, contents, system_instruction=None, stream=False, fallback=None, deadline=None, hedge=True,
+                 api_key=None, kind=None):
+        """kind: CALL_KINDS のいずれか (省略時は stream なら "stream"、それ以外は "text")"""
+        return HedgedCall(self, model, contents, system_instruction, stream, fallback, deadline, hedge, api_key, kind)
+
+    def events_for(self, call_id):
+        """呼び出し call_id の events (同時に走る他セッションの呼び出しは含まない)"""
+        if call_id is None:
+            return []
+        return [e for e in list(self.events) if e["call"] == call_id]
+
+    def stats(self, kind="stream"):
+        """kind の呼び出しのモデル別 初回応答遅延"""
+        with self._lock:
+            latency = {m: list(v) for (m, k), v in self._latency.items() if k == kind}
+        return {m: {"n": len(v), "p50_ms": round(float(np.percentile(v, 50)) * 1000, 1),
+                    "p95_ms": round(float(np.percentile(v, 95)) * 1000, 1)}
+                for m, v in latency.items() if v}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = LLMExecutor(call=_default_call())
+    return _executor
+
+
+def _default_call():
+    if os.environ.get("KS_LLM_BACKEND") == "fake":
+        return FakeGemini()
+    return gemini_call
+
+
+def set_llm_call(call):
+    """API 呼び出しを差し替える (テスト・ベンチ用)"""
+    get_executor().call = call
@@ -0,0 +1,155 @@
+"""Gemini モデル一覧のプロセス共有キャッシュ
+
+サイドバーは rerun のたびに描画されるため、`genai.list_models()` を毎回呼ぶと
+number_input の1キー入力ごとにネットワーク往復が発生する。
+ここでは API キー単位でモデル一覧を保持し、TTL 切れ後は古い一覧を即返しつつ
+バックグラウンドで再取得する (stale-while-revalidate)。
+"""
+import hashlib
+import os
+import threading
+import time
+
+DEFAULT_TTL = float(os.environ.get("KS_MODEL_CATALOG_TTL", "600"))
+
+
+def fetch_generate_models(api_key):
+    """generateContent 対応モデル名の一覧を API から取得する"""
+    from core.tracing import get_tracer
+    with get_tracer().span("models"):
+        return _fetch_generate_models(api_key)
+
+
+def _fetch_generate_models(api_key):
+    from core import llm
+    if os.environ.get("KS_LLM_BACKEND") == "fake":
+        from core.llm_executor import FAKE_MODELS
+        return list(FAKE_MODELS)
+    if llm.MODE == "replay":
+        models = llm.recorded_models()
+        if models is None:
+            raise llm.ReplayMiss("no recorded model list")
+        return models
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+    if llm.MODE != "off":
+        llm.record_models(models)
+    return models
+
+
+def default_model_index(model_list, preferred):
+    """preferred を含む最初のモデルの index (なければ 0)"""
+    for i, m_name in enumerate(model_list):
+        if preferred in m_name:
+            return i
+    return 0
+
+
+class _Entry:
+    __slots__ = ("models", "fetched_at", "refreshing", "lock")
+
+    def __init__(self):
+        self.models = None
+        self.fetched_at = 0.0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+
+class ModelCatalog:
+    """API キーごとのモデル一覧キャッシュ (TTL + バックグラウンド更新)"""
+
+    def __init__(self, fetcher=fetch_generate_models, ttl=DEFAULT_TTL):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+    @staticmethod
+    def _key(api_key):
+        # 生のキーをメモリ上の辞書キーとして保持しない
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _entry(self, api_key):
+        key = self._key(api_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            return entry
+
+    def get(self, api_key):
+        """モデル一覧を返す。初回のみ同期取得し、以降は rerun をブロックしない"""
+        entry = self._entry(api_key)
+        if entry.models is None:
+            # 初回ロード: 同じキーの同時アクセスは1回の取得にまとめる
+            with entry.lock:
+                if entry.models is None:
+                    self._count("misses")
+                    entry.models = list(self.fetcher(api_key))
+                    entry.fetched_at = time.monotonic()
+                    return entry.models
+            self._count("hits")
+            return entry.models
+
+        if time.monotonic() - entry.fetched_at < self.ttl:
+            self._count("hits")
+            return entry.models
+
+        self._count("stale_hits")
+        self._refresh_async(api_key, entry)
+        return entry.models
+
+    def _refresh_async(self, api_key, entry):
+        with entry.lock:
+            if entry.refreshing:
+                return
+            entry.refreshing = True
+
+        def _run():
+            try:
+                models = list(self.fetcher(api_key))
+                entry.models = models
+                entry.fetched_at = time.monotonic()
+                self._count("refreshes")
+            except Exception:
+                # 失敗時は古い一覧を使い続け、次回アクセスで再試行する
+                self._count("errors")
+            finally:
+                entry.refreshing = False
+
+        threading.Thread(target=_run, name="model-catalog-refresh", daemon=True).start()
+
+    def invalidate(self, api_key=None):
+        with self._lock:
+            if api_key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._key(api_key), None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """プロセス全体で共有するカタログ (全セッション・全エントリポイント共通)"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ModelCatalog()
+    return _catalog
+
+
+def list_generate_models(api_key):
+    return get_catalog().get(api_key)
@@ -0,0 +1,347 @@
+"""端末をまたいで共有する患者トレンドストア (SQLite / WAL)
+
+session_state の TrendStore はブラウザごとに空で、リロードで消える。
+SQLiteTrendStore は同じ get / append / replace / put / clear を持ち、
+サーバー内の全セッションで1つを共有する (get_patient_store)。
+
+- 読み出し: プロセス内の PatientTrend キャッシュを返す。patients 表の version を
+  主キーで1回引いて照合するだけなので、session_state 参照とほぼ同じコスト。
+  他プロセスが追記していれば差分 (id > last_id) だけ、置換していれば全件を読み直す。
+- 追記: キャッシュへ即時反映し、DB へは書き込みスレッドがまとめて1トランザクションで書く。
+- 置換・消去: その場で書く (置換前に保留中の追記を先に書き出す)。
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from core.schema import COLUMN_INDEX, COLUMN_NAMES
+from core.trend_store import PatientTrend
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FLUSH_INTERVAL = 0.2
+FLUSH_ROWS = 500
+
+# PRAGMA user_version。1 (または 0 で samples 表あり): data が JSON 文字列、2: layouts 表 + float64 BLOB
+SCHEMA_VERSION = 2
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS samples ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id TEXT NOT NULL,"
+    " t INTEGER NOT NULL, layout INTEGER NOT NULL, data BLOB NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS samples_patient_time ON samples (patient_id, t)",
+    "CREATE INDEX IF NOT EXISTS samples_patient_id ON samples (patient_id, id)",
+    "CREATE TABLE IF NOT EXISTS patients ("
+    " patient_id TEXT PRIMARY KEY, version INTEGER NOT NULL, generation INTEGER NOT NULL,"
+    " last_id INTEGER NOT NULL, updated REAL NOT NULL)",
+    # 行の列並び。列レジストリが変わっても古い行は列名で読み替える
+    "CREATE TABLE IF NOT EXISTS layouts (id INTEGER PRIMARY KEY, names TEXT NOT NULL UNIQUE)",
+)
+MIGRATE_BATCH = 10_000
+
+
+def data_dir():
+    path = os.environ.get("KS_DATA_DIR") or os.path.join(_ROOT, ".data")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@dataclass
+class _Entry:
+    trend: PatientTrend
+    version: int = 0        # 反映済みの patients.version
+    generation: int = 0     # 置換・消去のたびに増える (差分読み込みの可否)
+    last_id: int = 0        # 反映済みの samples.id の最大
+
+
+def _encode(values):
+    """1行分の値 (COLUMN_NAMES 順の float64) を BLOB で"""
+    return np.ascontiguousarray(values, dtype=np.float64).tobytes()
+
+
+class SQLiteTrendStore:
+    """患者 ID → PatientTrend (SQLite 永続化 + プロセス内キャッシュ)"""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, flush_rows=FLUSH_ROWS):
+        self.path = path
+        self.flush_rows = flush_rows
+        self._lock = threading.RLock()
+        self._wake = threading.Condition(self._lock)
+        self._cache = {}
+        self._pending = []   # (patient_id, t_ns, layout, data_blob)
+        self._stats = {"hits": 0, "incremental": 0, "loads": 0, "flushes": 0, "rows_written": 0}
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._layout = self._open_schema()
+        self._stop = False
+        self._writer = threading.Thread(target=self._run_writer, args=(flush_interval,), daemon=True,
+                                        name="patient-store-writer")
+        self._writer.start()
+
+    # --- スキーマ ---
+    def _open_schema(self):
+        """表を作り、古い版の DB なら移行して、現在の列並びの layout id を返す"""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            columns = [r[1] for r in conn.execute("PRAGMA table_info(samples)")]
+            legacy = version < SCHEMA_VERSION and columns and "layout" not in columns
+            if legacy:
+                # 索引は表の改名についてくるので、新しい表に作り直せるよう先に消す
+                conn.execute("DROP INDEX IF EXISTS samples_patient_time")
+                conn.execute("DROP INDEX IF EXISTS samples_patient_id")
+                conn.execute("ALTER TABLE samples RENAME TO samples_json")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            names = "\t".join(COLUMN_NAMES)
+            conn.execute("INSERT OR IGNORE INTO layouts (names) VALUES (?)", (names,))
+            layout = conn.execute("SELECT id FROM layouts WHERE names = ?", (names,)).fetchone()[0]
+            if legacy:
+                self._migrate_json(layout)
+            if version < SCHEMA_VERSION:
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return layout
+
+    def _migrate_json(self, layout):
+        """JSON 文字列の行を BLOB に書き直す (id はそのまま。列レジストリにない列名は捨てる)"""
+        conn = self._conn
+        width = len(COLUMN_NAMES)
+        last = 0
+        while True:
+            rows = conn.execute("SELECT id, patient_id, t, data FROM samples_json WHERE id > ? ORDER BY id LIMIT ?",
+                                (last, MIGRATE_BATCH)).fetchall()
+            if not rows:
+                break
+            out = []
+            for row_id, patient_id, t, data in rows:
+                values = np.full(width, np.nan)
+                for name, v in json.loads(data).items():
+                    j = COLUMN_INDEX.get(name)
+                    if j is not None:
+                        values[j] = v
+                out.append((row_id, patient_id, t, layout, _encode(values)))
+            conn.executemany("INSERT INTO samples (id, patient_id, t, layout, data) VALUES (?, ?, ?, ?, ?)", out)
+            last = rows[-1][0]
+        conn.execute("DROP TABLE samples_json")
+        # 移行前のキャッシュを持つプロセスには全件を読み直させる
+        conn.execute("UPDATE patients SET version = version + 1, generation = generation + 1")
+
+    # --- 読み出し ---
+    def _head(self, patient_id):
+        return self._conn.execute(
+            "SELECT version, generation, last_id FROM patients WHERE patient_id = ?", (patient_id,)
+        ).fetchone()
+
+    def _rows(self, sql, args):
+        rows = self._conn.execute(sql, args).fetchall()
+        if not rows:
+            return 0, np.array([], dtype="datetime64[ns]"), {}
+        ids, times, layouts, blobs = zip(*rows)
+        width = len(COLUMN_NAMES)
+        if all(layout == self._layout for layout in layouts):
+            block = np.frombuffer(b"".join(blobs), dtype=np.float64).reshape(len(rows), width)
+        else:
+            block = np.full((len(rows), width), np.nan)
+            for layout in set(layouts):
+                names = self._conn.execute("SELECT names FROM layouts WHERE id = ?", (layout,)).fetchone()[0].split("\t")
+                sel = np.fromiter((k for k, lay in enumerate(layouts) if lay == layout), dtype=np.int64)
+                old = np.frombuffer(b"".join(blobs[k] for k in sel), dtype=np.float64).reshape(len(sel), len(names))
+                for src, name in enumerate(names):
+                    j = COLUMN_INDEX.get(name)
+                    if j is not None:
+                        block[sel, j] = old[:, src]
+        return (ids[-1], np.array(times, dtype=np.int64).astype("datetime64[ns]"),
+                {name: block[:, j] for j, name in enumerate(COLUMN_NAMES)})
+
+    def _load(self, patient_id):
+        # 保留中の自分の追記を先に書き出してから全件を読む
+        self._flush_locked()
+        head = self._head(patient_id)
+        trend = PatientTrend()
+        last_id, times, cols = self._rows(
+            "SELECT id, t, layout, data FROM samples WHERE patient_id = ? ORDER BY t, id", (patient_id,))
+        trend.extend_arrays(times, cols)
+        version, generation, _ = head
+        self._stats["loads"] += 1
+        entry = self._cache[patient_id] = _Entry(trend, version, generation, last_id)
+        return entry
+
+    def get(self, patient_id):
+        """PatientTrend を返す (未登録なら空のトレンド。書き込まれるまで DB には作らない)"""
+        with self._lock:
+            entry = self._cache.get(patient_id)
+            head = self._head(patient_id)
+            if head is None:
+                if entry is None:
+                    entry = self._cache[patient_id] = _Entry(PatientTrend())
+                return entry.trend
+            version, generation, last_id = head
+            if entry is not None and entry.version == version:
+                self._stats["hits"] += 1
+                return entry.trend
+            if entry is not None and entry.generation == generation and entry.version:
+                # 他プロセスの追記分だけ読む
+                new_last, times, cols = self._rows(
+                    "SELECT id, t, layout, data FROM samples WHERE patient_id = ? AND id > ? ORDER BY id",
+                    (patient_id, entry.last_id))
+                entry.trend.extend_arrays(times, cols)
+                entry.version, entry.last_id = version, max(entry.last_id, new_last)
+                self._stats["incremental"] += 1
+                return entry.trend
+            return self._load(patient_id).trend
+
+    def range(self, patient_id, start=None, end=None):
+        """時刻範囲 [start, end) だけを DB から読んだ PatientTrend (キャッシュしない)"""
+        lo = np.iinfo(np.int64).min if start is None else int(np.datetime64(start, "ns").astype(np.int64))
+        hi = np.iinfo(np.int64).max if end is None else int(np.datetime64(end, "ns").astype(np.int64))
+        with self._lock:
+            self._flush_locked()
+            _, times, cols = self._rows(
+                "SELECT id, t, layout, data FROM samples WHERE patient_id = ? AND t >= ? AND t < ? ORDER BY t, id",
+                (patient_id, lo, hi))
+        trend = PatientTrend()
+        trend.extend_arrays(times, cols)
+        return trend
+
+    def __contains__(self, patient_id):
+        with self._lock:
+            entry = self._cache.get(patient_id)
+            return (entry is not None and len(entry.trend) > 0) or self._head(patient_id) is not None
+
+    def patients(self):
+        with self._lock:
+            stored = [r[0] for r in self._conn.execute("SELECT patient_id FROM patients ORDER BY patient_id")]
+            local = [pid for pid, e in self._cache.items() if len(e.trend) and pid not in stored]
+        return stored + local
+
+    # --- 書き込み ---
+    def append(self, patient_id, record):
+        with self._lock:
+            trend = self.get(patient_id)
+            i = trend.append(record)
+            self._pending.append((patient_id, int(trend.times[i].astype(np.int64)), self._layout,
+                                  _encode(trend.matrix()[:, i])))
+            if len(self._pending) >= self.flush_rows:
+                self._wake.notify()
+
+    def put(self, patient_id, trend):
+        """患者の履歴を trend で置き換えて保存する"""
+        with self._lock:
+            self._flush_locked()
+            times = trend.times.astype(np.int64).tolist()
+            data = trend.matrix().T
+            rows = [(patient_id, t, self._layout, _encode(v)) for t, v in zip(times, data)]
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM samples WHERE patient_id = ?", (patient_id,))
+                conn.executemany("INSERT INTO samples (patient_id, t, layout, data) VALUES (?, ?, ?, ?)", rows)
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0] if rows else 0
+                version, generation = conn.execute(
+                    "INSERT INTO patients (patient_id, version, generation, last_id, updated) VALUES (?, 1, 1, ?, ?)"
+                    " ON CONFLICT (patient_id) DO UPDATE SET version = version + 1, generation = generation + 1,"
+                    " last_id = excluded.last_id, updated = excluded.updated RETURNING version, generation",
+                    (patient_id, last_id, time.time())).fetchone()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._stats["rows_written"] += len(rows)
+            self._cache[patient_id] = _Entry(trend, version, generation, last_id)
+            return trend
+
+    def replace(self, patient_id, records):
+        trend = PatientTrend()
+        trend.extend(records)
+        return self.put(patient_id, trend)
+
+    def clear(self, patient_id):
+        self.put(patient_id, PatientTrend())
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending), cached=len(self._cache))
+
+    # --- 追記のまとめ書き ---
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT INTO samples (patient_id, t, layout, data) VALUES (?, ?, ?, ?)", pending)
+            # 書き込みロック中の連続挿入なので id は連番 → 患者ごとの最大 id は位置から分かる
+            first_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(pending) + 1
+            last_ids = {}
+            for k, (patient_id, *_) in enumerate(pending):
+                last_ids[patient_id] = first_id + k
+            heads = {}
+            now = time.time()
+            for patient_id, last_id in last_ids.items():
+                heads[patient_id] = conn.execute(
+                    "INSERT INTO patients (patient_id, version, generation, last_id, updated) VALUES (?, 1, 1, ?, ?)"
+                    " ON CONFLICT (patient_id) DO UPDATE SET version = version + 1,"
+                    " last_id = excluded.last_id, updated = excluded.updated RETURNING version, generation, last_id",
+                    (patient_id, last_id, now)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            self._pending = pending + self._pending
+            raise
+        self._stats["flushes"] += 1
+        self._stats["rows_written"] += len(pending)
+        for patient_id, (version, generation, last_id) in heads.items():
+            entry = self._cache.get(patient_id)
+            if entry is not None and entry.version == version - 1 and entry.generation in (0, generation):
+                entry.version, entry.generation, entry.last_id = version, generation, last_id
+            else:
+                # 間に他プロセスの書き込みがあった → 次の get で読み直す
+                self._cache.pop(patient_id, None)
+
+    def _run_writer(self, interval):
+        with self._lock:
+            while not self._stop:
+                self._wake.wait(interval)
+                try:
+                    self._flush_locked()
+                except sqlite3.Error:
+                    pass  # 保留分は残っている。次の周期で再試行
+
+    def close(self):
+        with self._lock:
+            self._stop = True
+            self._wake.notify()
+            self._flush_locked()
+        self._writer.join(timeout=5)
+        self._conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_patient_store():
+    """サーバー内で共有するストア (KS_DATA_DIR/patients.sqlite)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SQLiteTrendStore(os.path.join(data_dir(), "patients.sqlite"))
+                atexit.register(_store.flush)
+    return _store
@@ -0,0 +1,91 @@
+"""酸素運搬・酸塩基の派生指標 (NumPy ベクトル化)
+
+TAB 2 の入力行1件ぶんだけでなく、JSON 復元や一括取り込みした履歴全体の
+派生列を1パスで再計算する。入力の「有無」は従来のスカラー実装と同じく
+真偽値で判定する (0 と欠損 = 未入力)。結果が 0 の指標は保存時と同様に欠損扱い。
+"""
+import numpy as np
+
+# 混合静脈血 PvO2 は 40 mmHg 固定 (従来ロジック)
+PVO2_ASSUMED = 40.0
+
+INPUT_COLUMNS = ("PaO2", "FiO2", "Hb", "CO", "SpO2", "SvO2", "Na", "Cl", "HCO3", "Alb", "ECMO_Flow")
+DERIVED_COLUMNS = ("P/F", "DO2", "VO2", "O2ER", "AG", "Flow_Ratio")
+
+
+def _arr(cols, name, n):
+    v = cols.get(name)
+    if v is None:
+        return np.full(n, np.nan)
+    return np.asarray(v, dtype=np.float64)
+
+
+def _present(x):
+    # `if x:` 相当 (NaN と 0 は未入力)
+    return np.isfinite(x) & (x != 0)
+
+
+def _nz(x):
+    # 保存時の `x if x else None` 相当
+    return np.where(_present(x), x, np.nan)
+
+
+def derive(cols):
+    """{列名: 配列} から派生指標を計算して {名前: 配列} を返す
+
+    返す名前: P/F, CaO2, DO2, VO2, O2ER, AG_raw, cAG, AG, Flow_Ratio
+    AG は補正 AG があればそれを、無ければ未補正 AG (保存列と同じ規則)。
+    """
+    n = len(next(iter(cols.values()))) if cols else 0
+    pao2, fio2 = _arr(cols, "PaO2", n), _arr(cols, "FiO2", n)
+    hb, co, spo2, svo2 = _arr(cols, "Hb", n), _arr(cols, "CO", n), _arr(cols, "SpO2", n), _arr(cols, "SvO2", n)
+    na, cl, hco3, alb = _arr(cols, "Na", n), _arr(cols, "Cl", n), _arr(cols, "HCO3", n), _arr(cols, "Alb", n)
+    ecmo = _arr(cols, "ECMO_Flow", n)
+
+    out = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ok = _present(pao2) & _present(fio2) & (fio2 > 0)
+        out["P/F"] = _nz(np.where(ok, pao2 / (fio2 / 100), np.nan))
+
+        ok = _present(hb) & _present(co) & _present(spo2) & _present(pao2)
+        cao2 = np.where(ok, 1.34 * hb * (spo2 / 100) + 0.0031 * pao2, np.nan)
+        do2 = np.where(ok, co * cao2 * 10, np.nan)
+        ok_v = ok & _present(svo2)
+        cvo2 = 1.34 * hb * (svo2 / 100) + 0.0031 * PVO2_ASSUMED
+        vo2 = np.where(ok_v, co * (cao2 - cvo2) * 10, np.nan)
+        o2er = np.where(ok_v & _present(do2) & (do2 > 0), (vo2 / do2) * 100, np.nan)
+        out["CaO2"] = cao2
+        out["DO2"], out["VO2"], out["O2ER"] = _nz(do2), _nz(vo2), _nz(o2er)
+
+        ok = _present(na) & _present(cl) & _present(hco3)
+        ag = np.where(ok, na - (cl + hco3), np.nan)
+        c_ag = np.where(ok & _present(alb), ag + 2.5 * (4.0 - alb), np.nan)
+        out["AG_raw"], out["cAG"] = ag, c_ag
+        out["AG"] = np.where(_present(c_ag), c_ag, _nz(ag))
+
+        ok = _present(co) & _present(ecmo) & (co > 0)
+        out["Flow_Ratio"] = _nz(np.where(ok, (ecmo / co) * 100, np.nan))
+    return out
+
+
+def derive_one(**inputs):
+    """入力1行 (number_input の値) から派生指標を計算する。欠損は None"""
+    cols = {name: [np.nan if inputs.get(name) is None else inputs[name]] for name in INPUT_COLUMNS}
+    return {k: (None if np.isnan(v[0]) else float(v[0])) for k, v in derive(cols).items()}
+
+
+def recompute(trend):
+    """PatientTrend の派生列を全履歴で再計算する
+
+    入力から計算できた行だけ上書きし、計算できない行 (入力が欠けている行) の
+    既存値は残す。
+    """
+    if not len(trend):
+        return
+    values = derive(trend.columns())
+    for name in DERIVED_COLUMNS:
+        new = values[name]
+        current = trend.column(name)
+        merged = np.where(np.isnan(new), current, new)
+        if not np.array_equal(merged, current, equal_nan=True):
+            trend.set_column(name, merged)
@@ -0,0 +1,163 @@
+"""診断前処理の並列パイプライン
+
+キーワード抽出 → エビデンス検索 の直列チェーンと、画像デコード・トレンド表作成を
+スレッドプールで重ねて実行する。検索には予算 (search_budget 秒) があり、
+期限を過ぎたら届いた分のエビデンスだけでメイン呼び出しへ進む。
+結果は期限の時点で写し取り、それ以降に届いた検索結果は捨てる (返した PrepResult は変わらない)。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from core.images import prepare_image
+
+
+class StageTimer:
+    """ステージごとの開始・終了時刻 (パイプライン開始からの ms) を記録する"""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self._stages = {}
+        self._after = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, after=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self._stages[name] = (start - self.t0, end - self.t0)
+                if after:
+                    self._after[name] = after
+
+    def mark(self, name, start, end, after=None):
+        with self._lock:
+            self._stages[name] = (start - self.t0, end - self.t0)
+            if after:
+                self._after[name] = after
+
+    def critical_path(self):
+        """最後に終わったステージから依存を遡ったステージ名の列
+
+        after 指定のないステージは「開始直前に終わったステージ」を待っていたとみなす。
+        """
+        with self._lock:
+            stages = dict(self._stages)
+            after = dict(self._after)
+        if not stages:
+            return []
+        name = max(stages, key=lambda k: stages[k][1])
+        path = [name]
+        while True:
+            prev = after.get(name)
+            if prev is None:
+                start = stages[name][0]
+                before = [k for k, (_, e) in stages.items() if e <= start + 1e-6 and k not in path]
+                prev = max(before, key=lambda k: stages[k][1]) if before else None
+            if prev is None or prev not in stages:
+                break
+            path.append(prev)
+            name = prev
+        return path[::-1]
+
+    def rows(self):
+        critical = set(self.critical_path())
+        with self._lock:
+            items = sorted(self._stages.items(), key=lambda kv: kv[1][0])
+        return [{
+            "stage": name,
+            "start_ms": round(start * 1000, 1),
+            "end_ms": round(end * 1000, 1),
+            "duration_ms": round((end - start) * 1000, 1),
+            "critical": name in critical,
+        } for name, (start, end) in items]
+
+
+@dataclass
+class PrepResult:
+    search_key: str = ""
+    evidence: list = field(default_factory=list)
+    search_error: str = ""
+    search_complete: bool = False
+    images: list = field(default_factory=list)   # PreparedImage
+    trend: str = ""
+    timer: StageTimer = field(default_factory=StageTimer)
+
+
+def prepare_diagnosis(extract_keywords, search, uploads, build_trend, search_budget=8.0, decode=prepare_image):
+    """前処理を並列に実行して PrepResult を返す
+
+    extract_keywords(): 検索語 (str)
+    search(search_key): エビデンス文字列を届いた順に1件ずつ yield するイテレータ (SearchCache.iter_text)
+    build_trend(): プロンプト用トレンド文字列
+    decode(upload): 画像1件の前処理 (既定は縮小・再圧縮・キャッシュ済みの PreparedImage)
+    """
+    result = PrepResult()
+    timer = result.timer
+    done = threading.Event()
+    closed = threading.Event()
+    lock = threading.Lock()
+    # ワーカーはここにだけ書く。期限で closed を立てたら以降の書き込みは捨てる
+    found = {"search_key": "", "evidence": [], "search_error": "", "search_complete": False}
+
+    def _set(name, value):
+        with lock:
+            if closed.is_set():
+                return False
+            found[name] = value
+            return True
+
+    def _evidence():
+        try:
+            with timer.stage("keywords"):
+                key = extract_keywords()
+            if not _set("search_key", key):
+                return
+            with timer.stage("search", after="keywords"):
+                for item in search(key):
+                    with lock:
+                        if closed.is_set():
+                            return      # 予算切れ: 残りは読まない
+                        found["evidence"].append(item)
+            _set("search_complete", True)
+        except Exception as e:
+            _set("search_error", str(e))
+        finally:
+            done.set()
+
+    def _image(i, f):
+        with timer.stage(f"image[{i}]"):
+            return decode(f)
+
+    def _trend():
+        with timer.stage("trend"):
+            return build_trend()
+
+    pool = ThreadPoolExecutor(max_workers=2 + max(1, len(uploads or ())), thread_name_prefix="diag-prep")
+    try:
+        pool.submit(_evidence)
+        image_futures = [pool.submit(_image, i, f) for i, f in enumerate(uploads or ())]
+        trend_future = pool.submit(_trend)
+
+        wait(image_futures + [trend_future])
+        result.images = [f.result() for f in image_futures]
+        result.trend = trend_future.result()
+
+        remaining = search_budget - (time.perf_counter() - timer.t0)
+        if not done.wait(max(0.0, remaining)):
+            timer.mark("search_budget", timer.t0, timer.t0 + search_budget)
+        with lock:
+            closed.set()
+            result.search_key = found["search_key"]
+            result.evidence = list(found["evidence"])
+            result.search_error = found["search_error"]
+            result.search_complete = found["search_complete"]
+    finally:
+        # 予算切れの検索は次の1件が届いた時点で止まる (それまでは裏で待つ)
+        pool.shutdown(wait=False)
+    return result
@@ -0,0 +1,287 @@
+"""研究検索 (research.py) の処理本体: 1件分の検索 → 分析と、ファイルからのバッチ実行
+
+バッチは検索と分析を別々のスレッドプールで重ね、件数を絞って並列に流す。
+1件終わるごとに NDJSON へ追記するので、途中で止まっても同じジョブ
+(テーマ・モデル・クエリ一覧が同じ) を再実行すれば成功済みの件は飛ばす。
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import numpy as np
+
+SEARCH_WORKERS = 3
+ANALYSIS_WORKERS = 4
+MAX_RESULTS = 5
+
+
+# ==========================================
+# 1件分 (単発検索と共通)
+# ==========================================
+def format_context(results):
+    return "".join(f"【文献{i+1}】\nTitle: {r['title']}\nURL: {r['href']}\nSummary: {r['body']}\n\n"
+                   for i, r in enumerate(results))
+
+
+def build_prompt(my_theme, final_query, search_context):
+    return f"""
+        あなたは優秀な大学院生の研究パートナーです。
+        以下の検索結果を読み込み、「ユーザーの研究テーマ」に対する有用性を分析してください。
+
+        【ユーザーの研究テーマ】
+        {my_theme}
+
+        【検索キーワード】
+        {final_query}
+
+        【検索された文献リスト】
+        {search_context}
+
+        【命令】
+        1. 検索結果に含まれる情報を事実として扱うこと。
+        2. 英語の文献であっても、解説は日本語で行うこと。
+        3. 論文が見つかった場合は、その要点と研究への活かし方を解説すること。
+
+        【出力フォーマット】
+        ## 📊 検索結果レポート
+        ### 1. ヒットした主要文献
+        - **[タイトル]** (URL)
+            - 📝 **要約**: 
+        ### 2. 研究への活用ポイント
+        """
+
+
+def search_literature(query, offline=False):
+    """世界全体 (wt-wt)・HTML バックエンドで検索 (同一クエリはキャッシュから)"""
+    from core.search import get_search
+    return get_search().text(query, region='wt-wt', max_results=MAX_RESULTS, backend='html', offline=offline)
+
+
+def translate_prompt(query):
+    return f"Translate this academic search query into English. Output only the query.\n{query}"
+
+
+def search_fanout(query, my_theme, translate=None, offline=False):
+    """原文・英訳・PubMed/Nature 指定で並列検索し、研究テーマに対する BM25 上位 MAX_RESULTS 件 (FanOutResult)"""
+    from core.fanout import fan_out_search
+    return fan_out_search(query, my_theme, lambda q: search_literature(q, offline=offline),
+                          translate=translate, top_k=MAX_RESULTS)
+
+
+# ==========================================
+# バッチ
+# ==========================================
+def parse_queries(data, name=""):
+    """CSV (query 列、無ければ先頭列) またはテキスト (1行1件) → 重複を除いたクエリのリスト
+
+    空行と # で始まる行は無視する。
+    """
+    text = data.decode("utf-8-sig") if isinstance(data, bytes) else data
+    if name.lower().endswith(".csv"):
+        rows = list(csv.reader(io.StringIO(text)))
+        col = 0
+        if rows and any(h.strip().lower() in ("query", "queries", "keyword", "検索語") for h in rows[0]):
+            header = [h.strip().lower() for h in rows[0]]
+            col = next(i for i, h in enumerate(header) if h in ("query", "queries", "keyword", "検索語"))
+            rows = rows[1:]
+        items = [r[col] for r in rows if len(r) > col]
+    else:
+        items = text.splitlines()
+    seen, queries = set(), []
+    for q in items:
+        q = q.strip()
+        if q and not q.startswith("#") and q not in seen:
+            seen.add(q)
+            queries.append(q)
+    return queries
+
+
+def job_id(my_theme, model_name, queries):
+    raw = json.dumps([my_theme.strip(), model_name, queries], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def progress_path(job):
+    from core.patient_store import data_dir
+    path = os.path.join(data_dir(), "research")
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, f"{job}.ndjson")
+
+
+def load_progress(path):
+    """保存済みの {クエリ: 記録} (同じクエリは後の記録が勝つ。壊れた末尾行は無視)"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[record["query"]] = record
+    return done
+
+
+@dataclass
+class BatchResult:
+    records: list = field(default_factory=list)   # クエリ順
+    elapsed: float = 0.0
+    processed: int = 0                             # 今回実行した件数 (再開時の既存分を除く)
+    resumed: int = 0
+
+    @property
+    def throughput(self):
+        """今回実行分の queries/min"""
+        return self.processed / self.elapsed * 60 if self.elapsed > 0 else 0.0
+
+    def stage_stats(self):
+        """ステージ別の p50 / p95 (ms)"""
+        rows = []
+        for stage in ("queue_ms", "search_ms", "analysis_ms"):
+            values = [r[stage] for r in self.records if r.get(stage) is not None and not r.get("resumed")]
+            if values:
+                rows.append({"stage": stage[:-3], "n": len(values),
+                             "p50_ms": round(float(np.percentile(values, 50)), 1),
+                             "p95_ms": round(float(np.percentile(values, 95)), 1),
+                             "total_s": round(sum(values) / 1000, 1)})
+        return rows
+
+
+def run_batch(queries, search, analyze, path, search_workers=SEARCH_WORKERS, analysis_workers=ANALYSIS_WORKERS,
+              on_record=None):
+    """queries を検索 → 分析のパイプラインで流す
+
+    search(query): 検索結果のリスト
+    analyze(query, results): レポート文字列
+    on_record(record, done, total): 1件終わるごと (呼び出し元のスレッドで呼ぶので st.* を使ってよい)
+    """
+    previous = load_progress(path)
+    result = BatchResult()
+    records = {}
+    for q in queries:
+        r = previous.get(q)
+        if r is not None and r["status"] == "ok":
+            records[q] = dict(r, resumed=True)
+    result.resumed = len(records)
+    todo = [q for q in queries if q not in records]
+    total, done = len(queries), len(records)
+    t0 = time.perf_counter()
+
+    def _search(q, queued):
+        start = time.perf_counter()
+        return q, (start - queued) * 1000, search(q), (time.perf_counter() - start) * 1000
+
+    def _analyze(q, results):
+        start = time.perf_counter()
+        return analyze(q, results), (time.perf_counter() - start) * 1000
+
+    with open(path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(search_workers, thread_name_prefix="batch-search") as search_pool, \
+            ThreadPoolExecutor(analysis_workers, thread_name_prefix="batch-analyze") as analysis_pool:
+
+        def _finish(record):
+            nonlocal done
+            records[record["query"]] = record
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            result.processed += 1
+            if on_record:
+                on_record(record, done, total)
+
+        pending = {search_pool.submit(_search, q, time.perf_counter()): ("search", q, None) for q in todo}
+        try:
+            _drain(pending, analysis_pool, _analyze, _finish)
+        except BaseException:
+            # 中断 (Streamlit の再実行など): 未着手の分は捨て、実行中の分だけ待って抜ける
+            for fut in pending:
+                fut.cancel()
+            raise
+
+    result.elapsed = time.perf_counter() - t0
+    result.records = [records[q] for q in queries if q in records]
+    return result
+
+
+def _drain(pending, analysis_pool, analyze, finish):
+    """検索が終わった件から分析へ回し、分析が終わった件から記録する"""
+    while pending:
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in finished:
+            stage, q, partial = pending.pop(fut)
+            try:
+                value = fut.result()
+            except Exception as e:
+                record = {"query": q, "status": "error", "stage": stage, "error": f"{type(e).__name__}: {e}",
+                          "report": "", "n_results": 0, "queue_ms": None, "search_ms": None, "analysis_ms": None}
+                record.update(partial or {})
+                finish(record)
+                continue
+            if stage == "search":
+                _, queue_ms, results, search_ms = value
+                partial = {"queue_ms": round(queue_ms, 1), "search_ms": round(search_ms, 1),
+                           "n_results": len(results), "urls": [r["href"] for r in results]}
+                if not results:
+                    finish({"query": q, "status": "empty", "report": "", "analysis_ms": None, **partial})
+                    continue
+                pending[analysis_pool.submit(analyze, q, results)] = ("analysis", q, partial)
+            else:
+                report, analysis_ms = value
+                finish({"query": q, "status": "ok", "report": report,
+                         "analysis_ms": round(analysis_ms, 1), **partial})
+
+
+def results_table(records):
+    """結果一覧 (DataFrame 用の行)"""
+    rows = []
+    for r in records:
+        report = r.get("report") or r.get("error") or ""
+        # 見出しを飛ばした最初の行 (通常は先頭の文献タイトル)
+        first = next((line.strip(" -*").replace("**", "") for line in report.splitlines()
+                      if line.strip() and not line.lstrip().startswith("#")), "")
+        rows.append({
+            "Query": r["query"],
+            "Status": r["status"] + (" (resumed)" if r.get("resumed") else ""),
+            "Results": r.get("n_results", 0),
+            "Search ms": r.get("search_ms"),
+            "Analysis ms": r.get("analysis_ms"),
+            "Summary": first[:120],
+        })
+    return rows
+
+
+def batch_report(my_theme, result):
+    """Markdown レポート"""
+    ok = [r for r in result.records if r["status"] == "ok"]
+    lines = [
+        "# 📚 Batch Research Report",
+        "",
+        f"**研究テーマ**: {my_theme.strip()}",
+        "",
+        f"- クエリ: {len(result.records)} 件 (成功 {len(ok)} / 再開時スキップ {result.resumed})",
+        f"- 所要時間: {result.elapsed:.1f} s / スループット: {result.throughput:.1f} queries/min",
+        "",
+        "| stage | n | p50 ms | p95 ms |",
+        "|---|---|---|---|",
+        *(f"| {s['stage']} | {s['n']} | {s['p50_ms']} | {s['p95_ms']} |" for s in result.stage_stats()),
+        "",
+    ]
+    for i, r in enumerate(result.records, 1):
+        lines.append(f"## {i}. {r['query']}")
+        lines.append("")
+        if r["status"] == "ok":
+            # 各クエリの見出し (##) の下に収まるよう、レポート内の見出しを2段下げる
+            lines.append(re.sub(r"^(\s*)(#+)", r"\1##\2", r["report"].strip(), flags=re.M))
+        elif r["status"] == "empty":
+            lines.append("_検索結果なし_")
+        else:
+            lines.append(f"_エラー ({r.get('stage')}): {r.get('error')}_")
+        lines.append("")
+    return "\n".join(lines)
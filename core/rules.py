@@ -0,0 +1,244 @@
+"""KUSANO_BRAIN の数値規定を LLM の前にローカルで判定するルールエンジン
+
+  FLOW_RATIO_LOW : Flow/CO < 60% (Capture 不良 / High Shunt)           [追加規定1 Pattern A]
+  SVO2_HIGH      : SvO2 > 80% (Recirculation / Left Shift / Dysoxia)    [追加規定1]
+  DELTA_PAO2     : ECMO 導入時から導入 24h 後の ΔPaO2 (+20〜80 mmHg が安全域) [追加規定2]
+                   導入時刻は ECMO_Flow の最初の記録 (evaluate_trend の ecmo_start で明示も可)。
+                   判定するのは導入 24h ± DELTA_PAO2_WINDOW の間だけ
+  PACO2_DROP     : 直近 24h の最大値から PaCO2 が 50% を超えて低下       [追加規定2]
+  MISSING_DATA   : pH / Lac / 電解質 の欠損・未更新                      [追加規定3]
+
+状態 (列ごとの直近値、導入時と 24h 後の PaO2、PaCO2 の 24h 最大値の単調キュー) を
+1行ごとに更新するので、新しい記録1件の判定はマイクロ秒で済む。
+トレンドごとのエンジンは弱参照で保持し、追記分だけを流し込む。
+"""
+import threading
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+from core.schema import COLUMN_INDEX, COLUMN_NAMES, COLUMNS
+from core.trend_summary import STALE_HOURS
+
+FLOW_RATIO_MIN = 60.0
+SVO2_MAX = 80.0
+DELTA_PAO2_RANGE = (20.0, 80.0)
+DELTA_PAO2_WINDOW = np.timedelta64(6, "h").astype("timedelta64[ns]").astype(np.int64)
+BASELINE_GRACE = np.timedelta64(2, "h").astype("timedelta64[ns]").astype(np.int64)   # 導入前の値が無いとき
+PACO2_DROP_PCT = 50.0
+WINDOW = np.timedelta64(24, "h").astype("timedelta64[ns]").astype(np.int64)
+
+SEVERITY_ORDER = ("emergency", "warning", "info")
+AUDIT_COLUMNS = tuple(c.name for c in COLUMNS if c.audit)
+
+_J = {name: COLUMN_INDEX[name] for name in ("Flow_Ratio", "SvO2", "pH", "Lactate", "PaO2", "PaCO2", "FiO2", "ECMO_Flow")}
+_AUDIT_J = np.array([COLUMN_INDEX[name] for name in AUDIT_COLUMNS])
+
+
+@dataclass(frozen=True)
+class Finding:
+    rule: str
+    severity: str
+    message: str
+    value: float = None
+    time: np.datetime64 = None
+
+
+def _ts(t):
+    return str(np.datetime64(int(t), "ns").astype("datetime64[m]")).replace("T", " ")[5:]
+
+
+class RuleEngine:
+    """1患者分のルール状態。push で1行ずつ更新し findings で現在の判定を返す"""
+
+    def __init__(self, ecmo_start=None):
+        width = len(COLUMN_NAMES)
+        self.last = np.full(width, np.nan)
+        self.last_t = np.full(width, -1, dtype=np.int64)   # 列ごとの最終記録時刻 (ns, 未記録は -1)
+        self.latest_t = -1
+        self.rows = 0
+        self.version = -1        # 反映済みの PatientTrend.version
+        self.ecmo_start_arg = ecmo_start
+        self.ecmo_start = None if ecmo_start is None else np.datetime64(ecmo_start, "ns").astype(np.int64)
+        self._pao2_last = None   # (t, PaO2) 直近の値 (導入時の基準値を決めるまで)
+        self._pao2_base = None   # (t, PaO2) 導入時の基準値
+        self._pao2_day = None    # (t, PaO2) 導入 24h ± DELTA_PAO2_WINDOW で 24h に最も近い値
+        self._paco2 = deque()    # (t, PaCO2) 24h 最大値の単調減少キュー
+
+    def push(self, t, row):
+        """t: ns (int), row: COLUMN_NAMES 順の値 (NaN = 欠測)"""
+        present = row == row
+        self.last[present] = row[present]
+        self.last_t[present] = t
+        self.latest_t = max(self.latest_t, t)
+        self.rows += 1
+
+        ecmo = row[_J["ECMO_Flow"]]
+        if self.ecmo_start is None and ecmo == ecmo and ecmo > 0:
+            self.ecmo_start = t
+        pao2 = row[_J["PaO2"]]
+        if pao2 == pao2:
+            self._push_pao2(t, pao2)
+        paco2 = row[_J["PaCO2"]]
+        if paco2 == paco2:
+            q = self._paco2
+            while q and q[-1][1] <= paco2:
+                q.pop()
+            q.append((t, paco2))
+            while q[0][0] < t - WINDOW:
+                q.popleft()
+
+    def _push_pao2(self, t, pao2):
+        start = self.ecmo_start
+        if start is None or t <= start:
+            # 導入前 (導入と同じ行を含む): 最後の値が基準値の候補
+            self._pao2_last = (t, pao2)
+            return
+        if self._pao2_base is None:
+            last = self._pao2_last
+            if last is not None and start - last[0] <= WINDOW:
+                self._pao2_base = last
+            elif t - start <= BASELINE_GRACE:
+                # 導入前の値が無い: 導入直後の最初の値を基準にする
+                self._pao2_base = (t, pao2)
+                return
+        off = abs(t - start - WINDOW)
+        if off <= DELTA_PAO2_WINDOW and (self._pao2_day is None or off <= abs(self._pao2_day[0] - start - WINDOW)):
+            self._pao2_day = (t, pao2)
+
+    def _delta_pao2(self):
+        """(基準値, 24h 後の値)。導入 24h ± DELTA_PAO2_WINDOW を過ぎたら None"""
+        start = self.ecmo_start
+        if start is None or self._pao2_base is None or self._pao2_day is None:
+            return None
+        if self.latest_t > start + WINDOW + DELTA_PAO2_WINDOW:
+            return None
+        return self._pao2_base, self._pao2_day
+
+    def findings(self, now=None):
+        out = []
+        last, last_t = self.last, self.last_t
+
+        ratio = last[_J["Flow_Ratio"]]
+        if ratio == ratio and ratio < FLOW_RATIO_MIN:
+            out.append(Finding(
+                "FLOW_RATIO_LOW", "emergency",
+                f"Flow/CO = {ratio:.0f}% (< {FLOW_RATIO_MIN:.0f}%): Capture 不良 / High Shunt Fraction。"
+                "流量増加を最優先、流量 MAX でも不足なら CO 抑制 (β遮断・鎮静・解熱) を検討",
+                float(ratio), last_t[_J["Flow_Ratio"]]))
+
+        svo2 = last[_J["SvO2"]]
+        if svo2 == svo2 and svo2 > SVO2_MAX:
+            hints = ["Recirculation"]
+            ph, lac = last[_J["pH"]], last[_J["Lactate"]]
+            hints.append(f"Left Shift (pH {ph:.2f})" if ph == ph and ph > 7.45 else "Left Shift")
+            hints.append(f"Tissue Dysoxia (Lac {lac:.1f})" if lac == lac and lac > 2 else "Tissue Dysoxia")
+            out.append(Finding(
+                "SVO2_HIGH", "warning",
+                f"SvO2 = {svo2:.0f}% (> {SVO2_MAX:.0f}%): 鑑別 → " + " / ".join(hints),
+                float(svo2), last_t[_J["SvO2"]]))
+
+        pair = self._delta_pao2()
+        if pair is not None:
+            base, (t_now, pao2) = pair
+            delta = pao2 - base[1]
+            lo, hi = DELTA_PAO2_RANGE
+            if delta > hi:
+                sev, note = "warning", "過剰 (脳梗塞リスク): FiO2 を下げる"
+            elif delta < lo:
+                sev, note = "warning", "過小 (脳出血リスク): 原因精査"
+            else:
+                sev, note = "info", "安全域"
+            out.append(Finding(
+                "DELTA_PAO2", sev,
+                f"ECMO 導入 24h の ΔPaO2 = {delta:+.0f} mmHg ({_ts(base[0])} {base[1]:.0f} → {_ts(t_now)} {pao2:.0f}, "
+                f"安全域 +{lo:.0f}〜{hi:.0f}): {note}",
+                float(delta), t_now))
+
+        if self._paco2:
+            peak_t, peak = self._paco2[0]
+            paco2 = last[_J["PaCO2"]]
+            drop = (peak - paco2) / peak * 100 if peak > 0 else 0.0
+            if drop > PACO2_DROP_PCT:
+                out.append(Finding(
+                    "PACO2_DROP", "emergency",
+                    f"PaCO2 {peak:.0f} ({_ts(peak_t)}) → {paco2:.0f} mmHg: 24h で {drop:.0f}% 低下 "
+                    f"(> {PACO2_DROP_PCT:.0f}%)。脳血管収縮リスク → Sweep Gas を下げ緩徐に補正",
+                    float(drop), last_t[_J["PaCO2"]]))
+
+        if self.rows:
+            now_ns = np.datetime64(now or datetime.now(), "ns").astype(np.int64)
+            seen = last_t[_AUDIT_J]
+            missing = [name for name, t in zip(AUDIT_COLUMNS, seen) if t < 0]
+            stale = [name for name, t in zip(AUDIT_COLUMNS, seen)
+                     if t >= 0 and (now_ns - t) / 3.6e12 > STALE_HOURS]
+            if missing or stale:
+                parts = []
+                if missing:
+                    parts.append("未測定: " + ", ".join(missing))
+                if stale:
+                    parts.append(f"{STALE_HOURS:.0f}h 以上未更新: " + ", ".join(stale))
+                out.append(Finding("MISSING_DATA", "warning",
+                                   " / ".join(parts) + " → 客観的データの裏付け不足。測定を推奨"))
+
+        out.sort(key=lambda f: SEVERITY_ORDER.index(f.severity))
+        return out
+
+
+# ==========================================
+# トレンドごとのエンジン (追記分だけ流す)
+# ==========================================
+_engines = weakref.WeakKeyDictionary()
+_engines_lock = threading.Lock()
+
+
+def _sync(trend, ecmo_start=None):
+    """trend に対応するエンジンを最新にして返す
+
+    処理済みの最終行 (時刻と値) が変わっていなければ追記分だけ流す。
+    並べ替え・派生列の再計算・置換で変わっていたら最初から作り直す。
+    """
+    n = len(trend)
+    times, data = trend.times, trend.matrix()
+    engine, done = None, 0
+    state = _engines.get(trend)
+    if state is not None:
+        engine, done, last_time, last_row = state
+        if engine.ecmo_start_arg != ecmo_start:
+            engine, done = None, 0
+        elif engine.version == trend.version:
+            return engine
+        if done > n or done == n or (done and (times[done - 1] != last_time or
+                                              not np.array_equal(data[:, done - 1], last_row, equal_nan=True))):
+            engine, done = None, 0
+    if engine is None:
+        engine = RuleEngine(ecmo_start)
+    t_ns = times[done:n].astype(np.int64)
+    for i in range(done, n):
+        engine.push(int(t_ns[i - done]), data[:, i])
+    engine.version = trend.version
+    _engines[trend] = (engine, n, times[n - 1] if n else None, data[:, n - 1].copy() if n else None)
+    return engine
+
+
+def evaluate_trend(trend, now=None, ecmo_start=None):
+    """PatientTrend の現在の判定 (重い順の Finding のリスト)
+
+    ecmo_start: ECMO 導入時刻 (省略時は ECMO_Flow の最初の記録)
+    """
+    with _engines_lock:
+        return _sync(trend, ecmo_start).findings(now)
+
+
+def findings_text(findings):
+    """プロンプトに渡す構造化された事実 (確定済みの判定結果)"""
+    if not findings:
+        return "No rule triggered"
+    lines = []
+    for f in findings:
+        when = f" @{_ts(f.time)}" if f.time is not None and f.time >= 0 else ""
+        lines.append(f"- [{f.severity.upper()}] {f.rule}{when}: {f.message}")
+    return "\n".join(lines)
@@ -0,0 +1,47 @@
+"""トレンドデータの列レジストリ
+
+app.py / app_pro.py の入力・保存・グラフ・プロンプトは全てここを参照する。
+derived=True は入力値から計算される指標 (physiology で再計算可能)。
+keep_peaks=True の列はダウンサンプリングでも極値 (スパイク) を必ず残す。
+audit=True は Data Audit 規定の重要パラメータ (欠損・未更新をプロンプトで明示)。
+"""
+from dataclasses import dataclass
+
+TIME_COLUMN = "Time"
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    unit: str = ""
+    derived: bool = False
+    keep_peaks: bool = False
+    audit: bool = False
+
+
+COLUMNS = (
+    Column("P/F", "mmHg", derived=True),
+    Column("DO2", "mL/min", derived=True),
+    Column("VO2", "mL/min", derived=True),
+    Column("O2ER", "%", derived=True, keep_peaks=True),
+    Column("Lactate", "mmol/L", keep_peaks=True, audit=True),
+    Column("Hb", "g/dL"),
+    Column("pH", audit=True),
+    Column("SvO2", "%", keep_peaks=True),
+    Column("AG", "mEq/L", derived=True, keep_peaks=True),
+    Column("Na", "mEq/L", audit=True),
+    Column("Cl", "mEq/L", audit=True),
+    Column("HCO3", "mEq/L", audit=True),
+    Column("Alb", "g/dL"),
+    Column("CO", "L/min"),
+    Column("SpO2", "%"),
+    Column("PaO2", "mmHg"),
+    Column("FiO2", "%"),
+    Column("ECMO_Flow", "L/min"),
+    Column("Flow_Ratio", "%", derived=True),
+    Column("PaCO2", "mmHg"),
+)
+
+COLUMN_NAMES = tuple(c.name for c in COLUMNS)
+COLUMN_INDEX = {name: i for i, name in enumerate(COLUMN_NAMES)}
+COLUMNS_BY_NAME = {c.name: c for c in COLUMNS}
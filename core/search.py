@@ -0,0 +1,191 @@
+"""DuckDuckGo 検索 + 永続エビデンスキャッシュ
+
+同じ検索語は回診中に何度も繰り返され、連打するとレート制限でブロックされる。
+(正規化クエリ, region, backend, max_results) をキーに結果を SQLite へ保存し、
+TTL 内はネットワークに出ない。offline=True ではキャッシュのみを参照する。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from core.disk_cache import DiskCache, cache_dir
+from core.throttle import get_limiter, get_single_flight
+
+DEFAULT_TTL = float(os.environ.get("KS_SEARCH_TTL", str(24 * 3600)))
+
+
+class OfflineCacheMiss(LookupError):
+    """オフラインモードでキャッシュに無いクエリ"""
+
+
+def normalize_query(query):
+    query = unicodedata.normalize("NFKC", query)
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class DDGSBackend:
+    """duckduckgo_search.DDGS による実検索"""
+
+    name = "ddgs"
+
+    def text(self, query, region, max_results, backend):
+        from duckduckgo_search import DDGS
+        with DDGS() as ddgs:
+            return list(ddgs.text(query, region=region, max_results=max_results, backend=backend))
+
+    def iter_text(self, query, region, max_results, backend):
+        from duckduckgo_search import DDGS
+        with DDGS() as ddgs:
+            # 版によってはジェネレーター (届いた順に返る)。リストを返す版では一括
+            yield from ddgs.text(query, region=region, max_results=max_results, backend=backend)
+
+
+class FakeSearchBackend:
+    """テスト・ベンチ用の決定的な検索バックエンド"""
+
+    name = "fake"
+
+    def __init__(self, latency=0.0, body_size=200, fail=None, item_delay=0.0):
+        self.latency = latency
+        self.item_delay = item_delay    # iter_text で1件ごとに待つ秒数 (text は全件分まとめて待つ)
+        self.body_size = body_size
+        self.fail = fail
+        self.calls = []
+
+    def text(self, query, region, max_results, backend):
+        self.calls.append((query, region, max_results, backend))
+        if self.latency or self.item_delay:
+            time.sleep(self.latency + self.item_delay * max_results)
+        if self.fail:
+            raise self.fail
+        return self._results(query, region, max_results)
+
+    def iter_text(self, query, region, max_results, backend):
+        self.calls.append((query, region, max_results, backend))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail:
+            raise self.fail
+        for item in self._results(query, region, max_results):
+            if self.item_delay:
+                time.sleep(self.item_delay)
+            yield item
+
+    def _results(self, query, region, max_results):
+        digest = hashlib.sha1(query.encode("utf-8")).hexdigest()[:8]
+        body = (f"{query} ({region}) " * (self.body_size // max(1, len(query) + 8) + 1))[:self.body_size]
+        return [{
+            "title": f"[{digest}] {query} #{i + 1}",
+            "href": f"https://example.org/{digest}/{i + 1}",
+            "body": body,
+        } for i in range(max_results)]
+
+
+class SearchCache:
+    """キャッシュ付き検索。backend は text(query, region, max_results, backend) を持つ任意のオブジェクト"""
+
+    def __init__(self, backend=None, cache=None, ttl=DEFAULT_TTL, offline=False):
+        self.backend = backend or DDGSBackend()
+        self.cache = cache or DiskCache(os.path.join(cache_dir(), "search.sqlite"), max_bytes=32 * 1024 * 1024)
+        self.ttl = ttl
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "offline_misses": 0}
+
+    @staticmethod
+    def key(query, region, max_results, backend):
+        raw = json.dumps([normalize_query(query), region, backend, max_results], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _lookup(self, key, query, offline):
+        """キャッシュの結果 (無ければ None。オフラインなら OfflineCacheMiss)"""
+        # オフライン時は TTL 切れでも手元の結果を返す
+        blob = self.cache.get(key, max_age=None if offline else self.ttl)
+        if blob is not None:
+            self._count("hits")
+            return json.loads(blob)
+        if offline:
+            self._count("offline_misses")
+            raise OfflineCacheMiss(query)
+        self._count("misses")
+        return None
+
+    def text(self, query, region="wt-wt", max_results=5, backend="auto", offline=None):
+        offline = self.offline if offline is None else offline
+        key = self.key(query, region, max_results, backend)
+        cached = self._lookup(key, query, offline)
+        if cached is not None:
+            return cached
+
+        def fetch():
+            get_limiter().acquire_search(getattr(self.backend, "name", "default"))
+            results = self.backend.text(query, region=region, max_results=max_results, backend=backend)
+            if results:
+                # 0件はブロックや一時障害の可能性があるので保存しない
+                self.cache.set(key, json.dumps(results, ensure_ascii=False).encode("utf-8"))
+            return results
+
+        # 同じクエリが実行中 (連打・複数ユーザー) なら1回の検索結果を共有する
+        return get_single_flight().do(("search", key), fetch)
+
+    def iter_text(self, query, region="wt-wt", max_results=5, backend="auto", offline=None):
+        """text と同じ結果を届いた順に1件ずつ返す (予算付きの検索で途中までを使うため)
+
+        キャッシュにあれば全件をすぐ返す。バックエンドが iter_text を持たなければ text と同じ。
+        全件を読み切ったときだけキャッシュへ保存する (途中で打ち切られた分は保存しない)。
+        """
+        if not hasattr(self.backend, "iter_text"):
+            yield from self.text(query, region, max_results, backend, offline)
+            return
+        offline = self.offline if offline is None else offline
+        key = self.key(query, region, max_results, backend)
+        cached = self._lookup(key, query, offline)
+        if cached is not None:
+            yield from cached
+            return
+        get_limiter().acquire_search(getattr(self.backend, "name", "default"))
+        results = []
+        for item in self.backend.iter_text(query, region=region, max_results=max_results, backend=backend):
+            results.append(item)
+            yield item
+        if results:
+            self.cache.set(key, json.dumps(results, ensure_ascii=False).encode("utf-8"))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(self.cache.stats())
+        return stats
+
+
+_search = None
+_search_lock = threading.Lock()
+
+
+def _default_backend():
+    if os.environ.get("KS_SEARCH_BACKEND") == "fake":
+        return FakeSearchBackend()
+    return DDGSBackend()
+
+
+def get_search():
+    """プロセス共有の SearchCache (KS_SEARCH_OFFLINE=1 で既定をオフラインに)"""
+    global _search
+    if _search is None:
+        with _search_lock:
+            if _search is None:
+                _search = SearchCache(_default_backend(), offline=os.environ.get("KS_SEARCH_OFFLINE") == "1")
+    return _search
+
+
+def set_search_backend(backend):
+    """検索バックエンドを差し替える (テスト・ベンチ用)"""
+    get_search().backend = backend
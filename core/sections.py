@@ -0,0 +1,113 @@
+"""KUSANO_BRAIN 回答のセクション分割 (ストリーミング対応)
+
+回答は `---SECTION_PLAN_EMERGENCY---` などのマーカーで区切られる。
+SectionParser はチャンクを1回だけ走査し、マーカーがチャンク境界で
+分割されていても正しく振り分ける。
+"""
+import re
+
+SECTION_PREFIX = "---SECTION"
+
+SECTION_MARKERS = {
+    "---SECTION_PLAN_EMERGENCY---": "emergency",
+    "---SECTION_AI_OPINION---": "opinion",
+    "---SECTION_PLAN_ROUTINE---": "routine",
+    "---SECTION_FACT---": "fact",
+}
+SECTION_ORDER = ("emergency", "opinion", "routine", "fact")
+
+# "---SECTION" 以降のマーカー本体 (未完なら保留する)
+_MARKER_TAIL = re.compile(r"[A-Z_]*(---)?")
+
+
+class SectionParser:
+    """チャンクを feed() し、(section, text) のイベント列を受け取る
+
+    - マーカー前の前置き (preamble) は section=None として扱う
+    - 未知の `---SECTION...` 以降は次の既知マーカーまで捨てる
+      (従来の `split('---SECTION')[0]` と同じ挙動)
+    """
+
+    def __init__(self):
+        self.current = None
+        self.sections = {}
+        self.preamble = []
+        self.saw_marker = False
+        self._parts = []
+        self._buf = ""
+        self._discard = False
+
+    @property
+    def raw(self):
+        return "".join(self._parts)
+
+    def text(self, key):
+        return "".join(self.sections.get(key, ())).strip()
+
+    def feed(self, chunk):
+        if not chunk:
+            return []
+        self._parts.append(chunk)
+        self._buf += chunk
+        return self._drain(final=False)
+
+    def close(self):
+        return self._drain(final=True)
+
+    def _emit(self, events, text):
+        if not text or self._discard:
+            return
+        if self.current is None:
+            self.preamble.append(text)
+        else:
+            self.sections.setdefault(self.current, []).append(text)
+        events.append((self.current, text))
+
+    def _drain(self, final):
+        events = []
+        buf = self._buf
+        pos = 0
+        while True:
+            idx = buf.find(SECTION_PREFIX, pos)
+            if idx < 0:
+                break
+            self._emit(events, buf[pos:idx])
+            tail = _MARKER_TAIL.match(buf, idx + len(SECTION_PREFIX))
+            end = tail.end()
+            if tail.group(1) is None and "---".startswith(buf[end:]) and not final:
+                # マーカーの途中でチャンクが切れている → 次の feed まで保留
+                self._buf = buf[idx:]
+                return events
+            marker = buf[idx:end]
+            self.saw_marker = True
+            key = SECTION_MARKERS.get(marker)
+            if key is None:
+                self._discard = True
+            else:
+                self._discard = False
+                self.current = key
+            pos = end
+
+        rest = buf[pos:]
+        if not final:
+            # 末尾が "---SECTION" の先頭部分と一致する場合は保留
+            hold = 0
+            for n in range(min(len(rest), len(SECTION_PREFIX) - 1), 0, -1):
+                if SECTION_PREFIX.startswith(rest[-n:]):
+                    hold = n
+                    break
+            if hold:
+                self._emit(events, rest[:-hold])
+                self._buf = rest[-hold:]
+                return events
+        self._emit(events, rest)
+        self._buf = ""
+        return events
+
+
+def parse_sections(raw):
+    """全文を一括で分割する (非ストリーミング用)"""
+    parser = SectionParser()
+    parser.feed(raw)
+    parser.close()
+    return parser
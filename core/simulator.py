@@ -0,0 +1,256 @@
+"""負荷・規模テスト用の ICU 患者シミュレーター (NumPy ベクトル化)
+
+    python -m core.simulator [--patients 30] [--hours 72] [--interval 60] [--scenario mixed]
+                             [--store | --export DIR [--format JSON]] [--lab-interval H] [--missing P]
+
+VV-ECMO 管理中の患者の経過を、入力列 (PaO2・FiO2・Hb・CO・SpO2・SvO2・ECMO_Flow・電解質 …) の
+間で辻褄が合うように作る。派生列 (P/F・DO2・VO2・O2ER・AG・Flow_Ratio) は core.physiology で計算する。
+
+  動脈血酸素飽和度: ECMO で酸素化される割合 c = ECMO_Flow × (1 - 再循環率) / CO と
+                   肺のシャント率から、Fick の式 (SvO2 = SaO2 - VO2 / (13.4 Hb CO)) と連立して閉じた形で解く
+  PaO2: Hill の式 (P50 26.8 mmHg, n 2.7) の逆関数 / pH: Henderson-Hasselbalch (HCO3, PaCO2)
+
+シナリオ
+  stable         小さな揺らぎのみ
+  sepsis_shunt   敗血症の発症 (ロジスティック): CO・VO2 が上がりシャント率も増える。ECMO 流量は
+                 据え置きなので Flow/CO が 60% を割り、Lactate 上昇・代謝性アシドーシス・FiO2 増量
+  recirculation  カニューレ位置の変化で再循環率が上がる: 脱血側の SvO2 が見かけ上 80% を超え、
+                 SaO2 は下がる。流量を上げて対応するほど再循環が増える
+  mixed          患者ごとに上の3つから選ぶ (MIX の比率)
+
+患者数×時刻の2次元配列をまとめて作る (書き出しなしで 200 万行/秒程度)。
+"""
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+from core.physiology import DERIVED_COLUMNS, derive
+
+SCENARIOS = ("stable", "sepsis_shunt", "recirculation")
+MIX = (0.4, 0.35, 0.25)
+LAB_COLUMNS = ("Lactate", "pH", "Na", "Cl", "HCO3", "Alb", "Hb", "PaO2", "PaCO2")
+BLOCK_CELLS = 1 << 18       # 1回に作る 患者×時刻 の上限 (メモリ 数十 MB)
+
+# 酸素解離曲線 (Hill)
+P50 = 26.8
+HILL_N = 2.7
+
+
+@dataclass
+class SimPatient:
+    patient_id: str
+    scenario: str
+    times: np.ndarray        # datetime64[ns]
+    columns: dict            # {列名: float64 配列}
+
+    def __len__(self):
+        return len(self.times)
+
+    def trend(self):
+        from core.trend_store import PatientTrend
+        trend = PatientTrend(capacity=max(64, len(self)))
+        trend.extend_arrays(self.times, self.columns)
+        return trend
+
+
+def patient_ids(n, prefix="SIM"):
+    """画面の PATIENT ID と同じ英数字 10 文字以内"""
+    width = max(4, len(str(n - 1)))
+    return [f"{prefix}{i:0{width}d}" for i in range(n)]
+
+
+def _logistic(x):
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -50, 50)))
+
+
+def _drift(rng, p, hours):
+    """周期 3〜12h の正弦波2本の和 (-1〜1): 患者ごとにゆっくり揺れる成分"""
+    period = rng.uniform(3, 12, (p, 2))
+    phase = rng.uniform(0, 2 * np.pi, (p, 2))
+    w = 2 * np.pi / period
+    return 0.5 * (np.sin(w[:, :1] * hours + phase[:, :1]) + np.sin(w[:, 1:] * hours + phase[:, 1:]))
+
+
+def simulate_block(scenarios, hours, rng):
+    """scenarios (患者ごとのシナリオ名) × hours (経過時間の配列) の入力列と派生列 {列名: (患者, 時刻)}"""
+    p = len(scenarios)
+    shape = (p, len(hours))
+    kind = np.array([SCENARIOS.index(s) for s in scenarios])[:, None]
+    span = max(float(hours[-1]), 1.0)
+
+    def noise(scale):
+        return scale * rng.standard_normal(shape, dtype=np.float32)
+
+    def base(lo, hi):
+        return rng.uniform(lo, hi, (p, 1))
+
+    # 患者ごとの基礎値 (VV-ECMO 導入済みの重症 ARDS)
+    hb0, co0, vo0 = base(8.5, 11.5), base(4.5, 6.0), base(150, 210)
+    shunt0, ecmo0, fio0 = base(0.25, 0.45), base(3.8, 4.8), base(40, 60)
+    paco2_0, lac0 = base(36, 44), base(0.8, 1.6)
+    na0, cl0, alb0 = base(136, 142), base(101, 106), base(3.0, 3.8)
+
+    # 重症度 s (敗血症) と再循環率 r: 発症時刻・立ち上がりは患者ごと
+    onset = rng.uniform(0.2, 0.6, (p, 1)) * span
+    s = np.where(kind == 1, _logistic((hours - onset) / base(1.0, 4.0)), 0.03)
+    r = 0.05 + np.where(kind == 2, 0.55 * _logistic((hours - onset) / 0.5), 0.0)
+    dh, dr = _drift(rng, p, hours), _drift(rng, p, hours)
+
+    co = co0 * (1 + 0.6 * s) * (1 + 0.05 * dh) + noise(0.15)
+    vo2 = vo0 * (1 + 0.35 * s) * (1 + 0.03 * dh)
+    hb = hb0 - 1.2 * s + noise(0.1)
+    # 再循環には流量を上げて対応する (ポンプ設定なので 0.1 L/min 刻み)
+    ecmo = np.round(ecmo0 + (r - 0.05) + noise(0.02), 1)
+    shunt = np.clip(shunt0 + 0.3 * s + 0.03 * dr, 0.02, 0.85)
+    fio2 = np.clip(np.round((fio0 + 50 * s) / 5) * 5, 21, 100)
+
+    # SaO2 = A + B SvO2 と Fick (SvO2 = SaO2 - D) の連立
+    capture = np.clip(ecmo * (1 - r) / co, 0, 1)
+    d = vo2 / (13.4 * hb * co)
+    a = capture + (1 - capture) * (1 - shunt) * 0.98
+    b = (1 - capture) * shunt
+    sa = np.clip((a - b * d) / (1 - b), 0.55, 0.995)
+    sv = np.clip(sa - d, 0.2, 0.95)
+
+    paco2 = paco2_0 * (1 + 0.25 * (r - 0.05)) + 2 * dr + noise(1.5)
+    lac = np.maximum(lac0 + 6 * s * s + 4 * np.maximum(0.6 - sv, 0) + noise(0.2), 0.5)
+    hco3 = 24.5 - 0.9 * (lac - 1) - 2 * s + noise(0.6)
+    cols = {
+        "PaO2": P50 * (sa / (1 - sa)) ** (1 / HILL_N) * (1 + noise(0.03)),
+        "FiO2": fio2,
+        "Hb": hb,
+        "CO": co,
+        "SpO2": np.minimum(sa * 100 + noise(1.0), 100),
+        # 脱血側で測るので再循環した酸素化血が混ざる
+        "SvO2": np.minimum((sv + r * (1 - sv)) * 100 + noise(1.5), 100),
+        "ECMO_Flow": ecmo,
+        "PaCO2": paco2,
+        "Lactate": lac,
+        "HCO3": hco3,
+        "pH": 6.1 + np.log10(hco3 / (0.0307 * paco2)) + noise(0.01),
+        "Na": na0 - 2 * s + noise(1.0),
+        "Cl": cl0 + 5 * s + noise(1.0),
+        "Alb": np.maximum(alb0 - 1.0 * s + noise(0.1), 1.5),
+    }
+    cols = {name: np.asarray(v, dtype=np.float64) for name, v in cols.items()}
+    derived = derive(cols)
+    cols.update({name: derived[name] for name in DERIVED_COLUMNS})
+    return cols
+
+
+def _sparsify(cols, rng, interval, lab_interval, missing):
+    """検査値を lab_interval (時間) ごとに間引き、全列を missing の割合で欠測にする"""
+    if lab_interval:
+        every = max(1, int(round(lab_interval * 3600 / interval)))
+        skip = np.arange(next(iter(cols.values())).shape[1]) % every != 0
+        for name in LAB_COLUMNS:
+            cols[name][:, skip] = np.nan
+    if missing:
+        for v in cols.values():
+            v[rng.random(v.shape, dtype=np.float32) < missing] = np.nan
+
+
+def simulate(patients=10, hours=24.0, interval=60.0, scenario="mixed", seed=0, start=None,
+             lab_interval=None, missing=0.0, prefix="SIM"):
+    """SimPatient を患者順に返すジェネレーター
+
+    interval: サンプリング間隔 (秒)、start: 最初の時刻 (既定は「今」から hours 前。直近のデータとして扱われる)
+    lab_interval: 検査値 (LAB_COLUMNS) の測定間隔 (時間)。None ならバイタルと同じ間隔
+    派生列は間引く前の値で計算する (実際の記録と同じく、測定時の値を保存したもの)。
+    """
+    rng = np.random.default_rng(seed)
+    n = max(1, int(hours * 3600 // interval))
+    step = np.timedelta64(int(round(interval * 1e9)), "ns")
+    if start is None:
+        start = np.datetime64(datetime.now(), "s") - n * step
+    times = np.datetime64(start, "ns") + np.arange(n) * step
+    elapsed = np.arange(n) * (interval / 3600)
+    if scenario == "mixed":
+        kinds = rng.choice(SCENARIOS, size=patients, p=MIX)
+    elif scenario in SCENARIOS:
+        kinds = [scenario] * patients
+    else:
+        raise ValueError(f"unknown scenario: {scenario} (choose from {', '.join(SCENARIOS)}, mixed)")
+
+    ids = patient_ids(patients, prefix)
+    per_block = max(1, BLOCK_CELLS // n)
+    for lo in range(0, patients, per_block):
+        block = list(kinds[lo:lo + per_block])
+        cols = simulate_block(block, elapsed, rng)
+        _sparsify(cols, rng, interval, lab_interval, missing)
+        for i, kind in enumerate(block):
+            yield SimPatient(ids[lo + i], str(kind), times, {name: v[i] for name, v in cols.items()})
+
+
+# ==========================================
+# 書き出し
+# ==========================================
+def write_store(store, sim):
+    """各患者の履歴を store (TrendStore / SQLiteTrendStore) に置き換えて保存。書いた行数"""
+    rows = 0
+    for patient in sim:
+        store.put(patient.patient_id, patient.trend())
+        rows += len(patient)
+    return rows
+
+
+def write_exports(directory, sim, fmt="JSON"):
+    """画面の DOWNLOAD と同じ形式・ファイル名 (ICU_DATA_*) で書き出す。(行数, パスのリスト)"""
+    from core.backup import backup_filename, export_backup
+    os.makedirs(directory, exist_ok=True)
+    rows, paths = 0, []
+    for patient in sim:
+        data = export_backup(patient.trend(), fmt)
+        path = os.path.join(directory, backup_filename(patient.patient_id, fmt))
+        with open(path, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        rows += len(patient)
+        paths.append(path)
+    return rows, paths
+
+
+def main(argv=None):
+    from core.backup import EXPORT_FORMATS
+    p = argparse.ArgumentParser(prog="python -m core.simulator", description="合成 ICU 患者データを作る")
+    p.add_argument("--patients", type=int, default=30)
+    p.add_argument("--hours", type=float, default=72.0)
+    p.add_argument("--interval", type=float, default=60.0, help="サンプリング間隔 (秒)")
+    p.add_argument("--scenario", default="mixed", choices=(*SCENARIOS, "mixed"))
+    p.add_argument("--lab-interval", type=float, help="検査値の測定間隔 (時間)")
+    p.add_argument("--missing", type=float, default=0.0, help="ランダムに欠測にする割合")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--prefix", default="SIM")
+    out = p.add_mutually_exclusive_group()
+    out.add_argument("--store", action="store_true", help="共有の患者ストア (KS_DATA_DIR/patients.sqlite) に書く")
+    out.add_argument("--export", metavar="DIR", help="ICU_DATA_*.json などを書き出すディレクトリ")
+    p.add_argument("--format", default="JSON", choices=list(EXPORT_FORMATS))
+    args = p.parse_args(argv)
+
+    sim = simulate(args.patients, args.hours, args.interval, args.scenario, seed=args.seed,
+                   lab_interval=args.lab_interval, missing=args.missing, prefix=args.prefix)
+    t0 = time.perf_counter()
+    if args.store:
+        from core.patient_store import get_patient_store
+        store = get_patient_store()
+        rows = write_store(store, sim)
+        store.flush()
+        target = "patient store"
+    elif args.export:
+        rows, paths = write_exports(args.export, sim, args.format)
+        target = f"{len(paths)} files in {args.export}"
+    else:
+        # 生成だけ (速度の確認用)
+        rows = sum(len(patient) for patient in sim)
+        target = "(not written)"
+    elapsed = time.perf_counter() - t0
+    print(f"{args.patients} patients x {rows // max(args.patients, 1):,} rows = {rows:,} rows "
+          f"({args.scenario}) in {elapsed:.2f} s ({rows / max(elapsed, 1e-9) / 1e6:.2f} M rows/s) -> {target}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
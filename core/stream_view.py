@@ -0,0 +1,65 @@
+"""セクション別ストリーミング表示 (Streamlit)
+
+チャンクが届くたびに該当セクションの st.error / st.warning / st.info だけを
+書き換える。セクションの表示位置は到着順ではなく SECTION_ORDER で固定。
+"""
+import time
+
+import streamlit as st
+
+from core.sections import SECTION_ORDER, SectionParser
+
+
+def render_section_stream(chunks, alerts, fact_title, on_fact_done=None, trace=None):
+    """chunks を読みながら描画し、最後に SectionParser を返す
+
+    alerts: {"emergency": ("error", "見出し", "⚡"), ...}
+    on_fact_done: エビデンス展開部の末尾に追加描画する関数 (完了時のみ)
+    trace: core.tracing.Trace (セクション分割と描画の合計時間を parse / render として記録)
+    """
+    raw_slot = st.empty()
+    slots = {key: st.empty() for key in SECTION_ORDER}
+    parser = SectionParser()
+
+    def _draw(key, done=False):
+        body = parser.text(key)
+        if key == "fact":
+            with slots[key].container():
+                with st.expander(fact_title):
+                    st.markdown(body)
+                    if done and on_fact_done:
+                        on_fact_done()
+            return
+        kind, title, icon = alerts[key]
+        getattr(slots[key], kind)(f"{title}\n\n{body}", icon=icon)
+
+    parse_s = render_s = 0.0
+    n = 0
+    for chunk in chunks:
+        t0 = time.perf_counter()
+        touched = {key for key, _ in parser.feed(chunk)}
+        t1 = time.perf_counter()
+        parse_s += t1 - t0
+        n += 1
+        if not parser.saw_marker:
+            # マーカー出現前は生テキストをそのまま流す
+            raw_slot.markdown(parser.raw)
+        else:
+            raw_slot.empty()
+            for key in touched:
+                if key is not None:
+                    _draw(key)
+        render_s += time.perf_counter() - t1
+
+    t0 = time.perf_counter()
+    parser.close()
+    t1 = time.perf_counter()
+    for key in SECTION_ORDER:
+        if key in parser.sections:
+            _draw(key, done=True)
+    if not parser.saw_marker:
+        raw_slot.write(parser.raw)
+    if trace is not None:
+        trace.add("parse", (parse_s + t1 - t0) * 1000, chunks=n)
+        trace.add("render", (render_s + time.perf_counter() - t1) * 1000)
+    return parser
@@ -0,0 +1,271 @@
+"""プロセス共有のレート制限と同一リクエストの相乗り (single-flight)
+
+Streamlit は1プロセスで全ユーザーのセッションを処理するので、ここでの状態は
+サーバー全体で共有される。
+
+  TokenBucket  : API キーごと (llm:<hash>) ・検索バックエンドごと (search:<name>) の上限。
+                 予約方式 (残量が負になった分だけ待つ) なので到着順に通る
+  SingleFlight : 同じキーの呼び出しが実行中なら上流を呼ばずに結果を共有する。
+                 stream() はテキスト片を後から来た呼び出しにも最初から配る
+
+待ち行列の長さ・待ち時間・相乗り回数はサイドバーに出す (throttle_caption)。
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+LLM_RATE = float(os.environ.get("KS_LLM_RPM", "60"))          # 1分あたり
+LLM_BURST = int(os.environ.get("KS_LLM_BURST", "10"))
+SEARCH_RATE = float(os.environ.get("KS_SEARCH_RPM", "20"))
+SEARCH_BURST = int(os.environ.get("KS_SEARCH_BURST", "5"))
+
+
+class RateLimited(TimeoutError):
+    """待ち時間が timeout を超えるので実行しなかった"""
+
+
+class TokenBucket:
+    def __init__(self, rate_per_min, burst):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=200)
+
+    def acquire(self, timeout=None):
+        """トークンを1つ取る。待った秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if timeout is not None and wait > timeout:
+                self._tokens += 1
+                self.rejected += 1
+                raise RateLimited(f"rate limit: {wait:.2f}s wait exceeds {timeout:.2f}s")
+            self.acquired += 1
+            if wait:
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+        if wait:
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        with self._lock:
+            self.waits.append(wait)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            waits = list(self.waits)
+            return {
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "acquired": self.acquired,
+                "rejected": self.rejected,
+                "wait_p95_ms": round(float(np.percentile(waits, 95)) * 1000, 1) if waits else 0.0,
+            }
+
+
+class RateLimiter:
+    """名前ごとの TokenBucket"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name, rate_per_min, burst):
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = TokenBucket(rate_per_min, burst)
+            return bucket
+
+    def acquire_llm(self, api_key=None, timeout=None):
+        # 生のキーは辞書キーに使わない
+        name = "llm:" + (hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else "default")
+        return self.bucket(name, LLM_RATE, LLM_BURST).acquire(timeout)
+
+    def acquire_search(self, backend, timeout=None):
+        return self.bucket(f"search:{backend}", SEARCH_RATE, SEARCH_BURST).acquire(timeout)
+
+    def stats(self):
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {name: b.stats() for name, b in buckets.items()}
+
+
+class _Flight:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """テキスト片を貯めて、読み手ごとに先頭から配る"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def append(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def reader(self):
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                if i < len(self.chunks):
+                    chunk = self.chunks[i]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            i += 1
+            yield chunk
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """key が実行中ならその結果を待って共有、そうでなければ fn() を実行"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def stream(self, key, start):
+        """テキスト片のイテレータを共有する
+
+        先頭の呼び出しだけが start() で上流を開始し、専用スレッドで最後まで読み切る
+        (読み手の再実行・中断で上流の受信とキャッシュ保存が止まらない)。
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                source = start()
+            except Exception as e:
+                self._end_stream(key, broadcast, e)
+                raise
+            threading.Thread(target=self._pump, args=(key, broadcast, source), daemon=True,
+                             name="single-flight").start()
+        return broadcast.reader()
+
+    def _end_stream(self, key, broadcast, error=None):
+        with self._lock:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+        broadcast.finish(error)
+
+    def _pump(self, key, broadcast, source):
+        try:
+            for chunk in source:
+                broadcast.append(chunk)
+        except Exception as e:
+            self._end_stream(key, broadcast, e)
+        else:
+            self._end_stream(key, broadcast)
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._flights) + len(self._streams),
+                    "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+def get_single_flight():
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
+
+
+def throttle_caption():
+    """サイドバー用の1行 (待ち行列・待ち時間・相乗り)"""
+    kinds = {}
+    for name, b in get_limiter().stats().items():
+        # API キー・バックエンドの別は種類 (LLM / SEARCH) ごとにまとめる
+        k = kinds.setdefault(name.split(":")[0].upper(), {"waiting": 0, "max_waiting": 0, "wait_p95_ms": 0.0})
+        k["waiting"] += b["waiting"]
+        k["max_waiting"] = max(k["max_waiting"], b["max_waiting"])
+        k["wait_p95_ms"] = max(k["wait_p95_ms"], b["wait_p95_ms"])
+    flights = get_single_flight().stats()
+    parts = [f"{kind} queue {k['waiting']} (max {k['max_waiting']}) wait p95 {k['wait_p95_ms']:.0f} ms"
+             for kind, k in sorted(kinds.items())]
+    parts.append(f"in-flight {flights['in_flight']} / coalesced {flights['coalesced']}")
+    return "THROTTLE: " + " | ".join(parts)
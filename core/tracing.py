@@ -0,0 +1,215 @@
+"""ステージ別の所要時間 (span) の記録と集計
+
+診断・研究検索の1回分を1つの Trace とし、ステージごとの span を記録する。
+  models     モデル一覧の取得 (カタログのミス時のみ。画面をまたいで共有)
+  keywords   検索語の抽出 (LLM)
+  search     エビデンス・文献検索
+  image      画像の縮小・再圧縮
+  trend      トレンド要約
+  llm_ttft   生成の開始から最初のテキスト片まで
+  llm_total  生成の開始から最後のテキスト片まで (描画の待ちを含む)
+  parse      セクション分割 / render: Streamlit への描画
+Trace を閉じると span を JSON Lines (trace_path()) に1行ずつ追記し、
+(画面, ステージ) ごとの直近 HISTORY 回分をメモリに残して p50 / p95 を出す。
+並列に走った同じステージ (画像など) は1回分として最初の開始〜最後の終了で数える。
+
+KS_TRACE_LOG: 出力先 (既定 data_dir()/traces/spans.jsonl、"off" でファイルに書かない)
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+HISTORY = 50
+MAX_LOG_BYTES = 16 * 1024 * 1024
+STAGE_ORDER = ("models", "keywords", "translate", "search", "image", "trend", "rules",
+               "llm_ttft", "llm_total", "parse", "render", "total")
+
+
+def trace_path():
+    path = os.environ.get("KS_TRACE_LOG")
+    if path == "off":
+        return None
+    if path:
+        return path
+    from core.patient_store import data_dir
+    return os.path.join(data_dir(), "traces", "spans.jsonl")
+
+
+class Trace:
+    """1回分の span。スレッドから add / span してよい。finish() (with を抜けたとき) で書き出す"""
+
+    def __init__(self, tracer, app, attrs):
+        self.tracer = tracer
+        self.app = app
+        self.id = uuid.uuid4().hex[:12]
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.attrs = attrs
+        self.spans = []
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc if isinstance(exc, Exception) else None)
+
+    def add(self, stage, ms, start=None, **attrs):
+        """所要 ms の span を追加 (start は perf_counter の値。省略時は今から ms 前)"""
+        start_ms = (start - self.t0) * 1000 if start is not None else (time.perf_counter() - self.t0) * 1000 - ms
+        with self._lock:
+            self.spans.append({"stage": stage, "start_ms": round(start_ms, 1), "ms": round(ms, 1), **attrs})
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000, start=start, **attrs)
+
+    def stream(self, chunks, start=None):
+        """テキスト片のイテレータを包み、llm_ttft と llm_total を記録する
+
+        start: 生成を開始した時刻 (generate() は呼んだ時点で API 呼び出しを始める)
+        """
+        start = time.perf_counter() if start is None else start
+        first = None
+        chars = 0
+        error = None
+        try:
+            for chunk in chunks:
+                if first is None:
+                    first = time.perf_counter()
+                    self.add("llm_ttft", (first - start) * 1000, start=start)
+                chars += len(chunk)
+                yield chunk
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            extra = {"error": error} if error else {}
+            self.add("llm_total", (time.perf_counter() - start) * 1000, start=start, chars=chars, **extra)
+
+    def add_timer(self, timer):
+        """core.pipeline.StageTimer の記録を取り込む (image[i] は stage=image, index=i)"""
+        offset = timer.t0 - self.t0
+        for row in timer.rows():
+            m = re.fullmatch(r"(\w+)\[(\d+)\]", row["stage"])
+            stage, extra = (m.group(1), {"index": int(m.group(2))}) if m else (row["stage"], {})
+            self.add(stage, row["duration_ms"], start=self.t0 + offset + row["start_ms"] / 1000, **extra)
+
+    def stage_ms(self):
+        """ステージごとの所要 ms (同じステージが複数あれば最初の開始〜最後の終了)"""
+        with self._lock:
+            spans = list(self.spans)
+        envelope = {}
+        for s in spans:
+            lo, hi = envelope.get(s["stage"], (s["start_ms"], s["start_ms"] + s["ms"]))
+            envelope[s["stage"]] = (min(lo, s["start_ms"]), max(hi, s["start_ms"] + s["ms"]))
+        return {stage: round(hi - lo, 1) for stage, (lo, hi) in envelope.items()}
+
+    def finish(self, error=None):
+        if self.finished:
+            return
+        self.finished = True
+        total = (time.perf_counter() - self.t0) * 1000
+        extra = {"error": f"{type(error).__name__}: {error}"} if error is not None else {}
+        self.add("total", total, start=self.t0, **self.attrs, **extra)
+        self.tracer._finish(self)
+
+
+class Tracer:
+    def __init__(self, path=None, history=HISTORY, max_bytes=MAX_LOG_BYTES):
+        self.path = trace_path() if path is None else path or None
+        self.history = history
+        self.max_bytes = max_bytes
+        self._samples = {}      # (app, stage) -> deque[ms]
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.write_errors = 0
+
+    def start(self, app, **attrs):
+        return Trace(self, app, attrs)
+
+    def record(self, stage, ms, app="", **attrs):
+        """Trace に属さない単発の span (app="" は全画面共通として集計)"""
+        trace = Trace(self, app, {})
+        trace.add(stage, ms, start=trace.t0, **attrs)
+        trace.finished = True
+        self._finish(trace, with_total=False)
+
+    @contextmanager
+    def span(self, stage, app="", **attrs):
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000, app=app, **attrs)
+
+    def _finish(self, trace, with_total=True):
+        with self._lock:
+            for stage, ms in trace.stage_ms().items():
+                if stage == "total" and not with_total:
+                    continue
+                self._samples.setdefault((trace.app, stage), deque(maxlen=self.history)).append(ms)
+        with trace._lock:
+            lines = [json.dumps({"ts": round(trace.ts, 3), "trace": trace.id, "app": trace.app, **s},
+                                ensure_ascii=False, default=str) for s in trace.spans]
+        self._write(lines)
+
+    def _write(self, lines):
+        if not self.path or not lines:
+            return
+        try:
+            with self._write_lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    # 1世代だけ残して切り替える
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+        except OSError:
+            # 計測の失敗で診断を止めない
+            self.write_errors += 1
+
+    def stats(self, app=None, last=None):
+        """ステージごとの p50 / p95 (ms)。app を指定すると、その画面と全画面共通 (app="") の分"""
+        with self._lock:
+            samples = {k: list(v) for k, v in self._samples.items() if app is None or k[0] in (app, "")}
+        merged = {}
+        for (_, stage), values in samples.items():
+            merged.setdefault(stage, []).extend(values[-last:] if last else values)
+        order = {s: i for i, s in enumerate(STAGE_ORDER)}
+        return [{"stage": stage, "n": len(v),
+                 "p50_ms": round(float(np.percentile(v, 50)), 1),
+                 "p95_ms": round(float(np.percentile(v, 95)), 1),
+                 "last_ms": v[-1]}
+                for stage, v in sorted(merged.items(), key=lambda kv: (order.get(kv[0], len(order)), kv[0])) if v]
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer()
+    return _tracer
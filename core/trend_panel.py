@@ -0,0 +1,129 @@
+"""VITAL TRENDS タブの描画部品 (Streamlit)
+
+app_pro.py ではこれらを st.fragment で包み、再実行の単位を分ける。
+  - render_inputs : 入力欄 + 指標プレビュー (入力のたびにここだけ再実行)
+  - render_charts : DUAL TREND グラフ (保存時・表示切替時のみ再実行)
+  - render_rule_alerts : core.rules の判定結果 (emergency / warning のみ)
+入力値は session_state のキーから読むので、保存ボタンは入力の fragment の外に置ける。
+"""
+from datetime import datetime
+
+import numpy as np
+import streamlit as st
+
+from core.downsample import downsample_view
+from core.physiology import derive_one
+
+# (列名, ラベル, step, help) を画面の列ごとに
+INPUT_LAYOUT = (
+    (("PaO2", "PaO2", 1.0, None),
+     ("PaCO2", "PaCO2", 1.0, "24h で 50% を超える低下は脳血管収縮リスク"),
+     ("FiO2", "FiO2 (%)", 1.0, None),
+     ("Lactate", "Lactate (mmol/L)", 0.1, None)),
+    (("Hb", "Hb (g/dL)", 0.1, None),
+     ("CO", "CO (L/min)", 0.1, None),
+     ("SpO2", "SpO2 (%)", 1.0, None)),
+    (("pH", "pH", 0.01, None),
+     ("SvO2", "SvO2 (Pre) %", 1.0, "VV-ECMO時はRecirculationに注意"),
+     ("ECMO_Flow", "ECMO Flow (L/min)", 0.1, "VV-ECMO流量")),
+)
+ELECTROLYTE_LAYOUT = (("Na", "Na", 1.0), ("Cl", "Cl", 1.0), ("HCO3", "HCO3", 0.1), ("Alb", "Alb", 0.1))
+INPUT_NAMES = tuple(f[0] for col in INPUT_LAYOUT for f in col) + tuple(f[0] for f in ELECTROLYTE_LAYOUT)
+
+VIEW_RANGES = {"1h": np.timedelta64(1, "h"), "6h": np.timedelta64(6, "h"), "24h": np.timedelta64(24, "h"),
+               "72h": np.timedelta64(72, "h"), "ALL": None}
+
+
+def input_key(name):
+    return f"vital_in_{name}"
+
+
+def read_inputs():
+    """session_state から現在の入力値を読む (未描画なら 0.0)"""
+    return {name: st.session_state.get(input_key(name), 0.0) for name in INPUT_NAMES}
+
+
+def derive_inputs(values):
+    return derive_one(PaO2=values["PaO2"], FiO2=values["FiO2"], Hb=values["Hb"], CO=values["CO"],
+                      SpO2=values["SpO2"], SvO2=values["SvO2"], Na=values["Na"], Cl=values["Cl"],
+                      HCO3=values["HCO3"], Alb=values["Alb"], ECMO_Flow=values["ECMO_Flow"])
+
+
+def render_inputs():
+    """入力欄と計算プレビュー"""
+    cols = st.columns(3)
+    for col, fields in zip(cols, INPUT_LAYOUT):
+        for name, label, step, help_text in fields:
+            col.number_input(label, step=step, help=help_text, key=input_key(name))
+
+    # 電解質
+    for col, (name, label, step) in zip(st.columns(4), ELECTROLYTE_LAYOUT):
+        col.number_input(label, step=step, key=input_key(name))
+
+    # 計算ロジック (core.physiology: 履歴の一括再計算と同じ式)
+    d = derive_inputs(read_inputs())
+    pf, do2, vo2, o2er = d["P/F"], d["DO2"], d["VO2"], d["O2ER"]
+    ag, c_ag, flow_ratio = d["AG_raw"], d["cAG"], d["Flow_Ratio"]
+
+    # プレビュー
+    if pf or do2 or o2er or ag:
+        st.markdown("---")
+        cols = st.columns(5)
+        cols[0].metric("P/F", f"{pf:.0f}" if pf else "-")
+        cols[1].metric("DO2", f"{do2:.0f}" if do2 else "-")
+        cols[2].metric("VO2", f"{vo2:.0f}" if vo2 else "-")
+        cols[3].metric("O2ER", f"{o2er:.1f}%" if o2er else "-")
+        cols[4].metric("AG(c)", f"{c_ag:.1f}" if c_ag else (f"{ag:.1f}" if ag else "-"))
+
+        if flow_ratio:
+            ratio_delta = "Capture OK" if flow_ratio >= 60 else "⚠️ High Shunt"
+            delta_color = "normal" if flow_ratio >= 60 else "inverse"
+            st.metric("Flow/CO Ratio", f"{flow_ratio:.0f}%", ratio_delta, delta_color=delta_color)
+
+
+def make_record(values):
+    """ZERO-FILTER (V4.6): 0 より大きい場合のみ値を保存、そうでなければ None"""
+    d = derive_inputs(values)
+    record = {"Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    for name in ("P/F", "DO2", "VO2", "O2ER"):
+        record[name] = d[name] or None
+    record["AG"] = d["cAG"] or d["AG_raw"] or None
+    for name in INPUT_NAMES:
+        v = values[name]
+        record[name] = v if v and v > 0 else None
+    record["Flow_Ratio"] = d["Flow_Ratio"] or None
+    return record
+
+
+def render_charts(trend, patient_id):
+    """DUAL TREND ANALYSIS (Dual Panel - Robust)"""
+    if not len(trend):
+        return
+    # 列はレジストリ (core.schema) で固定・数値化済み → 変換なしでキャッシュ済み DataFrame を使う
+    df = trend.frame()
+    available_cols = trend.available()
+
+    st.markdown("### 📉 DUAL TREND ANALYSIS")
+    # 表示範囲とグラフ幅から点数を決めて間引く (乳酸スパイク等の極値は保持)
+    view_label = st.radio("Visible Range", list(VIEW_RANGES), index=len(VIEW_RANGES) - 1, horizontal=True, key="view_range")
+    window = VIEW_RANGES[view_label]
+    view_key = (patient_id, trend.token)
+
+    panels = (("A", "##### 📉 Trend Monitor A (Main)", ["DO2", "VO2"], "vol_sel"),
+              ("B", "##### 📉 Trend Monitor B (Sub/Correlated)", ["Lactate", "O2ER", "SvO2"], "res_sel"))
+    for col, (tag, title, wanted, key) in zip(st.columns(2), panels):
+        with col:
+            st.markdown(title)
+            safe_default = [c for c in wanted if c in available_cols]
+            selected = st.multiselect(f"Select Parameters {tag}", options=available_cols, default=safe_default, key=key)
+            if selected:
+                st.line_chart(downsample_view(df, selected, view_key, trend.version, window=window))
+
+
+def render_rule_alerts(findings):
+    """ルールエンジンの判定を表示 (info は出さない)"""
+    for f in findings:
+        if f.severity == "emergency":
+            st.error(f"🚨 {f.rule}: {f.message}")
+        elif f.severity == "warning":
+            st.warning(f"⚠️ {f.rule}: {f.message}")
@@ -0,0 +1,252 @@
+"""患者ごとの列指向トレンドストア
+
+従来の list-of-dicts は rerun のたびに DataFrame 化と pd.to_numeric を繰り返していた。
+PatientTrend は float64 の列配列 + datetime64 の時刻配列を容量倍増で伸ばし、
+追記は償却 O(1)。DataFrame は版 (version) ごとに1回だけ作ってキャッシュする。
+"""
+import itertools
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from core.schema import COLUMN_INDEX, COLUMN_NAMES, TIME_COLUMN
+
+_TIME_FORMATS = ("%H:%M:%S", "%H:%M")
+_tokens = itertools.count(1)
+
+
+def parse_time(value, today=None, after=None):
+    """"HH:MM(:SS)"・ISO 文字列・datetime を datetime64[ns] へ
+
+    日付のない "HH:MM(:SS)" (旧形式のバックアップ・デモ) は after (直前の行の時刻) の日付に置き、
+    after より前なら日付をまたいだとみなして翌日にする。after がなければ today
+    (省略時は今日。未来になるなら前日) の時刻とする。
+    """
+    if value is None or value == "":
+        return np.datetime64(datetime.now(), "ns")
+    if isinstance(value, np.datetime64):
+        return value.astype("datetime64[ns]")
+    if isinstance(value, datetime):
+        return np.datetime64(value, "ns")
+    text = str(value).strip()
+    if len(text) > 8:
+        # 日付付き (バックアップの "YYYY-MM-DD HH:MM:SS") は strptime を試さず ISO として読む
+        return np.datetime64(datetime.fromisoformat(text), "ns")
+    for fmt in _TIME_FORMATS:
+        try:
+            t = datetime.strptime(text, fmt).time()
+        except ValueError:
+            continue
+        return _clock_time(t, today, after)
+    return np.datetime64(datetime.fromisoformat(text), "ns")
+
+
+def _clock_time(t, today, after):
+    if after is not None and not np.isnat(after):
+        prev = after.astype("datetime64[us]").item()
+        stamp = datetime.combine(prev.date(), t)
+        return np.datetime64(stamp if stamp >= prev else stamp + timedelta(days=1), "ns")
+    now = datetime.now()
+    stamp = datetime.combine(today or now.date(), t)
+    if today is None and stamp > now:
+        stamp -= timedelta(days=1)
+    return np.datetime64(stamp, "ns")
+
+
+def to_float(value):
+    """pd.to_numeric(errors='coerce') 相当: 数値化できなければ NaN"""
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class PatientTrend:
+    """1患者分のトレンド (列 = float64 配列, 行 = 時刻)"""
+
+    def __init__(self, capacity=64):
+        self.n = 0
+        self.version = 0
+        # インスタンスごとに一意 (id() と違って GC 後も再利用されない)。置換・消去で作り直されたら別物
+        self.token = next(_tokens)
+        self._data = np.full((len(COLUMN_NAMES), capacity), np.nan)
+        self._time = np.empty(capacity, dtype="datetime64[ns]")
+        self._frame = None
+        self._frame_version = -1
+
+    def __len__(self):
+        return self.n
+
+    def _reserve(self, extra):
+        need = self.n + extra
+        cap = self._time.shape[0]
+        if need <= cap:
+            return
+        while cap < need:
+            cap *= 2
+        data = np.full((len(COLUMN_NAMES), cap), np.nan)
+        data[:, :self.n] = self._data[:, :self.n]
+        time = np.empty(cap, dtype="datetime64[ns]")
+        time[:self.n] = self._time[:self.n]
+        self._data, self._time = data, time
+
+    def append(self, record):
+        """1行追記して、その行の位置を返す
+
+        時刻が末尾より前 (手入力の後追い記録など) なら時刻順の位置に差し込む。
+        """
+        self._reserve(1)
+        n = self.n
+        t = parse_time(record.get(TIME_COLUMN), after=self._time[n - 1] if n else None)
+        row = np.full(len(COLUMN_NAMES), np.nan)
+        for name, value in record.items():
+            j = COLUMN_INDEX.get(name)
+            if j is not None:
+                row[j] = to_float(value)
+        i = n
+        if n and t < self._time[n - 1]:
+            # 同時刻なら既存の後ろ
+            i = int(np.searchsorted(self._time[:n], t, side="right"))
+            self._time[i + 1:n + 1] = self._time[i:n]
+            self._data[:, i + 1:n + 1] = self._data[:, i:n]
+        self._time[i] = t
+        self._data[:, i] = row
+        self.n += 1
+        self.version += 1
+        return i
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def extend_arrays(self, times, columns):
+        """一括追記。times: datetime64 配列, columns: {列名: 配列} (時刻順でなければ全体を並べ直す)"""
+        times = np.asarray(times, dtype="datetime64[ns]")
+        m = times.shape[0]
+        if m == 0:
+            return
+        self._reserve(m)
+        start, end = self.n, self.n + m
+        self._time[start:end] = times
+        self._data[:, start:end] = np.nan
+        for name, values in columns.items():
+            j = COLUMN_INDEX.get(name)
+            if j is not None:
+                self._data[j, start:end] = np.asarray(values, dtype=np.float64)
+        self.n = end
+        self.version += 1
+        if (start and times[0] < self._time[start - 1]) or not bool(np.all(times[1:] >= times[:-1])):
+            self._sort()
+
+    def _sort(self):
+        order = np.argsort(self._time[:self.n], kind="stable")
+        self._time[:self.n] = self._time[:self.n][order]
+        self._data[:, :self.n] = self._data[:, :self.n][:, order]
+        self.version += 1
+
+    def merge_arrays(self, times, columns):
+        """時刻で重複を除いて取り込み、時刻順に並べ直す。追加した行数を返す
+
+        同じ時刻の行は既存を優先 (取り込み側の重複は先勝ち)。
+        """
+        times = np.asarray(times, dtype="datetime64[ns]")
+        if times.shape[0] == 0:
+            return 0
+        _, first = np.unique(times, return_index=True)
+        keep = np.sort(first)
+        current = self.times
+        keep = keep[~np.isin(times[keep], current)]
+        if keep.shape[0] == 0:
+            return 0
+        new_times = times[keep]
+        new_cols = {name: np.asarray(values, dtype=np.float64)[keep] for name, values in columns.items()}
+        # extend_arrays が時刻順を保つ (末尾より後ろだけなら並べ替えずに追記)
+        self.extend_arrays(new_times, new_cols)
+        return keep.shape[0]
+
+    def set_column(self, name, values):
+        """列を丸ごと置き換える (派生列の一括再計算用)"""
+        self._data[COLUMN_INDEX[name], :self.n] = values
+        self.version += 1
+
+    @property
+    def times(self):
+        return self._time[:self.n]
+
+    def column(self, name):
+        return self._data[COLUMN_INDEX[name], :self.n]
+
+    def matrix(self):
+        """(列数, 行数) の値配列 (ビュー。列順は COLUMN_NAMES)"""
+        return self._data[:, :self.n]
+
+    def columns(self):
+        return {name: self._data[j, :self.n] for name, j in COLUMN_INDEX.items()}
+
+    def available(self):
+        """1件でも値のある列名 (レジストリ順)"""
+        mask = ~np.isnan(self._data[:, :self.n]).all(axis=1)
+        return [name for name, ok in zip(COLUMN_NAMES, mask) if ok]
+
+    def frame(self):
+        """DatetimeIndex ("Time") 付きの DataFrame (版ごとにキャッシュ)"""
+        if self._frame_version != self.version:
+            import pandas as pd
+            self._frame = pd.DataFrame(
+                self._data[:, :self.n].T,
+                index=pd.DatetimeIndex(self._time[:self.n], name=TIME_COLUMN),
+                columns=list(COLUMN_NAMES),
+            )
+            self._frame_version = self.version
+        return self._frame
+
+    def to_records(self):
+        """JSON バックアップ用 (NaN → None, 時刻は文字列)"""
+        records = []
+        times = self._time[:self.n].astype("datetime64[s]").astype(str)
+        data = self._data[:, :self.n]
+        for i in range(self.n):
+            record = {TIME_COLUMN: times[i].replace("T", " ")}
+            for j, name in enumerate(COLUMN_NAMES):
+                v = data[j, i]
+                record[name] = None if np.isnan(v) else float(v)
+            records.append(record)
+        return records
+
+
+class TrendStore:
+    """患者 ID → PatientTrend"""
+
+    def __init__(self):
+        self._patients = {}
+
+    def __contains__(self, patient_id):
+        return patient_id in self._patients
+
+    def get(self, patient_id):
+        """PatientTrend を返す (未登録なら空のトレンドを作る)"""
+        trend = self._patients.get(patient_id)
+        if trend is None:
+            trend = self._patients[patient_id] = PatientTrend()
+        return trend
+
+    def patients(self):
+        return list(self._patients)
+
+    def append(self, patient_id, record):
+        self.get(patient_id).append(record)
+
+    def replace(self, patient_id, records):
+        trend = PatientTrend()
+        trend.extend(records)
+        self._patients[patient_id] = trend
+        return trend
+
+    def put(self, patient_id, trend):
+        self._patients[patient_id] = trend
+        return trend
+
+    def clear(self, patient_id):
+        self._patients[patient_id] = PatientTrend()
@@ -0,0 +1,112 @@
+"""AI プロンプト用のトレンド要約 (トークン予算つき)
+
+従来は直近5行の表 (`tail(5).to_markdown()`) だけを渡していたため、
+長期入院の経過が失われ、ほぼ空の列がトークンを浪費していた。
+ここでは全履歴をパラメータごとの統計 (初回・最新・最小・最大・傾き・最終変化時刻) に
+圧縮し、KUSANO_BRAIN の Data Audit 規定向けに重要パラメータの欠損・未更新を明示する。
+"""
+import numpy as np
+
+from core.schema import COLUMN_NAMES, COLUMNS_BY_NAME
+
+DEFAULT_BUDGET = 600
+STALE_HOURS = 6.0
+
+# 予算が足りないときに残す順 (残りはレジストリ順)
+PRIORITY = ("Lactate", "pH", "P/F", "O2ER", "Flow_Ratio", "SvO2", "DO2", "VO2", "AG",
+            "Hb", "CO", "ECMO_Flow", "PaO2", "PaCO2", "FiO2", "SpO2", "Na", "Cl", "HCO3", "Alb")
+
+
+def estimate_tokens(text):
+    """おおよそのトークン数 (ASCII 4文字 ≈ 1、非 ASCII 1文字 ≈ 1)"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def _fmt(v):
+    return f"{v:.3g}" if abs(v) < 1000 else f"{v:.0f}"
+
+
+def _ts(t):
+    return str(t.astype("datetime64[m]")).replace("T", " ")[5:]
+
+
+def column_stats(times, values):
+    """1列分の統計 (値が無ければ None)"""
+    valid = np.flatnonzero(~np.isnan(values))
+    if not len(valid):
+        return None
+    v = values[valid]
+    t = times[valid]
+    hours = (t - t[0]).astype("timedelta64[s]").astype(np.float64) / 3600
+    slope = 0.0
+    if len(v) >= 2 and np.ptp(hours) > 0:
+        h = hours - hours.mean()
+        slope = float((h * (v - v.mean())).sum() / (h * h).sum())
+    changed = np.flatnonzero(np.diff(v) != 0)
+    last_change = t[changed[-1] + 1] if len(changed) else None
+    return {
+        "n": len(v), "first": float(v[0]), "first_t": t[0], "last": float(v[-1]), "last_t": t[-1],
+        "min": float(v.min()), "max": float(v.max()), "slope_per_h": slope, "last_change_t": last_change,
+    }
+
+
+def _line(name, s, compact=False):
+    unit = COLUMNS_BY_NAME[name].unit
+    head = f"- {name}{f' [{unit}]' if unit else ''}: "
+    if compact:
+        return head + f"last {_fmt(s['last'])} ({_ts(s['last_t'])}), range {_fmt(s['min'])}-{_fmt(s['max'])}"
+    if s["n"] == 1:
+        return head + f"{_fmt(s['last'])} ({_ts(s['last_t'])}, n=1)"
+    changed = _ts(s["last_change_t"]) if s["last_change_t"] is not None else "no change"
+    return head + (f"first {_fmt(s['first'])} ({_ts(s['first_t'])}) → last {_fmt(s['last'])} ({_ts(s['last_t'])}), "
+                   f"min {_fmt(s['min'])}, max {_fmt(s['max'])}, slope {s['slope_per_h']:+.3g}/h, "
+                   f"last change {changed}, n={s['n']}")
+
+
+def summarize_trend(trend, budget_tokens=DEFAULT_BUDGET, now=None):
+    """PatientTrend を budget_tokens 以内の要約テキストにする"""
+    if not len(trend):
+        return "No Data"
+    times = trend.times
+    end = times.max() if now is None else np.datetime64(now, "ns")
+    stats = {name: column_stats(times, trend.column(name)) for name in COLUMN_NAMES}
+
+    lines = [f"Records: {len(trend)} ({_ts(times.min())} → {_ts(times.max())})"]
+    # Data Audit: 重要パラメータの欠損・未更新は予算に関係なく必ず載せる
+    audit = []
+    for name in COLUMN_NAMES:
+        if not COLUMNS_BY_NAME[name].audit:
+            continue
+        s = stats[name]
+        if s is None:
+            audit.append(f"{name}: MISSING")
+        else:
+            age = (end - s["last_t"]).astype("timedelta64[m]").astype(np.float64) / 60
+            if age > STALE_HOURS:
+                audit.append(f"{name}: STALE (last {age:.0f}h ago)")
+    if audit:
+        lines.append("⚠️ Data Audit: " + ", ".join(audit))
+
+    order = [n for n in PRIORITY if stats.get(n)] + [n for n in COLUMN_NAMES if stats[n] and n not in PRIORITY]
+    # 1巡目: 全パラメータを簡略行で載せる (網羅優先)、2巡目: 優先順に詳細行へ格上げ
+    used = estimate_tokens("\n".join(lines)) + 12  # 省略注記ぶんを確保
+    body = {}
+    for name in order:
+        line = _line(name, stats[name], compact=True)
+        cost = estimate_tokens(line)
+        if used + cost > budget_tokens:
+            break
+        body[name] = line
+        used += cost
+    for name in body:
+        full = _line(name, stats[name])
+        extra = estimate_tokens(full) - estimate_tokens(body[name])
+        if used + extra <= budget_tokens:
+            body[name] = full
+            used += extra
+    lines.extend(body.values())
+    omitted = [n for n in order if n not in body]
+    if omitted:
+        lines.append(f"(omitted for budget: {', '.join(omitted)})")
+    return "\n".join(lines)
@@ -0,0 +1,188 @@
+"""3つの画面 (app.py / app_pro.py / research.py) で共通のスタイルとサイドバー部品
+
+表示文言は ja (Stable・研究) / en (PRO モニター風) の2種類。
+重いモジュール (genai・pandas・PIL・DDGS) はここでは読み込まない。
+"""
+import streamlit as st
+
+from core.llm import MODE as LLM_MODE, configure, get_llm_cache
+from core.model_catalog import default_model_index, get_catalog
+
+# ==========================================
+# スタイル
+# ==========================================
+_FOOTER = """
+    .footer {
+        position: fixed; left: 0; bottom: 0; width: 100%;
+        background-color: #0E1117; color: #FAFAFA;
+        text-align: center; padding: 10px; font-weight: bold;
+        border-top: 1px solid #444; z-index: 100; font-family: sans-serif;
+    }
+    .block-container { padding-bottom: 80px; }
+"""
+
+STYLE_RESEARCH = _FOOTER
+
+STYLE_STABLE = _FOOTER + """
+    /* スマホで見やすいように調整 */
+    p, li { font-size: 16px !important; }
+    .stAlert { font-weight: bold; }
+"""
+
+# 医療用モニター風
+STYLE_PRO = """
+    /* 全体背景：漆黒 */
+    .stApp { background-color: #000000; color: #FFFFFF; }
+
+    /* 基本テキスト */
+    h1, h2, h3, h4, h5, h6, p, li, span, div { color: #E0E0E0 !important; }
+    label, .stTextInput label, .stNumberInput label, .stTextArea label { color: #FFFFFF !important; font-weight: bold !important; }
+
+    /* サイドバー */
+    [data-testid="stSidebar"] { background-color: #111111; border-right: 1px solid #333; }
+    [data-testid="stSidebar"] * { color: #CCCCCC !important; }
+
+    /* メトリックカード（数値表示部） */
+    div[data-testid="metric-container"] {
+        background-color: #1E1E1E; border: 1px solid #444;
+        padding: 10px; border-radius: 5px;
+        box-shadow: 0 0 10px rgba(0, 255, 255, 0.1);
+    }
+    div[data-testid="metric-container"] label { color: #AAAAAA !important; }
+    div[data-testid="metric-container"] div[data-testid="stMetricValue"] { color: #00FFFF !important; }
+
+    /* 入力ボックス & セレクトボックスの強制ダークモード化 */
+    .stNumberInput input, .stTextInput input, .stTextArea textarea {
+        background-color: #222222 !important; color: #FFFFFF !important; border: 1px solid #555 !important;
+    }
+
+    /* ドロップダウンメニューの背景を黒くする */
+    div[data-baseweb="select"] > div {
+        background-color: #222222 !important;
+        border-color: #555 !important;
+    }
+    div[data-baseweb="popover"], div[data-baseweb="menu"], ul {
+        background-color: #111111 !important;
+    }
+    div[role="option"] span, li[role="option"] span, div[data-baseweb="menu"] li {
+        color: #FFFFFF !important;
+    }
+    div[data-baseweb="tag"] {
+        background-color: #333333 !important;
+        border: 1px solid #00FFFF !important;
+    }
+
+    /* フッター */
+    .footer {
+        position: fixed; left: 0; bottom: 0; width: 100%;
+        background-color: #000000; color: #555 !important;
+        text-align: center; padding: 5px; font-size: 12px;
+        border-top: 1px solid #333; z-index: 100; font-family: sans-serif;
+    }
+    .block-container { padding-bottom: 80px; }
+"""
+
+
+def apply_style(css, footer):
+    st.markdown(f'<style>{css}</style>\n<div class="footer">{footer}</div>', unsafe_allow_html=True)
+
+
+# ==========================================
+# サイドバー
+# ==========================================
+LABELS = {
+    "ja": {
+        "model_cache": "モデル一覧キャッシュ: hit {hits} / miss {misses}",
+        "replay": "🔁 リプレイモード (記録済み応答のみ)",
+        "llm_cache": "♻️ 応答キャッシュ",
+        "llm_cache_stats": "応答キャッシュ: {entries}件 / hit {hits} / miss {misses}",
+        "offline": "📴 オフライン (検索キャッシュのみ)",
+        "search_cache_stats": "検索キャッシュ: {entries}件 / hit {hits} / miss {misses}",
+        "trace": "⏱️ 性能パネル (ステージ別 p50 / p95)",
+        "trace_last": "直近の回数",
+        "trace_empty": "まだ記録がありません",
+    },
+    "en": {
+        "model_cache": "MODEL CACHE: hit {hits} / miss {misses}",
+        "replay": "🔁 LLM REPLAY MODE (no network)",
+        "llm_cache": "♻️ LLM RESPONSE CACHE",
+        "llm_cache_stats": "LLM CACHE: {entries} entries / hit {hits} / miss {misses}",
+        "offline": "📴 OFFLINE (Search Cache Only)",
+        "search_cache_stats": "SEARCH CACHE: {entries} entries / hit {hits} / miss {misses}",
+        "trace": "⏱️ PERFORMANCE PANEL (p50 / p95 per stage)",
+        "trace_last": "LAST N RUNS",
+        "trace_empty": "No runs recorded yet",
+    },
+}
+
+
+def api_key_input(secret_names=("GEMINI_API_KEY",), loaded="🔑 API Key Loaded"):
+    """secrets の先頭から順に探し、無ければ入力欄"""
+    for name in secret_names:
+        try:
+            api_key = st.secrets.get(name)
+        except Exception:
+            # secrets.toml が無い
+            api_key = None
+        if api_key:
+            st.success(loaded)
+            return api_key
+    return st.text_input("Gemini API Key", type="password")
+
+
+def model_select(api_key, preferred, label, error="Model Error"):
+    """(選択したモデル, モデル一覧)。genai はここで初めて読み込まれる"""
+    configure(api_key)
+    try:
+        model_list = get_catalog().get(api_key)
+        return st.selectbox(label, model_list, index=default_model_index(model_list, preferred)), model_list
+    except Exception:
+        st.error(error)
+        return None, []
+
+
+def model_cache_caption(lang="ja"):
+    stats = get_catalog().stats()
+    st.caption(LABELS[lang]["model_cache"].format(hits=stats["hits"] + stats["stale_hits"], misses=stats["misses"]))
+
+
+def llm_cache_control(lang="ja", help=None):
+    """応答キャッシュの切り替えと統計。使う llm_mode を返す"""
+    labels = LABELS[lang]
+    mode = LLM_MODE
+    if LLM_MODE == "replay":
+        st.warning(labels["replay"])
+    elif not st.checkbox(labels["llm_cache"], value=LLM_MODE == "cache", help=help):
+        mode = "off"
+    stats = get_llm_cache().stats()
+    st.caption(labels["llm_cache_stats"].format(**stats))
+    return mode
+
+
+def search_cache_control(lang="ja"):
+    """検索のオフライン切り替えと統計・レート制限。offline を返す"""
+    from core.search import get_search
+    from core.throttle import throttle_caption
+    labels = LABELS[lang]
+    offline = st.checkbox(labels["offline"], value=get_search().offline)
+    stats = get_search().stats()
+    st.caption(labels["search_cache_stats"].format(**stats))
+    st.caption(throttle_caption())
+    return offline
+
+
+def trace_panel(app, lang="ja"):
+    """core.tracing のステージ別 p50 / p95 (表示するかはユーザーが選ぶ)"""
+    from core.tracing import HISTORY, get_tracer
+    labels = LABELS[lang]
+    if not st.toggle(labels["trace"], value=False, key="trace_panel"):
+        return
+    last = st.slider(labels["trace_last"], min_value=5, max_value=HISTORY, value=20, step=5, key="trace_last")
+    tracer = get_tracer()
+    rows = tracer.stats(app, last=last)
+    if rows:
+        st.dataframe(rows, hide_index=True)
+    else:
+        st.caption(labels["trace_empty"])
+    if tracer.path:
+        st.caption(f"log: {tracer.path}")
@@ -0,0 +1,127 @@
+"""病棟一覧 (全患者の最新値 + 悪化スコア)
+
+全患者のトレンドを1本の行列に連結し、列ごとの「直近の有効値の位置」を
+np.maximum.accumulate で一度に求める。患者ごとの Python ループで評価しない。
+スコアは帯域表 (SCORE_BANDS) と変化量表 (TREND_RULES) をベクトル演算で足し合わせる。
+"""
+from datetime import datetime
+
+import numpy as np
+
+from core.schema import COLUMN_INDEX
+
+WARD_COLUMNS = ("P/F", "O2ER", "Lactate", "Flow_Ratio", "AG")
+LOOKBACK = np.timedelta64(6, "h")
+
+# 列: (向き, (閾値, 点数), ...)  閾値の厳しい順。該当した最も高い点数を採る
+SCORE_BANDS = {
+    "P/F": ("low", (100, 3), (200, 2), (300, 1)),
+    "O2ER": ("high", (40, 2), (30, 1)),
+    "Lactate": ("high", (4, 3), (2, 2)),
+    "Flow_Ratio": ("low", (60, 2)),
+    "AG": ("high", (20, 2), (16, 1)),
+}
+# 列, LOOKBACK 前からの変化量 (符号が悪化方向), 点数, 表示
+TREND_RULES = (
+    ("Lactate", 1.0, 2, "Lac↑"),
+    ("P/F", -50.0, 1, "P/F↓"),
+    ("O2ER", 10.0, 1, "O2ER↑"),
+)
+
+
+def _stack(trends):
+    """{患者ID: PatientTrend} → (ids, 連結時刻, 連結行列, 各患者の開始位置)"""
+    ids = [pid for pid, trend in trends.items() if len(trend)]
+    if not ids:
+        return ids, None, None, None
+    parts = [trends[pid] for pid in ids]
+    lengths = np.fromiter((len(t) for t in parts), dtype=np.int64, count=len(parts))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    times = np.concatenate([t.times for t in parts]).astype(np.int64)
+    data = np.concatenate([t.matrix() for t in parts], axis=1)
+    return ids, times, data, starts
+
+
+def _values_at(data, last_valid, rows, starts):
+    """rows (患者ごとの行位置) 時点での各列の直近有効値。患者をまたいだ値は NaN"""
+    idx = last_valid[:, rows]
+    ok = (rows >= starts) & (idx >= starts)
+    out = np.take_along_axis(data, np.maximum(idx, 0), axis=1)
+    return np.where(ok, out, np.nan)
+
+
+def latest_values(trends, lookback=LOOKBACK):
+    """患者ごとの最新値と lookback 前の値 (どちらも {列名: 配列}) と最終記録時刻を返す"""
+    ids, times, data, starts = _stack(trends)
+    if not ids:
+        return ids, {}, {}, np.array([], dtype="datetime64[ns]"), np.array([], dtype=np.int64)
+    n = data.shape[1]
+    ends = np.append(starts[1:], n) - 1
+    # 列ごとに「その行までで最後に値があった行」(患者の境界は _values_at で弾く)
+    positions = np.where(np.isnan(data), -1, np.arange(n))
+    last_valid = np.maximum.accumulate(positions, axis=1)
+
+    # 患者ごとに lookback 前の行: 患者番号を上位に持たせた単調キーで一括 searchsorted
+    seg = np.repeat(np.arange(len(ids)), np.diff(np.append(starts, n)))
+    back = int(lookback.astype("timedelta64[ns]").astype(np.int64))
+    t0 = times.min()
+    span = int(times.max() - t0) + back + 1
+    key = seg * span + (times - t0)
+    target = np.arange(len(ids)) * span + (times[ends] - t0 - back)
+    prev_rows = np.searchsorted(key, target, side="right") - 1
+
+    latest = _values_at(data, last_valid, ends, starts)
+    previous = _values_at(data, last_valid, prev_rows, starts)
+    cols = {name: latest[j] for name, j in COLUMN_INDEX.items()}
+    prev = {name: previous[j] for name, j in COLUMN_INDEX.items()}
+    return ids, cols, prev, times[ends].astype("datetime64[ns]"), np.diff(np.append(starts, n))
+
+
+def score(latest, previous):
+    """悪化スコアと該当項目の文字列 (どちらも患者数ぶんの配列)"""
+    m = len(next(iter(latest.values())))
+    total = np.zeros(m)
+    flags = np.full(m, "", dtype=object)
+    with np.errstate(invalid="ignore"):
+        for name, (direction, *bands) in SCORE_BANDS.items():
+            v = latest[name]
+            points = np.zeros(m)
+            label = np.full(m, "", dtype=object)
+            for threshold, pts in reversed(bands):
+                hit = v < threshold if direction == "low" else v > threshold
+                points = np.where(hit, pts, points)
+                label = np.where(hit, f"{name}{'<' if direction == 'low' else '>'}{threshold} ", label)
+            total += points
+            flags = flags + label
+        for name, delta, pts, text in TREND_RULES:
+            change = latest[name] - previous[name]
+            hit = change <= delta if delta < 0 else change >= delta
+            total += np.where(hit, pts, 0)
+            flags = flags + np.where(hit, text + " ", "")
+    return total, np.char.strip(flags.astype(str))
+
+
+def ward_overview(trends, now=None, lookback=LOOKBACK):
+    """病棟一覧の DataFrame (スコア降順)"""
+    import pandas as pd
+    ids, latest, previous, last_time, counts = latest_values(trends, lookback)
+    if not ids:
+        return pd.DataFrame(columns=["Patient", "Score", "Flags", *WARD_COLUMNS])
+    total, flags = score(latest, previous)
+    now = np.datetime64(now or datetime.now(), "ns")
+    frame = pd.DataFrame({
+        "Patient": ids,
+        "Score": total.astype(int),
+        "Flags": flags,
+        **{name: latest[name] for name in WARD_COLUMNS},
+        "ΔLactate": latest["Lactate"] - previous["Lactate"],
+        "Updated (min)": (now - last_time).astype("timedelta64[s]").astype(np.int64) // 60,
+        "Records": counts,
+    })
+    return frame.sort_values(["Score", "Lactate"], ascending=[False, False], na_position="last").reset_index(drop=True)
+
+
+def store_overview(store, now=None, lookback=LOOKBACK):
+    """TrendStore / SQLiteTrendStore の全患者について ward_overview"""
+    return ward_overview({pid: store.get(pid) for pid in store.patients()}, now=now, lookback=lookback)
+
@@ -1,24 +1,19 @@
 import streamlit as st
-import google.generativeai as genai
-from duckduckgo_search import DDGS
+from core.search import OfflineCacheMiss
+from core.llm import generate_text, MODE as LLM_MODE
+from core.ui import (STYLE_RESEARCH, apply_style, api_key_input, model_select, model_cache_caption, llm_cache_control,
+                     search_cache_control, trace_panel)
+from core.tracing import get_tracer
+from core.research import (SEARCH_WORKERS, ANALYSIS_WORKERS, build_prompt, format_context, search_literature,
+                           search_fanout, translate_prompt,
+                           parse_queries, job_id, progress_path, load_progress, run_batch, results_table, batch_report)
 
 # ==========================================
 # 0. アプリ設定
 # ==========================================
 st.set_page_config(page_title="K's Research Assistant", layout="wide", page_icon="🎓")
 
-st.markdown(f"""
-    <style>
-    .footer {{
-        position: fixed; left: 0; bottom: 0; width: 100%;
-        background-color: #0E1117; color: #FAFAFA;
-        text-align: center; padding: 10px; font-weight: bold;
-        border-top: 1px solid #444; z-index: 100; font-family: sans-serif;
-    }}
-    .block-container {{ padding-bottom: 80px; }}
-    </style>
-    <div class="footer">K's Research Assistant | Global Academic Mode</div>
-    """, unsafe_allow_html=True)
+apply_style(STYLE_RESEARCH, "K's Research Assistant | Global Academic Mode")
 
 st.title("🎓 K's Research Assistant")
 st.caption("研究・論文検索支援システム (全世界対応版)")
@@ -27,34 +22,21 @@ st.caption("研究・論文検索支援システム (全世界対応版)")
 # 1. サイドバー
 # ==========================================
 selected_model_name = None
+llm_mode = LLM_MODE
 
 with st.sidebar:
     st.header("⚙️ 設定")
-    try:
-        # 研究用キーがあれば優先
-        api_key = st.secrets.get("GEMINI_API_KEY_RESEARCH", None)
-        if not api_key:
-            api_key = st.secrets.get("GEMINI_API_KEY", None)
-        
-        if not api_key:
-            api_key = st.text_input("Gemini API Key", type="password")
-        else:
-            st.success("API Key Loaded!")
-    except:
-        api_key = st.text_input("Gemini API Key", type="password")
-
+    # 研究用キーがあれば優先
+    api_key = api_key_input(("GEMINI_API_KEY_RESEARCH", "GEMINI_API_KEY"), loaded="API Key Loaded!")
     if api_key:
-        genai.configure(api_key=api_key)
-        try:
-            model_list = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-            # Flashを優先 (連打対策)
-            default_index = 0
-            for i, m_name in enumerate(model_list):
-                if "gemini-1.5-flash" in m_name:
-                    default_index = i
-                    break
-            selected_model_name = st.selectbox("使用AIモデル", model_list, index=default_index)
-        except: st.error("モデルエラー")
+        # Flashを優先 (連打対策)
+        selected_model_name, _ = model_select(api_key, "gemini-1.5-flash", "使用AIモデル", error="モデルエラー")
+        model_cache_caption()
+        llm_mode = llm_cache_control()
+
+    st.markdown("---")
+    offline_mode = search_cache_control()
+    trace_panel("research")
 
 # ==========================================
 # 2. メイン入力エリア
@@ -77,6 +59,24 @@ with col2:
         value="DECIDE-AI clinical implementation nature"
     )
 
+fanout_mode = st.toggle("🔀 マルチクエリ展開 (原文 + 英訳 + PubMed/Nature を並列検索 → 重複除去 → テーマで再ランキング)",
+                        value=False)
+
+
+def translate_query(query, trace):
+    with trace.span("translate"):
+        return generate_text(selected_model_name, translate_prompt(query), mode=llm_mode, api_key=api_key, kind="short")
+
+
+def run_search(query, trace):
+    """(検索結果, FanOutResult)。展開モードなら上位 MAX_RESULTS 件に絞った results、そうでなければ1回の検索"""
+    with trace.span("search", fanout=fanout_mode) as attrs:
+        if fanout_mode:
+            fanout = search_fanout(query, my_theme, translate=lambda q: translate_query(q, trace), offline=offline_mode)
+            attrs.update(raw=fanout.raw, unique=fanout.unique)
+            return fanout.results, fanout
+        return search_literature(query, offline=offline_mode), None
+
 # ==========================================
 # 3. 分析ロジック (世界検索・直球版)
 # ==========================================
@@ -88,62 +88,109 @@ if st.button("🚀 検索 & 分析開始", type="primary"):
         
         # ★修正：入力された文字をそのまま使う（勝手に加工しない）
         final_query = search_query.strip()
+        # ステージ別の所要時間を記録 (サイドバーの性能パネル・traces/spans.jsonl)
+        trace = get_tracer().start("research", model=selected_model_name, fanout=fanout_mode)
         
         try:
             # ★修正：最初から「世界全体 (wt-wt)」で探す
             # これなら英語論文も、日本の論文も両方ヒットします
             with st.spinner(f"世界中の文献を検索中... ({final_query})"):
-                with DDGS() as ddgs:
-                    # HTMLモードでブロック回避しつつ、地域制限なしで検索
-                    results = list(ddgs.text(final_query, region='wt-wt', max_results=5, backend='html'))
-                    
-                    if not results:
-                        st.error("❌ 検索結果が見つかりませんでした。キーワードの綴りを確認してください。")
-                        st.stop()
-
-                    for i, r in enumerate(results):
-                        search_context += f"【文献{i+1}】\nTitle: {r['title']}\nURL: {r['href']}\nSummary: {r['body']}\n\n"
-
+                # HTMLモードでブロック回避しつつ、地域制限なしで検索 (同一クエリはキャッシュから)
+                results, fanout = run_search(final_query, trace)
+                
+                if not results:
+                    st.error("❌ 検索結果が見つかりませんでした。キーワードの綴りを確認してください。")
+                    trace.finish()
+                    st.stop()
+
+                search_context = format_context(results)
+
+        except OfflineCacheMiss as e:
+            st.error("📴 オフラインモード: このキーワードの検索結果はキャッシュにありません。")
+            trace.finish(e)
+            st.stop()
         except Exception as e:
             st.error(f"検索システムエラー: {e}")
+            trace.finish(e)
             st.stop()
 
         # 分析実行 (AI)
-        prompt = f"""
-        あなたは優秀な大学院生の研究パートナーです。
-        以下の検索結果を読み込み、「ユーザーの研究テーマ」に対する有用性を分析してください。
-
-        【ユーザーの研究テーマ】
-        {my_theme}
-
-        【検索キーワード】
-        {final_query}
-
-        【検索された文献リスト】
-        {search_context}
-
-        【命令】
-        1. 検索結果に含まれる情報を事実として扱うこと。
-        2. 英語の文献であっても、解説は日本語で行うこと。
-        3. 論文が見つかった場合は、その要点と研究への活かし方を解説すること。
-
-        【出力フォーマット】
-        ## 📊 検索結果レポート
-        ### 1. ヒットした主要文献
-        - **[タイトル]** (URL)
-            - 📝 **要約**: 
-        ### 2. 研究への活用ポイント
-        """
+        prompt = build_prompt(my_theme, final_query, search_context)
         
         try:
-            model = genai.GenerativeModel(selected_model_name)
-            with st.spinner("分析中..."):
-                response = model.generate_content(prompt)
+            with st.spinner("分析中..."), trace.span("llm_total"):
+                response_text = generate_text(selected_model_name, prompt, mode=llm_mode, api_key=api_key)
             
-            st.markdown(response.text)
+            with trace.span("render"):
+                st.markdown(response_text)
             
             with st.expander("📚 参照した文献ソース"):
+                if fanout is not None:
+                    st.caption(f"{len(fanout.variants)} クエリ / {fanout.raw} 件 → 重複除去 {fanout.unique} 件 → "
+                               f"上位 {len(fanout.results)} 件 ({fanout.elapsed * 1000:.0f} ms)")
+                    st.dataframe(fanout.variants, hide_index=True)
                 st.text(search_context)
 
         except Exception as e:
             st.error(f"AIエラー: {e}")
+            trace.finish(e)
+        trace.finish()
+
+# ==========================================
+# 4. バッチモード (CSV / テキストの一括検索)
+# ==========================================
+st.markdown("---")
+with st.expander("📚 バッチモード (文献レビュー用: 複数クエリを一括で検索 & 分析)"):
+    batch_file = st.file_uploader("クエリ一覧 (CSV の query 列 / テキスト1行1件)", type=["csv", "txt"], key="batch_file")
+    b1, b2 = st.columns(2)
+    search_workers = b1.number_input("検索の並列数", min_value=1, max_value=8, value=SEARCH_WORKERS,
+                                     help="検索サイトのブロックを避けるため少なめに (レート制限も共有)")
+    analysis_workers = b2.number_input("分析の並列数", min_value=1, max_value=16, value=ANALYSIS_WORKERS)
+    batch_queries = parse_queries(batch_file.getvalue(), batch_file.name) if batch_file else []
+    if batch_queries:
+        job = job_id(my_theme, selected_model_name, batch_queries)
+        path = progress_path(job)
+        saved = sum(1 for r in load_progress(path).values() if r["status"] == "ok")
+        st.caption(f"{len(batch_queries)} 件 / ジョブ {job}" + (f" (保存済み {saved} 件は再開時にスキップ)" if saved else ""))
+
+    if st.button("🚀 バッチ実行", disabled=not batch_queries):
+        if not api_key:
+            st.error("APIキーを入れてください")
+        else:
+            # 1クエリ = 1 trace (検索と分析は別スレッドで、記録は on_record で閉じる)
+            traces = {}
+
+            def batch_trace(query):
+                if query not in traces:
+                    traces[query] = get_tracer().start("research", model=selected_model_name, fanout=fanout_mode, batch=True)
+                return traces[query]
+
+            def search(query):
+                return run_search(query, batch_trace(query))[0]
+
+            def analyze(query, results):
+                prompt = build_prompt(my_theme, query, format_context(results))
+                with batch_trace(query).span("llm_total"):
+                    return generate_text(selected_model_name, prompt, mode=llm_mode, api_key=api_key)
+
+            bar = st.progress(0.0, text="開始...")
+
+            def on_record(record, done, total):
+                bar.progress(done / total, text=f"{done}/{total}: {record['query']} ({record['status']})")
+                trace = traces.pop(record["query"], None)
+                if trace is not None:
+                    trace.attrs["status"] = record["status"]
+                    trace.finish()
+
+            result = run_batch(batch_queries, search, analyze, path,
+                               search_workers=int(search_workers), analysis_workers=int(analysis_workers),
+                               on_record=on_record)
+            bar.progress(1.0, text="完了")
+            m1, m2, m3 = st.columns(3)
+            m1.metric("スループット", f"{result.throughput:.1f} q/min")
+            m2.metric("所要時間", f"{result.elapsed:.1f} s")
+            m3.metric("成功", f"{sum(r['status'] == 'ok' for r in result.records)} / {len(result.records)}")
+            st.dataframe(result.stage_stats(), hide_index=True)
+            st.dataframe(results_table(result.records), hide_index=True)
+            st.download_button("📥 Markdown レポート", batch_report(my_theme, result),
+                               file_name=f"research_{job}.md", mime="text/markdown")
@@ -0,0 +1,42 @@
+import io
+
+import pytest
+
+from core.backup import BackupFormatError, export_backup, import_backup
+from core.trend_store import PatientTrend
+
+
+def _trend(n=200):
+    trend = PatientTrend()
+    trend.extend([{"Time": f"2026-03-01 {i // 60:02d}:{i % 60:02d}:00", "PaO2": 60.0 + i % 40} for i in range(n)])
+    return trend
+
+
+@pytest.mark.parametrize("fmt", ["NDJSON.gz", "Parquet"])
+def test_round_trip(fmt):
+    restored = PatientTrend()
+    report = import_backup(io.BytesIO(export_backup(_trend(), fmt)), restored)
+    assert report.rows_added == 200 and restored.column("PaO2")[:3].tolist() == [60.0, 61.0, 62.0]
+
+
+@pytest.mark.parametrize("fmt, cut", [("NDJSON.gz", 0.5), ("NDJSON.gz", 0.9), ("Parquet", 0.5), ("Parquet", 0.1)])
+def test_truncated_file_raises_backup_format_error(fmt, cut):
+    data = export_backup(_trend(), fmt)
+    with pytest.raises(BackupFormatError):
+        import_backup(io.BytesIO(data[:int(len(data) * cut)]), PatientTrend())
+
+
+@pytest.mark.parametrize("data", [
+    b"\x1f\x8b" + b"\x00" * 30,                     # gzip ヘッダーが壊れている
+    b"PAR1" + b"\x00" * 64 + b"PAR1",               # Parquet のフッターが壊れている
+])
+def test_corrupt_header_raises_backup_format_error(data):
+    with pytest.raises(BackupFormatError):
+        import_backup(io.BytesIO(data), PatientTrend())
+
+
+def test_corrupt_gzip_body_raises_backup_format_error():
+    data = bytearray(export_backup(_trend(), "NDJSON.gz"))
+    data[len(data) // 2:len(data) // 2 + 16] = b"\xff" * 16
+    with pytest.raises(BackupFormatError):
+        import_backup(io.BytesIO(bytes(data)), PatientTrend())
@@ -0,0 +1,25 @@
+from core.batch_diagnosis import Options, load_results, run_batch
+
+
+def _diagnose(path, data, history, labs, opts):
+    return {"history": history, "labs": labs, "size": len(data)}
+
+
+def test_broken_notes_only_fail_their_own_file(tmp_path):
+    files = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.json"
+        path.write_text("{}", encoding="utf-8")
+        files.append(str(path))
+    (tmp_path / "a.notes.json").write_text('{"history": "VV-ECMO day 2"}', encoding="utf-8")
+    (tmp_path / "b.notes.json").write_text('{"history": ', encoding="utf-8")
+    (tmp_path / "c.notes.json").write_text('["not", "an", "object"]', encoding="utf-8")
+    out = tmp_path / "results.ndjson"
+
+    result = run_batch(files, str(out), Options(), workers=2, diagnose=_diagnose)
+
+    status = {r["patient_id"]: r["status"] for r in result.records}
+    assert status == {"a": "ok", "b": "error", "c": "error"}
+    assert result.records[0]["history"] == "VV-ECMO day 2"
+    assert "JSONDecodeError" in result.records[1]["error"]
+    assert [r["file"] for r in load_results(str(out)).values()] == [files[0]]
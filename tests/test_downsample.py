@@ -0,0 +1,41 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.downsample import CHART_WIDTH_PX, _Tiers, downsample_view, target_points
+from core.simulator import simulate
+
+CHART_COLUMNS = ["P/F", "DO2", "VO2", "O2ER", "Lactate", "Hb", "pH", "SvO2", "AG", "CO", "SpO2", "ECMO_Flow"]
+
+
+def _frame(hours, interval=60.0):
+    patient = next(simulate(1, hours, interval, "sepsis_shunt", seed=0))
+    return pd.DataFrame(patient.columns, index=pd.DatetimeIndex(patient.times))
+
+
+def test_tiers_shrink_with_many_columns():
+    rng = np.random.default_rng(0)
+    for n in (4320, 200_000):
+        x = np.arange(n, dtype=np.float64)
+        tiers = _Tiers(x, {f"c{i}": rng.normal(size=n) for i in range(12)})
+        sizes = [n] + [len(t) for t in tiers.tiers]
+        assert all(b <= a // 2 for a, b in zip(sizes, sizes[1:]))
+
+
+def test_downsample_view_twelve_columns_all_range():
+    frame = _frame(72)
+    t0 = time.perf_counter()
+    view = downsample_view(frame, CHART_COLUMNS, ("test", "12cols"), 0)
+    assert time.perf_counter() - t0 < 5
+    assert 0 < len(view) <= len(frame)
+    assert view.index.is_monotonic_increasing
+
+
+def test_downsample_view_keeps_lactate_peak():
+    frame = _frame(24 * 14)
+    frame.iloc[len(frame) // 3, frame.columns.get_loc("Lactate")] = 25.0
+    view = downsample_view(frame, CHART_COLUMNS, ("test", "peak"), 0)
+    assert len(view) < len(frame)
+    assert view["Lactate"].max() == 25.0
+    assert len(view) <= len(CHART_COLUMNS) * 2 * target_points(CHART_WIDTH_PX) + 2 * len(CHART_COLUMNS)
@@ -0,0 +1,15 @@
+from core.fanout import SITE_FILTERS, fan_out_search
+
+
+def test_translation_is_expanded_with_site_filters():
+    seen = []
+
+    def search(q):
+        seen.append(q)
+        return [{"title": q, "href": f"https://example.org/{len(seen)}", "body": q}]
+
+    out = fan_out_search("敗血症 ECMO", "sepsis", search, translate=lambda q: "sepsis ECMO")
+    english = ["sepsis ECMO"] + [f"sepsis ECMO site:{site}" for site in SITE_FILTERS]
+    assert set(english) <= set(seen)
+    assert [v["query"] for v in out.variants][-len(english):] == english
+    assert len(out.variants) == len(seen) == 2 * (1 + len(SITE_FILTERS))
@@ -0,0 +1,70 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from core.ingest import FeedManager, LineParser, PatientFeed, trend_sink
+from core.schema import TIME_COLUMN
+from core.trend_store import TrendStore
+from core.trend_summary import summarize_trend
+
+
+def test_bad_timestamp_only_drops_its_own_line():
+    parser = LineParser()
+    records = parser.parse([
+        f"{TIME_COLUMN},SpO2",
+        "2026-03-01T10:00:00,95",
+        "not-a-time,96",
+        '{"ts": "2026-03-01T10:00:02", "SpO2": 97}',
+        '{"ts": "10:00:xx", "SpO2": 98}',
+    ])
+    assert [r is None for r in records] == [False, True, False, True]
+    feed = PatientFeed()
+    feed.ingest_many([r for r in records if r is not None] + [{"ts": "garbage", "SpO2": 1}])
+    assert feed.samples == 2 and feed.errors == 1
+
+
+def test_minute_frame_uses_naive_local_time():
+    feed = PatientFeed()
+    start = datetime(2026, 3, 1, 8, 0)
+    feed.ingest_many([{TIME_COLUMN: (start + pd.Timedelta(minutes=i)).isoformat(), "SpO2": 90 + i} for i in range(3)])
+    df = feed.minute_frame()
+    assert df.index.tz is None
+    assert list(df.index) == [pd.Timestamp(start), pd.Timestamp(start) + pd.Timedelta(minutes=1)]
+    assert df["SpO2"].tolist() == [90.0, 91.0]
+
+
+def test_start_file_raises_for_missing_path(tmp_path):
+    feeds = FeedManager()
+    with pytest.raises(OSError):
+        feeds.start_file("p1", str(tmp_path / "missing.csv"))
+    assert feeds.source("p1") is None
+
+
+def test_closed_minutes_reach_the_trend_store():
+    store = TrendStore()
+    feed = PatientFeed()
+    feed.sink = trend_sink(store, "p1")
+    start = datetime(2026, 3, 1, 8, 0)
+    feed.ingest_many([{TIME_COLUMN: (start + pd.Timedelta(seconds=s)).isoformat(), "Lactate": 2.0 + s // 60}
+                      for s in range(0, 180, 10)])
+    trend = store.get("p1")
+    # 進行中の3分目はまだ書かない
+    assert trend.times.astype("datetime64[m]").astype(str).tolist() == ["2026-03-01T08:00", "2026-03-01T08:01"]
+    assert trend.column("Lactate").tolist() == [2.0, 3.0]
+    assert "Lactate" in summarize_trend(trend)
+
+
+def test_error_counter_is_updated_under_the_lock():
+    feed = PatientFeed()
+    feed.lock.acquire()
+    try:
+        worker = threading.Thread(target=feed.ingest_many, args=([{"ts": "garbage"}],))
+        worker.start()
+        worker.join(0.2)
+        assert worker.is_alive() and feed.errors == 0
+    finally:
+        feed.lock.release()
+    worker.join()
+    assert feed.errors == 1
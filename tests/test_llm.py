@@ -0,0 +1,21 @@
+from core.disk_cache import DiskCache
+from core.llm import LLMCache
+
+
+def test_llm_cache_counts_hits_and_misses(tmp_path):
+    cache = LLMCache(DiskCache(str(tmp_path / "llm.sqlite")))
+    cache.record("misses")
+    cache.record("hits")
+    cache.record("hits")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["replay_misses"]) == (2, 1, 0)
+
+
+def test_generate_exposes_its_own_call_id(monkeypatch):
+    from core.llm import generate
+    from core.llm_executor import FakeGemini, get_executor
+    monkeypatch.setattr(get_executor(), "call", FakeGemini())
+    call = generate("models/fake", "call id test prompt", mode="off", api_key="test")
+    assert "".join(call)
+    assert call.call_id is not None
+    assert {e["call"] for e in get_executor().events_for(call.call_id)} == {call.call_id}
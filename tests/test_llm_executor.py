@@ -0,0 +1,30 @@
+from core.llm_executor import HEDGE_DEFAULT, HEDGE_MIN_SAMPLES, FakeGemini, LLMExecutor
+
+
+def test_latency_history_is_kept_per_call_kind():
+    ex = LLMExecutor(call=FakeGemini())
+    "".join(ex.generate("m", "keywords", kind="short", hedge=False))
+    "".join(ex.generate("m", "diagnosis", system_instruction="brain", stream=True, hedge=False))
+    "".join(ex.generate("m", "analysis", hedge=False))
+    assert {k for m, k in ex._latency} == {"short", "stream", "text"}
+    assert set(ex.stats("stream")) == {"m"} and ex.stats("stream")["m"]["n"] == 1
+
+
+def test_hedge_delay_ignores_other_kinds():
+    ex = LLMExecutor(call=FakeGemini())
+    for _ in range(HEDGE_MIN_SAMPLES):
+        ex.observe("m", 0.05, "short")
+        ex.observe("m", 30.0, "text")
+    assert ex.hedge_delay("m", "stream") == HEDGE_DEFAULT
+    assert ex.hedge_delay("m", "text") > ex.hedge_delay("m", "short")
+
+
+def test_events_are_filtered_by_call():
+    ex = LLMExecutor(call=FakeGemini())
+    first = ex.generate("m", "one", hedge=False)
+    second = ex.generate("m", "two", hedge=False)
+    "".join(second)
+    "".join(first)
+    mine = ex.events_for(first.call_id)
+    assert mine and {e["call"] for e in mine} == {first.call_id}
+    assert ex.events_for(None) == []
@@ -0,0 +1,67 @@
+import json
+import sqlite3
+
+import numpy as np
+
+from core.patient_store import SCHEMA_VERSION, SQLiteTrendStore
+
+
+def _legacy_db(path, rows):
+    """列 layout のない版 (data は JSON 文字列) の DB"""
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE samples (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id TEXT NOT NULL,"
+        " t INTEGER NOT NULL, data TEXT NOT NULL);"
+        "CREATE INDEX samples_patient_time ON samples (patient_id, t);"
+        "CREATE INDEX samples_patient_id ON samples (patient_id, id);"
+        "CREATE TABLE patients (patient_id TEXT PRIMARY KEY, version INTEGER NOT NULL, generation INTEGER NOT NULL,"
+        " last_id INTEGER NOT NULL, updated REAL NOT NULL);"
+    )
+    conn.executemany("INSERT INTO samples (patient_id, t, data) VALUES (?, ?, ?)",
+                     [(pid, t, json.dumps(values)) for pid, t, values in rows])
+    conn.execute("INSERT INTO patients VALUES ('p1', 2, 1, 2, 0)")
+    conn.commit()
+    conn.close()
+
+
+def test_json_rows_are_migrated_to_blobs(tmp_path):
+    path = str(tmp_path / "patients.sqlite")
+    t0 = np.datetime64("2026-03-01T08:00", "ns").astype(np.int64)
+    _legacy_db(path, [("p1", int(t0), {"PaO2": 80.0, "Unknown": 1.0}),
+                      ("p1", int(t0) + 3_600_000_000_000, {"PaO2": 95.0, "Lactate": 2.5})])
+    store = SQLiteTrendStore(path)
+    try:
+        trend = store.get("p1")
+        assert len(trend) == 2
+        assert trend.column("PaO2").tolist() == [80.0, 95.0]
+        assert np.isnan(trend.column("Lactate")[0]) and trend.column("Lactate")[1] == 2.5
+        store.append("p1", {"Time": "2026-03-01T10:00", "PaO2": 101.0})
+        store.flush()
+        conn = sqlite3.connect(path)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert conn.execute("SELECT count(*) FROM sqlite_master WHERE name = 'samples_json'").fetchone()[0] == 0
+        assert conn.execute("SELECT typeof(data) FROM samples GROUP BY 1").fetchall() == [("blob",)]
+        conn.close()
+    finally:
+        store.close()
+    reopened = SQLiteTrendStore(path)
+    try:
+        assert reopened.get("p1").column("PaO2").tolist() == [80.0, 95.0, 101.0]
+    finally:
+        reopened.close()
+
+
+def test_out_of_order_append_is_stored_in_time_order(tmp_path):
+    path = str(tmp_path / "patients.sqlite")
+    store = SQLiteTrendStore(path)
+    try:
+        store.append("p1", {"Time": "2026-03-01 10:00:00", "PaO2": 100.0})
+        store.append("p1", {"Time": "2026-03-01 08:00:00", "PaO2": 80.0})
+        assert store.get("p1").column("PaO2").tolist() == [80.0, 100.0]
+    finally:
+        store.close()
+    reopened = SQLiteTrendStore(path)
+    try:
+        assert reopened.get("p1").column("PaO2").tolist() == [80.0, 100.0]
+    finally:
+        reopened.close()
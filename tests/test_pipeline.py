@@ -0,0 +1,35 @@
+import time
+
+from core.pipeline import prepare_diagnosis
+
+
+def _search(n, delay):
+    def search(key):
+        for i in range(n):
+            time.sleep(delay)
+            yield f"{key}-{i}"
+    return search
+
+
+def test_budget_uses_results_that_arrived_before_the_deadline():
+    prep = prepare_diagnosis(lambda: "ecmo", _search(10, 0.1), None, lambda: "trend", search_budget=0.35)
+    assert prep.search_key == "ecmo" and not prep.search_complete
+    assert 1 <= len(prep.evidence) < 10
+    snapshot = list(prep.evidence)
+    # 期限後に届いた分は返した結果に書き込まれない
+    time.sleep(0.4)
+    assert prep.evidence == snapshot and not prep.search_complete
+
+
+def test_complete_search_within_budget():
+    prep = prepare_diagnosis(lambda: "ards", _search(3, 0.0), None, lambda: "trend", search_budget=5)
+    assert prep.search_complete and prep.evidence == ["ards-0", "ards-1", "ards-2"] and prep.trend == "trend"
+
+
+def test_late_keywords_leave_an_empty_snapshot():
+    def slow_keywords():
+        time.sleep(0.3)
+        return "late"
+    prep = prepare_diagnosis(slow_keywords, _search(3, 0.0), None, lambda: "trend", search_budget=0.1)
+    time.sleep(0.4)
+    assert prep.search_key == "" and prep.evidence == [] and not prep.search_complete and not prep.search_error
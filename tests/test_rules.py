@@ -0,0 +1,38 @@
+import numpy as np
+
+from core.rules import evaluate_trend
+from core.trend_store import PatientTrend
+
+NOW = np.datetime64("2026-01-10")
+
+
+def _trend(hours, ecmo_from=None, pao2=lambda h: 70.0):
+    trend = PatientTrend()
+    h = np.arange(hours)
+    cols = {"PaO2": np.array([pao2(x) for x in h], dtype=np.float64), "PaCO2": np.full(hours, 40.0)}
+    if ecmo_from is not None:
+        cols["ECMO_Flow"] = np.where(h >= ecmo_from, 4.0, np.nan)
+    trend.extend_arrays(np.datetime64("2026-01-01T00:00") + h * np.timedelta64(1, "h"), cols)
+    return trend
+
+
+def _delta(trend, **kwargs):
+    return [f for f in evaluate_trend(trend, now=NOW, **kwargs) if f.rule == "DELTA_PAO2"]
+
+
+def test_delta_pao2_silent_long_after_ecmo_start():
+    assert _delta(_trend(24 * 5, ecmo_from=0)) == []
+
+
+def test_delta_pao2_silent_without_ecmo():
+    assert _delta(_trend(48)) == []
+
+
+def test_delta_pao2_anchored_on_ecmo_start():
+    found = _delta(_trend(26, ecmo_from=2, pao2=lambda h: 60.0 if h <= 2 else 110.0))
+    assert [(f.severity, f.value) for f in found] == [("info", 50.0)]
+
+
+def test_delta_pao2_explicit_start():
+    found = _delta(_trend(30), ecmo_start=np.datetime64("2026-01-01T05:00"))
+    assert [(f.severity, f.value) for f in found] == [("warning", 0.0)]
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import pytest
+
+import core.disk_cache
+from core.disk_cache import DiskCache
+from core.search import FakeSearchBackend, OfflineCacheMiss, SearchCache
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # core.disk_cache の時計だけを進める (time モジュール全体は差し替えない)
+    monkeypatch.setattr(core.disk_cache, "time", SimpleNamespace(time=clock))
+    return clock
+
+
+def _search(tmp_path, **kwargs):
+    backend = FakeSearchBackend()
+    return backend, SearchCache(backend, DiskCache(str(tmp_path / "search.sqlite")), **kwargs)
+
+
+def test_ttl_expiry_refetches(tmp_path, clock):
+    backend, search = _search(tmp_path, ttl=60)
+    first = search.text("ECMO  Sepsis")
+    clock.now += 30
+    assert search.text("ecmo sepsis") == first
+    assert len(backend.calls) == 1
+    clock.now += 31
+    search.text("ecmo sepsis")
+    assert len(backend.calls) == 2
+    assert search.stats()["hits"] == 1 and search.stats()["misses"] == 2
+
+
+def test_offline_returns_stale_hits_and_raises_on_miss(tmp_path, clock):
+    backend, search = _search(tmp_path, ttl=60, offline=True)
+    with pytest.raises(OfflineCacheMiss):
+        search.text("ARDS prone")
+    assert backend.calls == [] and search.stats()["offline_misses"] == 1
+    first = search.text("ARDS prone", offline=False)
+    clock.now += 3600
+    assert search.text("ARDS prone") == first
+    assert len(backend.calls) == 1
+
+
+def test_lru_evicts_least_recently_accessed(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / "lru.sqlite"), max_entries=2)
+    cache.set("a", b"1")
+    clock.now += 1
+    cache.set("b", b"2")
+    clock.now += 1
+    assert cache.get("a") == b"1"
+    clock.now += 1
+    cache.set("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1" and cache.get("c") == b"3"
+
+
+def test_lru_evicts_by_size(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / "size.sqlite"), max_bytes=10)
+    for key in "abc":
+        clock.now += 1
+        cache.set(key, bytes(4))
+    assert cache.get("a") is None
+    assert cache.stats() == {"entries": 2, "bytes": 8}
+
+
+def test_iter_text_streams_and_caches_only_complete_results(tmp_path, clock):
+    backend, search = _search(tmp_path, ttl=60)
+    items = search.iter_text("vv ecmo", max_results=3)
+    first = next(items)
+    items.close()
+    assert search.cache.stats()["entries"] == 0
+    full = list(search.iter_text("vv ecmo", max_results=3))
+    assert full[0] == first and len(full) == 3
+    assert list(search.iter_text("VV  ECMO", max_results=3)) == full == search.text("vv ecmo", max_results=3)
+    assert len(backend.calls) == 2
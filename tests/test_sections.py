@@ -0,0 +1,44 @@
+import pytest
+
+from core.sections import SECTION_ORDER, SectionParser, parse_sections
+
+TEXTS = [
+    "前置き\n---SECTION_PLAN_EMERGENCY---\n- 送血流量を上げる\n---SECTION_AI_OPINION---\n敗血症の疑い\n"
+    "---SECTION_PLAN_ROUTINE---\n- 血培\n---SECTION_FACT---\nPaO2 62 mmHg\n",
+    # 未知のマーカー以降は次の既知マーカーまで捨てる
+    "---SECTION_AI_OPINION---\nA\n---SECTION_UNKNOWN---\n捨てる\n---SECTION_FACT---\nB ---SECTION",
+    # マーカーに似た文字列・末尾の不完全なマーカー
+    "---SECT ---SECTION_FACT-- x ---SECTION_FACT---\nOK\n---SECTION_PLAN_",
+    "マーカーなし ---",
+]
+
+
+def _snapshot(parser):
+    return ("".join(parser.preamble), {k: parser.text(k) for k in SECTION_ORDER},
+            parser.saw_marker, parser.raw)
+
+
+def _feed(chunks):
+    parser = SectionParser()
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    events += parser.close()
+    return parser, events
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_split_at_every_offset_matches_parse_sections(text):
+    expected = _snapshot(parse_sections(text))
+    for i in range(len(text) + 1):
+        parser, events = _feed([text[:i], text[i:]])
+        assert _snapshot(parser) == expected, i
+        # 逐次イベントをつなぐと最終結果と同じ
+        streamed = {k: "".join(t for s, t in events if s == k).strip() for k in SECTION_ORDER}
+        assert streamed == expected[1], i
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_one_character_chunks_match_parse_sections(text):
+    parser, _ = _feed(list(text))
+    assert _snapshot(parser) == _snapshot(parse_sections(text))
@@ -0,0 +1,55 @@
+import io
+import json
+from datetime import datetime
+
+import numpy as np
+
+from core.backup import import_backup
+from core.trend_store import PatientTrend, parse_time
+
+
+def _sorted(trend):
+    return bool(np.all(trend.times[1:] >= trend.times[:-1]))
+
+
+def test_out_of_order_manual_entry_is_inserted_in_time_order():
+    trend = PatientTrend()
+    trend.extend([{"Time": "2026-03-01 08:00:00", "Lactate": 2.0}, {"Time": "2026-03-01 10:00:00", "Lactate": 4.0}])
+    assert trend.append({"Time": "2026-03-01 09:00:00", "Lactate": 3.0}) == 1
+    assert trend.append({"Time": "2026-03-01 11:00:00", "Lactate": 5.0}) == 3
+    assert _sorted(trend)
+    assert trend.column("Lactate").tolist() == [2.0, 3.0, 4.0, 5.0]
+
+
+def test_extend_arrays_keeps_time_order():
+    trend = PatientTrend()
+    t = np.array(["2026-03-01T10:00", "2026-03-01T08:00", "2026-03-01T09:00"], dtype="datetime64[ns]")
+    trend.extend_arrays(t, {"PaO2": [3.0, 1.0, 2.0]})
+    trend.extend_arrays(t[:1] - np.timedelta64(1, "h"), {"PaO2": [2.5]})
+    assert _sorted(trend)
+    assert trend.column("PaO2").tolist() == [1.0, 2.0, 2.5, 3.0]
+
+
+def test_clock_only_times_follow_the_previous_row():
+    after = np.datetime64("2026-03-01T23:30", "ns")
+    assert parse_time("23:45", after=after) == np.datetime64("2026-03-01T23:45", "ns")
+    assert parse_time("00:15", after=after) == np.datetime64("2026-03-02T00:15", "ns")
+    assert parse_time("08:00") <= np.datetime64(datetime.now(), "ns")
+
+
+def test_legacy_backup_keeps_its_own_timeline():
+    rows = [{"Time": "2026-03-01 22:00:00", "pH": 7.30}, {"Time": "23:00", "pH": 7.25}, {"Time": "01:00", "pH": 7.20}]
+    trend = PatientTrend()
+    import_backup(io.BytesIO(json.dumps(rows).encode("utf-8")), trend)
+    assert trend.times.astype("datetime64[m]").astype(str).tolist() == [
+        "2026-03-01T22:00", "2026-03-01T23:00", "2026-03-02T01:00"]
+    assert trend.column("pH").tolist() == [7.30, 7.25, 7.20]
+
+
+def test_token_is_not_reused_after_gc():
+    seen = set()
+    for _ in range(100):
+        trend = PatientTrend()
+        assert trend.token not in seen
+        seen.add(trend.token)
+        del trend